@@ -2,10 +2,102 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from battery1 import calculate_power_difference
+from battery_kernels import clamped_cumsum
+from day_matrix import local_day_segments, segment_rows, sort_within_segments, store_segments
+from Discharge_battery import discharge_intervals
 import seaborn as sns
 
 
-def charge_battery(battery_capacity, data):
+def charge_intervals(battery_capacity, data, segments=None, store=None):
+    """
+    Select the intervals in which the smart battery charges: every day the cheapest intervals
+    with a PV surplus are charged until the residual load of the next day (limited by the
+    battery capacity) is stored.
+
+    Parameters:
+        battery_capacity (float): The capacity of the battery in kWh.
+        data (DataFrame): Aligned data with 'datetime', 'Euro', 'power_difference_kwh',
+                          'Volume_Afname_kWh' and 'Power_Output_kWh'.
+        segments (tuple): Result of local_day_segments(data['datetime']), computed if None.
+        store (tuple): (matrices, index) of open_day_matrix_store for the same data, or None.
+                       The day layout and the prices are then read from the store.
+
+    Returns:
+        tuple: (rows, entry_days, charge_power, charge_levels, end_levels) with the positions in
+               data of the charged intervals (per day, sorted by hour and by price within an
+               hour), the day of every interval, the charged energy (kWh), the charge level
+               after every interval (kWh) and the charge level at the end of every day (kWh).
+    """
+    # Rows per local day (96 rows, 92 and 100 on the DST days), in the order of groupby('day')
+    if store is not None:
+        matrices, index = store
+        if index['n_rows'] != len(data):
+            raise ValueError(f"The day-matrix store has {index['n_rows']} rows, the data {len(data)}.")
+    if segments is None:
+        segments = local_day_segments(data['datetime']) if store is None else store_segments(index)
+    order, segment_starts, days = segments
+    n_days = len(days)
+    wall_times = pd.DatetimeIndex(data['datetime']).tz_localize(None)[order]
+    hours = wall_times.hour.values
+    if store is not None:
+        # The valid slots of the (days, 100) matrix, row by row, are the rows in the order of segments.
+        # float32 keeps the order and the ties of the prices (two decimals), so the price sort is unchanged
+        euro = matrices['Euro'][np.asarray(index['rows']) >= 0]
+    else:
+        euro = data['Euro'].values[order]
+    power_difference = data['power_difference_kwh'].values[order].astype(float)
+    residual_load = np.clip(data['Volume_Afname_kWh'].values - data['Power_Output_kWh'].values, 0, None)[order]
+
+    # Charging capacity of every day: residual load of the next day, limited by the battery
+    residual_sums = np.empty(n_days)
+    for day_index, rows in segment_rows(segment_starts):
+        residual_sums[day_index] = residual_load[rows].sum(axis=1)
+    temp_capacity = np.zeros(n_days)  # No next day for the last day, so its capacity is 0
+    temp_capacity[:-1] = np.minimum(residual_sums[1:], battery_capacity)
+
+    # Sort every day by price (cheapest to most expensive)
+    by_price = sort_within_segments(euro, segment_starts)
+    values = power_difference[by_price]
+
+    # Add the non-zero power differences in price order until the capacity is reached:
+    # the first interval where the cumulative sum reaches the capacity is reduced to fit and
+    # is the last one charged that day
+    taken = np.zeros(len(values))
+    used = np.zeros(len(values), dtype=bool)
+    for day_index, rows in segment_rows(segment_starts):
+        day_values = values[rows]
+        capacity = temp_capacity[day_index][:, None]
+        cumulative = np.cumsum(day_values, axis=1)
+        nonzero = day_values != 0
+        full = nonzero & (cumulative >= capacity)
+        last = np.where(full.any(axis=1), full.argmax(axis=1), rows.shape[1])[:, None]
+        column = np.arange(rows.shape[1])
+        day_used = nonzero & (column <= last)
+        day_taken = np.where((column == last) & (cumulative > capacity), day_values - (cumulative - capacity), day_values)
+        taken[rows] = np.where(day_used, day_taken, 0)
+        used[rows] = day_used
+
+    # Charged intervals in chronological order of the hour; within an hour they keep the price order
+    day_of_row = np.repeat(np.arange(n_days), np.diff(segment_starts))
+    selected = by_price[used]
+    entry_days = day_of_row[selected]
+    entry_hours = hours[selected]
+    chronological = np.lexsort((entry_hours, entry_days))
+    entry_days = entry_days[chronological]
+    entry_hours = entry_hours[chronological]
+    charge_power = taken[used][chronological]
+
+    # Charge levels as a cumulative sum of the charge power, capped at the capacity of the day
+    entry_starts = np.searchsorted(entry_days, np.arange(n_days + 1))
+    charge_levels = clamped_cumsum(charge_power, entry_starts, upper=temp_capacity)
+    has_entries = np.diff(entry_starts) > 0
+    end_levels = np.where(has_entries, charge_levels[np.maximum(entry_starts[1:] - 1, 0)], 0)
+
+    rows = order[selected[chronological]]
+    return rows, entry_days, charge_power, charge_levels, end_levels
+
+
+def charge_battery(battery_capacity, data, write_excel=True, store=None):
     data = data.copy()  # Create a copy of the input DataFrame to avoid modifying the original
     """
     Determines the hours during which the battery should be charged based on electricity prices and power difference.
@@ -15,6 +107,9 @@ def charge_battery(battery_capacity, data):
         power_output (DataFrame): DataFrame containing power output data.
         belpex_data (DataFrame): DataFrame containing electricity prices.
         load_profile (DataFrame): DataFrame containing the load profile.
+        write_excel (bool): Write charge_schedule.xlsx and end_of_day_charge_levels.xlsx to results/.
+        store (tuple): (matrices, index) of cached_day_matrix_store for data, or None to group the
+                       rows of data per day (see charge_intervals).
 
     Returns:
         dict: A dictionary where keys are days and values are lists of hours to charge the battery.
@@ -48,124 +143,48 @@ def charge_battery(battery_capacity, data):
     data['residual_load'] = data['Volume_Afname_kWh'] - data['Power_Output_kWh']
     data['residual_load'] = data['residual_load'].clip(lower=0)
 
-    grouped = data.groupby('day')
-
-    charge_schedule = {}
-    end_of_day_charge_levels = []  # List to store the charge level at the end of each day
-
-    # Process each day
-    days = list(grouped.groups.keys())  # Get the list of all days
-    for i, day in enumerate(days):
-        group = grouped.get_group(day)
-
-        # Calculate the charging capacity for the day based on the residual load of the next day
-        if i + 1 < len(days):  # Check if there is a next day
-            next_day = days[i + 1]
-            next_day_group = grouped.get_group(next_day)
-            temp_capacity = min(next_day_group['residual_load'].sum(), battery_capacity)
-        else:
-            temp_capacity = 0  # No next day, so set capacity to 0
-
-        # Reset the battery charge at the start of each day
-        current_charge = 0  # Reset the current charge of the battery
-
-        # Sort by price (cheapest to most expensive)
-        sorted_group = group.sort_values(by='Euro')
-
-        charge_hours = []
-        charge_power = []  # List to store the power charged during each hour
-
-        # Iterate through the sorted hours
-        for _, row in sorted_group.iterrows():
-            hour = row['datetime'].hour
-            power_difference1 = row['power_difference_kwh']
-
-            # Only add the hour if power_difference is not 0
-            if power_difference1 != 0:
-                # Add power difference to the total and update current charge
-                current_charge += power_difference1
-                if current_charge > temp_capacity:
-                    # Adjust the last charged power to avoid exceeding capacity
-                    power_difference1 -= (current_charge - temp_capacity)
-                    current_charge = temp_capacity
-
-                charge_hours.append(hour)
-                charge_power.append(power_difference1)  # Track the power charged during this hour
-
-                # Stop charging if the battery is full
-                if current_charge >= temp_capacity:
-                    break
-
-        # Ensure the hours and power are sorted in chronological order
-        sorted_indices = sorted(range(len(charge_hours)), key=lambda i: charge_hours[i])
-        charge_hours = [charge_hours[i] for i in sorted_indices]
-        charge_power = [charge_power[i] for i in sorted_indices]
-
-        # Calculate the charge levels as a cumulative sum of charge_power
-        charge_levels = []
-        current_charge = 0
-        for power in charge_power:
-            current_charge += power
-            if current_charge > temp_capacity:
-                current_charge = temp_capacity
-            charge_levels.append(current_charge)
-
-        # Store the sorted and calculated data in the charge_schedule
-        charge_schedule[day] = {
-            'hours': charge_hours,
-            'power': charge_power,
-            'current_charge': charge_levels
-        }
-
-        # Append the charge level at the end of the day
-        end_of_day_charge_levels.append({'Day': day, 'End of Day Charge Level (kWh)': current_charge})
-
-    # Create a DataFrame for the charge schedule, including charge power and charge level
-    charge_schedule_df = pd.DataFrame([
-        {
-            'datetime': 0,
-            'Day': day,
-            'Hour': hour,
-            'Minute': 0,
-            'Charge Power (kWh)': charge_schedule[day]['power'][i],
-            'Charge Level (kWh)': charge_schedule[day]['current_charge'][i]
-        }
-        for day in charge_schedule
-        for i, hour in enumerate(charge_schedule[day]['hours'])
-    ])
-
-    # Change charge_schedule_df to match the format of the original data
-    charge_schedule_df['Minute'] = charge_schedule_df.groupby(['Day', 'Hour']).cumcount() * 15
-    charge_schedule_df['datetime'] = pd.to_datetime(
-        charge_schedule_df['Day'].astype(str) + ' ' +
-        charge_schedule_df['Hour'].astype(str) + ':' +
-        charge_schedule_df['Minute'].astype(str).str.zfill(2) + ':00'
-    )
-    #charge_schedule_df.set_index('datetime', inplace=True)
-    charge_schedule_df.drop(columns=['Day', 'Hour', 'Minute'], inplace=True)
+    # Charged intervals, charge power and charge levels (see charge_intervals)
+    segments = local_day_segments(data['datetime']) if store is None else store_segments(store[1])
+    days = segments[2]
+    rows, entry_days, charge_power, charge_levels, end_levels = charge_intervals(battery_capacity, data, segments, store)
+    entry_hours = pd.DatetimeIndex(data['datetime']).tz_localize(None).hour.values[rows]
+    has_entries = np.bincount(entry_days, minlength=len(days)) > 0
+    end_of_day_charge_levels = [
+        {'Day': day, 'End of Day Charge Level (kWh)': float(end_levels[i]) if has_entries[i] else 0}
+        for i, day in enumerate(pd.DatetimeIndex(days).date)
+    ]
+
+    # Timestamps of the charge schedule: the n-th charged interval of an hour is put at minute n * 15
+    new_group = np.r_[True, (entry_days[1:] != entry_days[:-1]) | (entry_hours[1:] != entry_hours[:-1])]
+    group_starts = np.flatnonzero(new_group)
+    rank = np.arange(len(entry_days)) - group_starts[np.cumsum(new_group) - 1]
+    minutes = entry_hours.astype(np.int64) * 60 + rank * 15
+    charge_schedule_df = pd.DataFrame({
+        'datetime': pd.DatetimeIndex(days[entry_days] + minutes.astype('timedelta64[m]')).as_unit('ns'),
+        'Charge Power (kWh)': charge_power,
+        'Charge Level (kWh)': charge_levels,
+    })
 
     # Save the charge_schedule DataFrame to an Excel file
-    charge_schedule_df.to_excel('results/charge_schedule.xlsx', index=False)
+    if write_excel:
+        charge_schedule_df.to_excel('results/charge_schedule.xlsx', index=False)
 
     # Make sure datetime is in the same timezone as the original data
     charge_schedule_df['datetime'] = charge_schedule_df['datetime'].dt.tz_localize("Europe/Brussels", ambiguous="NaT", nonexistent="NaT")
 
-    # Merge data with charge_schedule_df to include the original data columns
-    merged_data = pd.merge(data, charge_schedule_df, on='datetime', how='left', suffixes=('', '_charge'))
-    merged_data['Charge Power (kWh)'] = merged_data['Charge Power (kWh)'].fillna(0)
-    merged_data['Charge Level (kWh)'] = merged_data['Charge Level (kWh)'].fillna(0)
-    merged_data.drop(columns=['day', 'power_difference_kwh'], inplace=True)
-
-    battery_charge = pd.DataFrame()
-    battery_charge['datetime'] = merged_data['datetime']
-    battery_charge['charge_power'] = merged_data['Charge Power (kWh)']
-    battery_charge['charge_level'] = merged_data['Charge Level (kWh)']
+    # Charge power and level of every row of data (0 outside the schedule)
+    position = pd.Index(charge_schedule_df['datetime']).get_indexer(data['datetime'])
+    scheduled = position >= 0
+    battery_charge = pd.DataFrame({'datetime': data['datetime'].reset_index(drop=True)})
+    battery_charge['charge_power'] = np.where(scheduled, charge_power[position], 0.0)
+    battery_charge['charge_level'] = np.where(scheduled, charge_levels[position], 0.0)
 
     # Create a DataFrame for the end-of-day charge levels
     end_of_day_charge_df = pd.DataFrame(end_of_day_charge_levels)
 
     # Save the end-of-day charge levels to an Excel file
-    end_of_day_charge_df.to_excel('results/end_of_day_charge_levels.xlsx', index=False)
+    if write_excel:
+        end_of_day_charge_df.to_excel('results/end_of_day_charge_levels.xlsx', index=False)
 
     # Print the list of end-of-day charge levels
     #print(end_of_day_charge_levels)
@@ -233,6 +252,60 @@ def charge_battery(battery_capacity, data):
 
 
 
+def smart_battery_schedule(battery_capacity, data, write_excel=False, skip_charging_intervals=False):
+    """
+    Smart battery heuristic in one in-memory pass: the charge and discharge selections run on
+    the same day layout and are combined per row of data, without merges or Excel files.
+    Charging and discharging both use the exact intervals of data (charge_battery keeps the
+    legacy timestamps, which move the charged intervals of an hour to its first quarters).
+
+    Parameters:
+        battery_capacity (float): The capacity of the battery in kWh.
+        data (DataFrame): Aligned data with the power difference (see calculate_power_difference).
+        write_excel (bool): Also write the charge, end-of-day, discharge and smart battery
+                            schedules to results/.
+        skip_charging_intervals (bool): Do not discharge in the charged intervals (see discharge_battery).
+
+    Returns:
+        ndarray: Net charge power per row of data (charge - discharge, kWh).
+    """
+    segments = local_day_segments(data['datetime'])
+    rows, entry_days, charge_power, charge_levels, end_levels = charge_intervals(battery_capacity, data, segments)
+    charge = np.zeros(len(data))
+    charge[rows] = charge_power
+
+    # Every day starts with the level at the end of the previous day (the first day with the last day)
+    eligible = data['power_difference_kwh'].values == 0
+    if skip_charging_intervals:
+        eligible[rows] = False
+    discharge_power, charge_level, discharged = discharge_intervals(data, np.roll(end_levels, 1), eligible, segments)
+    net_charge = charge - discharge_power
+
+    if write_excel:
+        wall_times = pd.DatetimeIndex(data['datetime']).tz_localize(None)
+        charged_rows = np.sort(rows)
+        levels = np.zeros(len(data))
+        levels[rows] = charge_levels
+        discharged_rows = np.flatnonzero(discharged)
+        pd.DataFrame({
+            'datetime': wall_times[charged_rows],
+            'Charge Power (kWh)': charge[charged_rows],
+            'Charge Level (kWh)': levels[charged_rows],
+        }).to_excel('results/charge_schedule.xlsx', index=False)
+        pd.DataFrame({
+            'Day': pd.DatetimeIndex(segments[2]).date,
+            'End of Day Charge Level (kWh)': end_levels,
+        }).to_excel('results/end_of_day_charge_levels.xlsx', index=False)
+        pd.DataFrame({
+            'datetime': wall_times[discharged_rows],
+            'Discharge Power (kWh)': discharge_power[discharged_rows],
+            'Charge Level (kWh)': charge_level[discharged_rows],
+        }).to_excel('results/discharge_schedule.xlsx', index=False)
+        pd.DataFrame({'datetime': wall_times, 'charge_power': net_charge}).to_excel('results/smart_battery_schedule.xlsx', index=False)
+
+    return net_charge
+
+
 def smart_battery_merge(battery_charge, discharge_schedule):
     # Update 'charge_power' in smart_battery based on discharge_schedule
     smart_battery = pd.DataFrame
@@ -244,10 +317,7 @@ def smart_battery_merge(battery_charge, discharge_schedule):
             how='left'
         )
         # If discharge_power is not NaN, set charge_power to -1 * discharge_power
-        smart_battery['charge_power'] = smart_battery.apply(
-            lambda row: row['charge_power'] - row['discharge_power'],
-            axis=1
-        )
+        smart_battery['charge_power'] = smart_battery['charge_power'] - smart_battery['discharge_power']
         # Drop the 'discharge_power' column as it's no longer needed
         smart_battery.drop(columns=['discharge_power'], inplace=True)
 
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from battery_simulation import simulate_conventional_batch
 
 def conventional_battery(battery_capacity, data):
     data = data.copy()  # Create a copy of the input DataFrame to avoid modifying the original
@@ -18,50 +19,14 @@ def conventional_battery(battery_capacity, data):
         charge_schedule (list): List of dictionaries with charging details.
         discharge_schedule (list): List of dictionaries with discharging details.
     """
-    # Initialize variables
-    current_charge = 0  # Current charge level of the battery
-    charge_amount = 0  # Amount of power charged during the hour
-    discharge_amount = 0  # Amount of power discharged during the hour
-    charge_schedule = []  # To store charging details
-    discharge_schedule = []  # To store discharging details
-    charge_discharge_schedule = []  # To store charge/discharge schedule
-
-    # Iterate through each hour in the data
-    for _, row in data.iterrows():
-        hour = row['datetime']
-        power_difference = row['power_difference_kwh_for_conventional']
-
-        if power_difference > 0:
-            # Surplus of power: Charge the battery
-            charge_amount = min(power_difference, battery_capacity - current_charge)
-            current_charge += charge_amount
-            discharge_amount = 0  # Reset discharge amount
-            
-            
-        elif power_difference < 0:
-            # Deficit of power: Discharge the battery
-            discharge_amount = min(abs(power_difference), current_charge)
-            current_charge -= discharge_amount
-            charge_amount = 0
-        discharge_schedule.append({
-                'hour': hour,
-                'discharge_power': discharge_amount,
-                'current_charge': current_charge
-        })
-        charge_schedule.append({
-                'hour': hour,
-                'charge_power': charge_amount,
-                'current_charge': current_charge
-            })
-        charge_discharge_schedule.append({
-                'hour': hour,
-                'charge_power': charge_amount-discharge_amount,
-                'current_charge': current_charge
-            })
-
-    convention_charge_schedule_df = pd.DataFrame(charge_schedule)
-    convention_discharge_schedule_df = pd.DataFrame(discharge_schedule)
-    convention_charge_discharge_schedule_df = pd.DataFrame(charge_discharge_schedule)
+    # Simulate the battery with the batched simulator (one scenario)
+    charge, discharge, current_charge = simulate_conventional_batch(data['power_difference_kwh_for_conventional'].values, battery_capacity)
+    charge, discharge, current_charge = charge[0], discharge[0], current_charge[0]
+    hours = data['datetime'].reset_index(drop=True)
+
+    convention_charge_schedule_df = pd.DataFrame({'hour': hours, 'charge_power': charge, 'current_charge': current_charge})
+    convention_discharge_schedule_df = pd.DataFrame({'hour': hours, 'discharge_power': discharge, 'current_charge': current_charge})
+    convention_charge_discharge_schedule_df = pd.DataFrame({'hour': hours, 'charge_power': charge - discharge, 'current_charge': current_charge})
 
     # Remove timezone information from datetime columns
     if 'hour' in convention_charge_schedule_df.columns:
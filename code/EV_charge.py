@@ -1,9 +1,11 @@
 from datetime import datetime, time, timedelta
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from battery_kernels import ev_drive_discharge, ev_weekly_correction
 
-def charge_ev_weekly(data, battery_capacity, charge_battery_schedule, max_charge_percent=100, max_charge_rate=2.3, drive_discharge=8):
+def charge_ev_weekly(data, battery_capacity, charge_battery_schedule, max_charge_percent=100, max_charge_rate=2.3, drive_discharge=8, exclude_battery_charging=False, write_excel=True, plot=True):
     data = data.copy()
     
     """
@@ -19,13 +21,17 @@ def charge_ev_weekly(data, battery_capacity, charge_battery_schedule, max_charge
         max_charge_percent (float): Maximum charge level as a percentage of battery capacity.
         max_charge_rate (float): Maximum charging rate in kW.
         drive_discharge (float): Daily discharge in kWh.
+        exclude_battery_charging (bool): Do not charge the EV in the intervals of charge_battery_schedule.
+                                         Off by default: the original membership test compared tz-aware
+                                         with naive timestamps and never excluded an interval.
+        write_excel (bool): Write ev_charge_schedule_with_charging.xlsx to results/.
+        plot (bool): Save the EV charging heatmap to results/.
 
     Returns:
         pd.DataFrame: DataFrame containing the updated charge levels for all weeks.
     """
     max_charge = battery_capacity * (max_charge_percent / 100)
     max_charge_per_interval = max_charge_rate / 4  # Maximum charge rate per 15-minute interval
-    results = []
 
     # Sort data by datetime for the discharging simulation
     data = data.sort_values(by='datetime')  # Ensure data is sorted by datetime
@@ -33,97 +39,53 @@ def charge_ev_weekly(data, battery_capacity, charge_battery_schedule, max_charge
     # Exclude overlapping hours from the EV charging schedule
     charge_battery_hours = charge_battery_schedule['datetime']
 
-    # Initialize the starting charge level
-    current_charge = max_charge
-    current_day = None  # Track the current day
-    current_week = None  # Track the current week
-    daily_discharge_remaining = 0  # Initialize daily discharge remaining
-
-    # First iteration: Simulate driving (discharge)
-    for _, entry in data.iterrows():
-        dt = entry['datetime']
-
-        # Reset weekly charge at the start of a new week
-        if current_week != dt.isocalendar()[1]:  # Check if the week number has changed
-            current_week = dt.isocalendar()[1]
-            current_charge = max_charge  # Reset charge to max at the start of a new week
-
-        # Reset daily discharge at the start of a new day
-        if current_day != dt.date():
-            current_day = dt.date()
-            daily_discharge_remaining = drive_discharge  # Reset daily discharge to 8 kWh at the start of each day
-
-        # Simulate daily driving (8 kWh between 8 AM and 6 PM)
-        if time(8, 0) <= dt.time() <= time(18, 0):  # Applies to all days (weekdays and weekends)
-            discharge_amount = min(drive_discharge / (10 * 4), daily_discharge_remaining)  # Spread 8 kWh over 10 hours (15-min intervals)
-            current_charge -= discharge_amount
-            current_charge = max(current_charge, 0)  # Ensure charge does not go below 0
-            daily_discharge_remaining -= discharge_amount  # Reduce the daily discharge remaining
-
-        # Append the results for this time interval (discharge only)
-        results.append({
-            "datetime": dt,
-            "price": entry['Euro'],
-            "power_surplus": entry['power_difference_kwh'],
-            "charge_power": 0,  # No charging during this iteration
-            "discharge_charge": current_charge  # Preserve the charge after discharging            
-            })
-
-    # Convert the results list to a DataFrame for charging simulation
-    results_df = pd.DataFrame(results)
-
-    # Ensure 'charge_power' column is explicitly cast to a compatible dtype
-    results_df['charge_power'] = results_df['charge_power'].astype(float)
+    # Day, ISO week and drive window (8 AM to 6 PM) of every interval
+    datetimes = data['datetime']
+    minute_of_day = datetimes.dt.hour.values * 60 + datetimes.dt.minute.values
+    days = datetimes.dt.date.values
+    weeks = datetimes.dt.isocalendar().week.values
+    new_day = np.r_[True, days[1:] != days[:-1]]
+    new_week = np.r_[True, weeks[1:] != weeks[:-1]]
+    in_drive_window = (minute_of_day >= 8 * 60) & (minute_of_day <= 18 * 60)  # Applies to all days (weekdays and weekends)
+
+    # First iteration: Simulate driving (discharge), drive_discharge is spread over 10 hours (15-min intervals)
+    discharge_charge = ev_drive_discharge(in_drive_window, new_day, new_week, max_charge, drive_discharge, drive_discharge / (10 * 4))
+
+    # DataFrame of the results for the charging simulation
+    results_df = pd.DataFrame({
+        "datetime": datetimes.reset_index(drop=True),
+        "price": data['Euro'].values,
+        "power_surplus": data['power_difference_kwh'].values,
+        "charge_power": 0.0,  # No charging during this iteration
+        "discharge_charge": discharge_charge  # Preserve the charge after discharging
+    })
 
     # Second iteration: Simulate charging (using power surplus)
-    results_df = results_df.sort_values(by='price')  # Sort by price for charging
-    for _, row in results_df.iterrows():
-        dt = row['datetime']
-        price = row['price']
-        power_surplus = row['power_surplus']
-        charge_power = 0
-        weekday = dt.weekday()
-        is_weekend = weekday >= 5  # Saturday and Sunday are weekends
-
-        # Skip hours where the battery is charging
-        if dt in charge_battery_hours.values:
-            continue
-
-        # Charging allowed: 6 PM to 8 AM on weekdays or the entire day on weekends
-        if (is_weekend or dt.time() >= time(18, 0) or dt.time() <= time(8, 0)):
-            charge_needed = max_charge - results_df.loc[row.name, 'discharge_charge']
-            if power_surplus > 0:
-                # Use power surplus to charge as much as possible, limited by max charge rate per interval
-                charge_power = min(charge_needed, power_surplus, max_charge_per_interval)
-
-        # Update the charging power in the results DataFrame
-        results_df.loc[row.name, 'charge_power'] = charge_power
-
-    # Recalculate updated_charge in chronological order
-    results_df = results_df.sort_values(by='datetime')  # Return to chronological order
-    current_week = None  # Reset current week for recalculation
-    for i, row in results_df.iterrows():
-        dt = row['datetime']
-
-        # Reset cumulative charging power at the start of a new week
-        if current_week != dt.isocalendar()[1]:  # Check if the week number has changed
-            current_week = dt.isocalendar()[1]
-            cumulative_charge_power = 0  # Reset cumulative charging power
-
-        # Calculate updated_charge as discharge_charge + cumulative charging power
-        cumulative_charge_power += row['charge_power']
-        updated_charge = row['discharge_charge'] + cumulative_charge_power
-
-        # If updated_charge exceeds max_charge, adjust the charge_power in the current row
-        if updated_charge > max_charge:
-            excess = updated_charge - max_charge
-            # Ensure charge_power does not go below 0
-            adjusted_charge_power = max(0, row['charge_power'] - excess)
-            results_df.loc[i, 'charge_power'] = adjusted_charge_power
-            updated_charge = row['discharge_charge'] + cumulative_charge_power - (row['charge_power'] - adjusted_charge_power)
-
-        # Update the updated_charge in the DataFrame
-        results_df.loc[i, 'updated_charge'] = updated_charge
+    # Charging allowed: 6 PM to 8 AM on weekdays or the entire day on weekends, with a power surplus
+    is_weekend = datetimes.dt.weekday.values >= 5  # Saturday and Sunday are weekends
+    in_charge_window = is_weekend | (minute_of_day >= 18 * 60) | (minute_of_day <= 8 * 60)
+    power_surplus = results_df['power_surplus'].values
+    can_charge = in_charge_window & (power_surplus > 0)
+
+    # Skip intervals where the home battery is charging
+    if exclude_battery_charging:
+        can_charge &= ~datetimes.isin(charge_battery_hours).values
+
+    # Every interval only depends on its own charge level after driving, so the intervals are
+    # independent: use the power surplus as much as possible, limited by the max charge rate
+    charge_needed = max_charge - discharge_charge
+    charge_power = np.minimum(np.minimum(charge_needed, power_surplus), max_charge_per_interval)
+    results_df['charge_power'] = np.where(can_charge, charge_power, 0.0)
+
+    # Recalculate updated_charge in chronological order: the charge power is reduced where the
+    # cumulative charging of the week would exceed max_charge. results_df is in index order, so a
+    # stable sort keeps rows with the same timestamp (the repeated DST hour) in order of index
+    results_df = results_df.sort_values(by='datetime', kind='stable')
+    weeks = weeks[results_df.index.values]  # The index holds the chronological position of every row
+    new_week = np.r_[True, weeks[1:] != weeks[:-1]]
+    adjusted_charge_power, updated_charge = ev_weekly_correction(results_df['discharge_charge'].values, results_df['charge_power'].values, new_week, max_charge)
+    results_df['charge_power'] = adjusted_charge_power
+    results_df['updated_charge'] = updated_charge
     '''
     # Third iteration: Simulate grid charging for each week
     results_df['week'] = results_df['datetime'].dt.isocalendar().week  # Add a column for the week number
@@ -221,9 +183,13 @@ def charge_ev_weekly(data, battery_capacity, charge_battery_schedule, max_charge
 
     # Save the DataFrame to an Excel file
     results_df['datetime'] = pd.to_datetime(results_df['datetime']).dt.tz_localize(None)  # Remove timezone info
-    results_df.to_excel('results/ev_charge_schedule_with_charging.xlsx', index=False)
+    if write_excel:
+        results_df.to_excel('results/ev_charge_schedule_with_charging.xlsx', index=False)
     #print(f"Charge schedule saved to {'results/ev_charge_schedule_with_charging.xlsx'}")
 
+    if not plot:
+        return results_df
+
         # Load data
     df = results_df.copy()
 
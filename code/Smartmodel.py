@@ -4,99 +4,33 @@ from pulp import *
 import matplotlib.pyplot as plt
 import seaborn as sns
 from pulp import LpProblem, LpVariable, LpMaximize, lpSum, LpStatus, value
+from smart_lp import _battery_args, cached_smart_lp, solve_smart_lp
+from smart_dp import solve_smart_dp
+from smart_flow import solve_smart_flow
 
-def smartmodel():
-    # -------------------
-    # SMART MODEL
-    # -------------------
-    # Load data
-    # Assuming the data is in a file named 'data.xlsx' in the 'results' directory
-    # The file should contain columns: 'datetime', 'Power_Output_kWh', 'Volume_Afname_kWh', and 'Euro'
-    # Load data
-    df = pd.read_excel('results/data.xlsx')
+# Battery of the smart model: power (kW), energy (kWh), efficiencies, throughput weight and
+# interval length (hours)
+SMART_BATTERY = {'c_max': 5.85, 'd_max': 5.85, 'E_max': 5.85, 'E_min': 0.0, 'eta_c': 1, 'eta_d': 1, 'aplha': 100, 'delta_t': 0.25}
 
-    # Prepare data
-    dt = 0.25  # 15-minute interval in hours
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    df['pv'] = df['Power_Output_kWh'] / dt
-    df['load'] = df['Volume_Afname_kWh'] / dt
-    df['price'] = df['Euro']
-    df['residual'] = df['load'] - df['pv']
 
-    # Battery specs
-    c_max = 5.85
-    d_max = 5.85
-    E_max = 5.85
-    E_min = 0.0
-    eta_c = 1
-    eta_d = 1
-    aplha = 100
+def solve_pulp(prices, residual, c_max, d_max, E_max, eta_c, eta_d, aplha, delta_t, E_min=0.0):
     """
-    T = len(df)
-    hours = range(T)
-
-    # Optimization model
-    prob = LpProblem("Battery_Optimization", LpMinimize)
-    c = LpVariable.dicts("charge", hours, 0, c_max)
-    d = LpVariable.dicts("discharge", hours, 0, d_max)
-    SOC = LpVariable.dicts("SOC", hours, E_min, E_max)
-
-    # Objective function
-    prob += lpSum([df['price'].iloc[t] * (c[t] - d[t]) for t in hours])
-
-    # Constraints
-    for t in hours:
-        if t == 0:
-            prob += SOC[t] == E_max / 2 + (eta_c * c[t] - d[t] * (1 / eta_d)) * dt
-        else:
-            prob += SOC[t] == SOC[t - 1] + (eta_c * c[t] - d[t] * (1 / eta_d)) * dt
-
-        # Charge only when overgeneration
-        if df['residual'].iloc[t] < 0:
-            prob += c[t] <= min(c_max, -df['residual'].iloc[t])
-        else:
-            prob += c[t] == 0
-
-        # Discharge only when residual load
-        if df['residual'].iloc[t] > 0:
-            prob += d[t] <= min(d_max, df['residual'].iloc[t])
-        else:
-            prob += d[t] == 0
-
-    # SOC cyclical constraint
-    prob += SOC[T - 1] == E_max / 2
-
-    # Solve
-    prob.solve()
-
-    # Add results
-    df['charge_kW'] = [value(c[t]) for t in hours]
-    df['discharge_kW'] = [value(d[t]) for t in hours]
-    df['SOC_kWh'] = [value(SOC[t]) for t in hours]
-
-    #print("Optimization status:", LpStatus[prob.status])
-    #print("Total energy cost (€):", value(prob.objective))
-    df['charge_power'] = (df['charge_kW'] - df['discharge_kW'])*dt  # Positive for charging, negative for discharging
-
-    # Save results
-    df.to_excel('results/optimized_battery_schedule.xlsx', index=False)
+    Solve the smart battery LP with the PuLP model (CBC).
+
+    Parameters:
+        prices (ndarray): Electricity price per interval (EUR/MWh).
+        residual (ndarray): Residual load per interval (kW).
+        c_max, d_max (float): Maximum charge and discharge power (kW).
+        E_max (float): Maximum stored energy (kWh).
+        eta_c, eta_d (float): Charge and discharge efficiency.
+        aplha (float): Weight of the throughput term of the objective.
+        delta_t (float): Length of an interval (hours).
+        E_min (float): Minimum stored energy (kWh).
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
     """
-
-
-    # Load your data (adjust the path as needed)
-
-    # Prepare the data
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    df['residual'] = df['load'] - df['pv']
-    df['price'] = df['price'].astype(float)
-    df = df.sort_values('datetime').reset_index(drop=True)
-
-    # Model parameters
-    prices = df['price'].values
-    residual = df['residual'].values
-    N = len(df)
-    delta_t = 0.25  # 15-minute intervals
-
+    N = len(prices)
 
     # Define the optimization problem
     model = LpProblem("Maximize_Saved_Money", LpMaximize)
@@ -104,7 +38,7 @@ def smartmodel():
     # Define variables
     c = LpVariable.dicts("charge", range(N), 0, c_max)
     d = LpVariable.dicts("discharge", range(N), 0, d_max)
-    E = LpVariable.dicts("energy", range(N), 0, E_max)
+    E = LpVariable.dicts("energy", range(N), E_min, E_max)
 
     # Objective function
     model += lpSum(prices[t] * (d[t] - c[t]) + aplha*(d[t] + c[t]) for t in range(N))
@@ -133,19 +67,154 @@ def smartmodel():
     model.solve()
 
     # Collect results
-    df['charge_kW'] = [value(c[t]) for t in range(N)]
-    df['discharge_kW'] = [value(d[t]) for t in range(N)]
-    df['SOC_kWh'] = [value(E[t]) for t in range(N)]
-    df['charge_power'] = (df['charge_kW'] - df['discharge_kW'])*dt  # Positive for charging, negative for discharging
+    charge_kW = np.array([value(c[t]) for t in range(N)])
+    discharge_kW = np.array([value(d[t]) for t in range(N)])
+    SOC_kWh = np.array([value(E[t]) for t in range(N)])
+    return charge_kW, discharge_kW, SOC_kWh, value(model.objective)
+
+
+def optimize_smart_battery(data, battery=None, backend='highs', use_cache=False, write_excel=False, plot=False):
+    """
+    Optimize the smart battery schedule for the in-memory aligned data (e.g. from
+    all_correct_data_files), without reading or writing files unless asked.
+
+    Parameters:
+        data (DataFrame): Aligned 15-minute data with 'datetime', 'Power_Output_kWh',
+                          'Volume_Afname_kWh' and 'Euro', in order of time.
+        battery (dict): Battery spec with any of 'c_max', 'd_max', 'E_max', 'E_min', 'eta_c', 'eta_d',
+                        'aplha' and 'delta_t'; missing keys take the values of SMART_BATTERY.
+        backend (str): 'highs' (smart_lp.solve_smart_lp), 'pulp' (PuLP model), 'dp'
+                       (smart_dp.solve_smart_dp, SOC grid) or 'flow' (smart_flow.solve_smart_flow,
+                       exact for a lossless battery).
+        use_cache (bool): Reuse the cached solution when the prices, residual load and battery
+                          parameters did not change (see smart_lp.cached_smart_lp). Off by default,
+                          like write_excel and plot: the cache writes files to data/cache.
+        write_excel (bool): Write the schedule to results/optimized_battery_schedule.xlsx.
+        plot (bool): Plot the schedule (see plot_smart_schedule).
+
+    Returns:
+        tuple: (schedule, objective) with a copy of data (same index) with the 'pv', 'load',
+               'price', 'residual' (kW), 'charge_kW', 'discharge_kW', 'SOC_kWh' and 'charge_power'
+               (kWh per interval, positive for charging) columns, and the maximized objective.
+    """
+    battery = dict(SMART_BATTERY, **(battery or {}))
+    dt = battery['delta_t']
+    schedule = data.copy()
+    schedule['pv'] = schedule['Power_Output_kWh'] / dt
+    schedule['load'] = schedule['Volume_Afname_kWh'] / dt
+    schedule['price'] = schedule['Euro'].astype(float)
+    schedule['residual'] = schedule['load'] - schedule['pv']
+    prices = schedule['price'].values
+    residual = schedule['residual'].values
+
+    args = _battery_args(battery)
+    if backend == 'highs':
+        solve = lambda: solve_smart_lp(prices, residual, **args)
+    elif backend == 'pulp':
+        solve = lambda: solve_pulp(prices, residual, battery['c_max'], battery['d_max'], battery['E_max'], battery['eta_c'], battery['eta_d'], battery['aplha'], dt, battery['E_min'])
+    elif backend == 'dp':
+        solve = lambda: solve_smart_dp(prices, residual, **args)
+    elif backend == 'flow':
+        solve = lambda: solve_smart_flow(prices, residual, **args)
+    else:
+        raise ValueError(f"Unknown smart model backend '{backend}'.")
+    if use_cache:
+        charge_kW, discharge_kW, SOC_kWh, objective = cached_smart_lp(prices, residual, battery, solve=solve, backend=backend)
+    else:
+        charge_kW, discharge_kW, SOC_kWh, objective = solve()
+
+    schedule['charge_kW'] = charge_kW
+    schedule['discharge_kW'] = discharge_kW
+    schedule['SOC_kWh'] = SOC_kWh
+    schedule['charge_power'] = (schedule['charge_kW'] - schedule['discharge_kW'])*dt  # Positive for charging, negative for discharging
+
+    if write_excel:
+        excel = schedule.copy()
+        if excel['datetime'].dt.tz is not None:
+            excel['datetime'] = excel['datetime'].dt.tz_localize(None)
+        excel.to_excel('results/optimized_battery_schedule.xlsx', index=False)
+    if plot:
+        plot_smart_schedule(schedule.copy())
+    return schedule, objective
+
+
+def smartmodel(backend='pulp', use_cache=True):
+    """
+    Optimize the smart battery schedule for the data in results/data.xlsx, write the schedule to
+    results/optimized_battery_schedule.xlsx and plot it. Kept for the scripts that use it; use
+    optimize_smart_battery for in-memory data.
+
+    Parameters:
+        backend (str): 'pulp' for the PuLP model (CBC), 'highs' for the sparse matrix LP of
+                       smart_lp.py solved with HiGHS (same LP, much faster to build).
+        use_cache (bool): Reuse the cached solution when the prices, residual load and battery
+                          parameters did not change (see smart_lp.cached_smart_lp).
+
+    Returns:
+        DataFrame: The data with the charge, discharge, SOC and charge_power columns.
+    """
+    # -------------------
+    # SMART MODEL
+    # -------------------
+    # Load data
+    # Assuming the data is in a file named 'data.xlsx' in the 'results' directory
+    # The file should contain columns: 'datetime', 'Power_Output_kWh', 'Volume_Afname_kWh', and 'Euro'
+    # Load data
+    df = pd.read_excel('results/data.xlsx')
+
+    # Prepare data
+    dt = 0.25  # 15-minute interval in hours
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df['pv'] = df['Power_Output_kWh'] / dt
+    df['load'] = df['Volume_Afname_kWh'] / dt
+    df['price'] = df['Euro']
+    df['residual'] = df['load'] - df['pv']
+
+    # Battery specs
+    c_max = 5.85
+    d_max = 5.85
+    E_max = 5.85
+    E_min = 0.0
+    eta_c = 1
+    eta_d = 1
+    aplha = 100
 
+    # Prepare the data
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df['residual'] = df['load'] - df['pv']
+    df['price'] = df['price'].astype(float)
+    df = df.sort_values('datetime').reset_index(drop=True)
+
+    # Model parameters
+    prices = df['price'].values
+
+    df, objective = optimize_smart_battery(df, {'c_max': c_max, 'd_max': d_max, 'E_max': E_max, 'E_min': E_min, 'eta_c': eta_c, 'eta_d': eta_d, 'aplha': aplha, 'delta_t': dt}, backend=backend, use_cache=use_cache)
 
     # Total savings
-    total_savings = sum(prices[t] * (value(d[t]) - value(c[t])) for t in range(N))
+    total_savings = np.sum(prices * (df['discharge_kW'].values - df['charge_kW'].values))
     print("Total monetary savings (€):", total_savings)
 
     #save results
     df.to_excel('results/optimized_battery_schedule.xlsx', index=False)
 
+    plot_smart_schedule(df)
+
+    return df
+
+
+def plot_smart_schedule(df):
+    """
+    Plot a smart battery schedule (SOC, charge/discharge power, price and residual load, heatmap,
+    week view and monthly summary) and save the figures in results/.
+
+    Parameters:
+        df (DataFrame): Schedule from optimize_smart_battery. The 'date', 'time', 'month', 'charged'
+                        and 'discharged' columns of the figures are added to it.
+    """
+    if df['datetime'].dt.tz is not None:
+        # The week view selects on naive timestamps, like the data read from results/data.xlsx
+        df['datetime'] = df['datetime'].dt.tz_localize(None)
+
     # -------------------
     # PLOT RESULTS
     # -------------------
@@ -260,5 +329,3 @@ def smartmodel():
     plt.tight_layout()
     plt.savefig('results/smart_model_monthly_summary.png')
     #plt.show()
-
-    return df
\ No newline at end of file
@@ -0,0 +1,367 @@
+import numpy as np
+
+# Kernels for the sequential state updates of the battery and EV models.
+# Every kernel works on plain float arrays. When Numba is installed the kernels are compiled
+# (backend 'numba'); otherwise the same code runs as plain Python (backend 'python').
+# The arithmetic is written in the same order as the original loops, so both backends give
+# the same floats as the functions they replace.
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+DEFAULT_BACKEND = 'numba' if HAVE_NUMBA else 'python'
+
+
+def _conventional_soc(surplus, deficit, capacities, charge_limits, discharge_limits, charge_efficiency, discharge_efficiency, initial_charge):
+    n_scenarios, n_intervals = surplus.shape
+    charge = np.zeros((n_scenarios, n_intervals))
+    discharge = np.zeros((n_scenarios, n_intervals))
+    stored = np.zeros((n_scenarios, n_intervals))
+    for s in range(n_scenarios):
+        current_charge = initial_charge[s]
+        for t in range(n_intervals):
+            charge_amount = min(min(surplus[s, t], charge_limits[s]), (capacities[s] - current_charge) / charge_efficiency[s])
+            current_charge += charge_amount * charge_efficiency[s]
+
+            discharge_amount = min(min(deficit[s, t], discharge_limits[s]), current_charge * discharge_efficiency[s])
+            current_charge -= discharge_amount / discharge_efficiency[s]
+
+            charge[s, t] = charge_amount
+            discharge[s, t] = discharge_amount
+            stored[s, t] = current_charge
+    return charge, discharge, stored
+
+
+def _ev_drive_discharge(in_drive_window, new_day, new_week, max_charge, drive_discharge, discharge_per_interval):
+    n_intervals = in_drive_window.shape[0]
+    discharge_charge = np.zeros(n_intervals)
+    current_charge = max_charge
+    daily_discharge_remaining = 0.0
+    for t in range(n_intervals):
+        if new_week[t]:
+            current_charge = max_charge
+        if new_day[t]:
+            daily_discharge_remaining = drive_discharge
+        if in_drive_window[t]:
+            discharge_amount = min(discharge_per_interval, daily_discharge_remaining)
+            current_charge -= discharge_amount
+            current_charge = max(current_charge, 0.0)
+            daily_discharge_remaining -= discharge_amount
+        discharge_charge[t] = current_charge
+    return discharge_charge
+
+
+def _ev_weekly_correction(discharge_charge, charge_power, new_week, max_charge):
+    n_intervals = charge_power.shape[0]
+    adjusted_charge_power = np.zeros(n_intervals)
+    updated_charge = np.zeros(n_intervals)
+    cumulative_charge_power = 0.0
+    for t in range(n_intervals):
+        if new_week[t]:
+            cumulative_charge_power = 0.0
+        # The cumulative sum uses the charge power before the correction
+        cumulative_charge_power += charge_power[t]
+        updated = discharge_charge[t] + cumulative_charge_power
+        adjusted = charge_power[t]
+        if updated > max_charge:
+            excess = updated - max_charge
+            adjusted = max(0.0, charge_power[t] - excess)
+            updated = discharge_charge[t] + cumulative_charge_power - (charge_power[t] - adjusted)
+        adjusted_charge_power[t] = adjusted
+        updated_charge[t] = updated
+    return adjusted_charge_power, updated_charge
+
+
+def _clamped_cumsum(values, segment_starts, initial_levels, lower, upper):
+    # Per segment: running sum from the initial level, clamped to [lower, upper] after every step
+    levels = np.zeros(values.shape[0])
+    n_segments = segment_starts.shape[0] - 1
+    for k in range(n_segments):
+        current_charge = initial_levels[k]
+        for t in range(segment_starts[k], segment_starts[k + 1]):
+            current_charge += values[t]
+            if current_charge > upper[k]:
+                current_charge = upper[k]
+            if current_charge < lower[k]:
+                current_charge = lower[k]
+            levels[t] = current_charge
+    return levels
+
+
+def _ev_fleet(power_surplus, available, consumption, capacities, charge_limits, initial_levels, site_limits, grid_charging):
+    # Per interval: every vehicle first uses its consumption (energy that is not available is
+    # unmet), then the plugged-in vehicles request energy up to their charger limit and free
+    # capacity. The requests share the PV surplus pro rata, topped up from the grid if allowed,
+    # and the total is limited by the site connection.
+    n_vehicles, n_intervals = available.shape
+    pv_charge = np.zeros((n_vehicles, n_intervals))
+    grid_charge = np.zeros((n_vehicles, n_intervals))
+    levels = np.zeros((n_vehicles, n_intervals))
+    unmet = np.zeros((n_vehicles, n_intervals))
+    current_charge = initial_levels.copy()
+    request = np.zeros(n_vehicles)
+    for t in range(n_intervals):
+        total_request = 0.0
+        for v in range(n_vehicles):
+            use = consumption[v, t]
+            if use > current_charge[v]:
+                unmet[v, t] = use - current_charge[v]
+                current_charge[v] = 0.0
+            else:
+                current_charge[v] -= use
+            request[v] = 0.0
+            if available[v, t]:
+                request[v] = max(0.0, min(charge_limits[v], capacities[v] - current_charge[v]))
+            total_request += request[v]
+
+        if total_request > 0:
+            delivered = min(total_request, site_limits[t])
+            pv_used = min(max(power_surplus[t], 0.0), delivered)
+            grid_used = delivered - pv_used if grid_charging else 0.0
+            for v in range(n_vehicles):
+                share = request[v] / total_request
+                pv_charge[v, t] = pv_used * share
+                grid_charge[v, t] = grid_used * share
+                current_charge[v] += pv_charge[v, t] + grid_charge[v, t]
+
+        for v in range(n_vehicles):
+            levels[v, t] = current_charge[v]
+    return pv_charge, grid_charge, levels, unmet
+
+
+def _storage_flow(moves, ranks, gt_count, ge_count, positive_count, n_positions, E_start, E_end, E_min, E_max, first, tolerance):
+    # Exact SOC path of the lossless storage problem (see smart_flow.solve_smart_flow).
+    # The best value as a function of the SOC is concave and piecewise linear; it is kept as its
+    # domain [low, high] and the length of every slope, indexed by the rank of the slope (largest
+    # first) in a Fenwick tree. A move of an interval inserts a segment with its own slope, and
+    # the part of the domain outside [E_min, E_max] is cut from the ends of the slope order.
+    n_intervals = moves.shape[0]
+    tree = np.zeros(n_positions + 1)
+    lengths = np.zeros(n_positions)
+    top_step = 1
+    while top_step * 2 <= n_positions:
+        top_step *= 2
+    lows = np.zeros(n_intervals)
+    highs = np.zeros(n_intervals)
+    best_low = np.zeros(n_intervals)
+    best_high = np.zeros(n_intervals)
+    low = E_start
+    high = E_start
+
+    for t in range(first, n_intervals):
+        if moves[t] == 0:
+            continue
+        lows[t] = low
+        highs[t] = high
+        # Range of the SOC before interval t at which the value has the slope of interval t
+        for k in range(2):
+            i = gt_count[t] if k == 0 else ge_count[t]
+            total = 0.0
+            while i > 0:
+                total += tree[i]
+                i -= i & -i
+            if k == 0:
+                best_low[t] = low + total
+            else:
+                best_high[t] = low + total
+
+        amount = abs(moves[t])
+        lengths[ranks[t]] += amount
+        i = ranks[t] + 1
+        while i <= n_positions:
+            tree[i] += amount
+            i += i & -i
+        if moves[t] > 0:
+            high += amount
+            excess = high - E_max
+            high = min(high, E_max)
+        else:
+            low -= amount
+            excess = E_min - low
+            low = max(low, E_min)
+
+        # Cut the excess from the smallest slopes (above E_max) or the largest slopes (below E_min)
+        while excess > tolerance:
+            if moves[t] > 0:
+                target = 0.0
+                i = n_positions
+                while i > 0:
+                    target += tree[i]
+                    i -= i & -i
+                target -= tolerance
+            else:
+                target = tolerance
+            # Position at which the running total of the lengths first exceeds target
+            position = 0
+            remaining = target
+            step = top_step
+            while step > 0:
+                if position + step <= n_positions and tree[position + step] <= remaining:
+                    position += step
+                    remaining -= tree[position]
+                step //= 2
+            if position >= n_positions:
+                break
+            cut = min(lengths[position], excess)
+            if lengths[position] - cut <= tolerance:
+                cut = lengths[position]
+            if cut <= 0:
+                break
+            lengths[position] -= cut
+            excess -= cut
+            i = position + 1
+            while i <= n_positions:
+                tree[i] -= cut
+                i += i & -i
+
+    path = np.zeros(n_intervals + 1)
+    if np.isnan(E_end):
+        # Free end level: the SOC at which the slope of the value turns negative
+        total = 0.0
+        i = positive_count
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        level = low + total
+    else:
+        if E_end < low - 1e3 * tolerance or E_end > high + 1e3 * tolerance:
+            return path, False
+        level = min(max(E_end, low), high)
+
+    # Backward pass: the SOC before every interval that gives the best value, closest to the SOC after it
+    path[n_intervals] = level
+    for t in range(n_intervals - 1, first - 1, -1):
+        if moves[t] > 0:
+            previous = min(max(level, best_low[t]), best_high[t])
+            previous = min(max(previous, max(level - moves[t], lows[t])), min(level, highs[t]))
+            level = previous
+        elif moves[t] < 0:
+            previous = min(max(level, best_low[t]), best_high[t])
+            previous = min(max(previous, max(level, lows[t])), min(level - moves[t], highs[t]))
+            level = previous
+        path[t] = level
+    for t in range(first):
+        path[t] = E_start
+    return path, True
+
+
+_PYTHON_KERNELS = {
+    'conventional_soc': _conventional_soc,
+    'ev_drive_discharge': _ev_drive_discharge,
+    'ev_weekly_correction': _ev_weekly_correction,
+    'clamped_cumsum': _clamped_cumsum,
+    'ev_fleet': _ev_fleet,
+    'storage_flow': _storage_flow,
+}
+_compiled_kernels = {}
+
+
+def get_kernel(name, backend=None):
+    """
+    Return a kernel for the requested backend ('numba' or 'python', None for the default).
+    Numba kernels are compiled on first use.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'python':
+        return _PYTHON_KERNELS[name]
+    if backend != 'numba':
+        raise ValueError(f"Unknown kernel backend '{backend}'.")
+    if not HAVE_NUMBA:
+        raise ImportError("The 'numba' backend requires the numba package.")
+    if name not in _compiled_kernels:
+        _compiled_kernels[name] = njit(cache=True)(_PYTHON_KERNELS[name])
+    return _compiled_kernels[name]
+
+
+def conventional_soc(surplus, deficit, capacities, charge_limits, discharge_limits, charge_efficiency, discharge_efficiency, initial_charge, backend=None):
+    """
+    SOC recurrence of the conventional battery for (scenarios, T) surplus and deficit arrays
+    and per-scenario parameters (see simulate_conventional_batch).
+
+    Returns:
+        tuple: (charge, discharge, stored) arrays of shape (scenarios, T).
+    """
+    arrays = [np.ascontiguousarray(a, dtype=float) for a in (surplus, deficit, capacities, charge_limits, discharge_limits, charge_efficiency, discharge_efficiency, initial_charge)]
+    return get_kernel('conventional_soc', backend)(*arrays)
+
+
+def ev_drive_discharge(in_drive_window, new_day, new_week, max_charge, drive_discharge, discharge_per_interval, backend=None):
+    """
+    Charge level of the EV after driving: the battery is full at the start of every week and
+    drive_discharge kWh per day is used in the drive window, discharge_per_interval at a time.
+
+    Parameters:
+        in_drive_window (array-like): True for the intervals in the daily drive window.
+        new_day, new_week (array-like): True for the first interval of a day / week.
+        max_charge (float): Charge level at the start of a week (kWh).
+        drive_discharge (float): Energy used per day (kWh).
+        discharge_per_interval (float): Energy used per interval while driving (kWh).
+
+    Returns:
+        ndarray: Charge level after every interval (kWh).
+    """
+    return get_kernel('ev_drive_discharge', backend)(
+        np.ascontiguousarray(in_drive_window, dtype=np.bool_), np.ascontiguousarray(new_day, dtype=np.bool_),
+        np.ascontiguousarray(new_week, dtype=np.bool_), float(max_charge), float(drive_discharge), float(discharge_per_interval))
+
+
+def ev_weekly_correction(discharge_charge, charge_power, new_week, max_charge, backend=None):
+    """
+    Weekly correction of the EV charging: the charge power is reduced wherever the charge level
+    (level after driving plus the charging since the start of the week) exceeds max_charge.
+
+    Returns:
+        tuple: (adjusted_charge_power, updated_charge) arrays.
+    """
+    return get_kernel('ev_weekly_correction', backend)(
+        np.ascontiguousarray(discharge_charge, dtype=float), np.ascontiguousarray(charge_power, dtype=float),
+        np.ascontiguousarray(new_week, dtype=np.bool_), float(max_charge))
+
+
+def clamped_cumsum(values, segment_starts, initial_levels=None, lower=None, upper=None, backend=None):
+    """
+    Running sum per segment, starting from an initial level and clamped to [lower, upper]
+    after every step (charge levels of a schedule).
+
+    Returns:
+        ndarray: Level after every value.
+    """
+    n_segments = len(segment_starts) - 1
+    initial_levels = np.zeros(n_segments) if initial_levels is None else np.broadcast_to(np.asarray(initial_levels, dtype=float), (n_segments,))
+    lower = np.full(n_segments, -np.inf) if lower is None else np.broadcast_to(np.asarray(lower, dtype=float), (n_segments,))
+    upper = np.full(n_segments, np.inf) if upper is None else np.broadcast_to(np.asarray(upper, dtype=float), (n_segments,))
+    return get_kernel('clamped_cumsum', backend)(
+        np.ascontiguousarray(values, dtype=float), np.ascontiguousarray(segment_starts, dtype=np.int64),
+        np.ascontiguousarray(initial_levels), np.ascontiguousarray(lower), np.ascontiguousarray(upper))
+
+
+def ev_fleet(power_surplus, available, consumption, capacities, charge_limits, initial_levels, site_limits, grid_charging, backend=None):
+    """
+    Charge levels of a fleet of EVs that share a PV surplus and a site connection
+    (see ev_fleet.simulate_ev_fleet).
+
+    Returns:
+        tuple: (pv_charge, grid_charge, levels, unmet) arrays of shape (vehicles, T).
+    """
+    return get_kernel('ev_fleet', backend)(
+        np.ascontiguousarray(power_surplus, dtype=float), np.ascontiguousarray(available, dtype=np.bool_),
+        np.ascontiguousarray(consumption, dtype=float), np.ascontiguousarray(capacities, dtype=float),
+        np.ascontiguousarray(charge_limits, dtype=float), np.ascontiguousarray(initial_levels, dtype=float),
+        np.ascontiguousarray(site_limits, dtype=float), bool(grid_charging))
+
+
+def storage_flow(moves, ranks, gt_count, ge_count, positive_count, n_positions, E_start, E_end, E_min, E_max, first, tolerance=1e-12, backend=None):
+    """
+    Exact SOC path of the lossless storage problem for the prepared arrays of
+    smart_flow.solve_smart_flow.
+
+    Returns:
+        tuple: (path, feasible) with the SOC before the first and after every interval
+               (length T + 1) and False when the end level cannot be reached.
+    """
+    return get_kernel('storage_flow', backend)(
+        np.ascontiguousarray(moves, dtype=float), np.ascontiguousarray(ranks, dtype=np.int64),
+        np.ascontiguousarray(gt_count, dtype=np.int64), np.ascontiguousarray(ge_count, dtype=np.int64),
+        int(positive_count), int(n_positions), float(E_start), float(E_end), float(E_min), float(E_max), int(first), float(tolerance))
@@ -0,0 +1,77 @@
+import numpy as np
+from battery_kernels import HAVE_NUMBA, conventional_soc
+
+# Batched simulation of the conventional (self-consumption) battery.
+# All scenarios (capacities, households, ...) are advanced together: the loop runs over the
+# timesteps and every step is a NumPy operation over the scenario axis. With Numba installed
+# the same recurrence runs as a compiled kernel (see battery_kernels.py).
+
+
+def _scenario_vector(value, n_scenarios, default):
+    # Broadcast a scalar or per-scenario parameter to a (scenarios,) array
+    if value is None:
+        value = default
+    return np.broadcast_to(np.asarray(value, dtype=float), (n_scenarios,)).copy()
+
+
+def simulate_conventional_batch(net_power, capacities, charge_limits=None, discharge_limits=None, charge_efficiency=1.0, discharge_efficiency=1.0, initial_charge=0.0, backend=None):
+    """
+    Simulate the conventional battery for many scenarios at once.
+    A surplus (net_power > 0) charges the battery and a deficit (net_power < 0) discharges it,
+    limited by the free capacity, the stored energy and the charge/discharge limits.
+
+    Parameters:
+        net_power (array-like): Surplus (+) or deficit (-) per interval (kWh), shape (T,) or (scenarios, T).
+                                A single series is shared by all scenarios.
+        capacities (array-like): Capacity of every scenario (kWh), scalar or shape (scenarios,).
+        charge_limits (array-like): Maximum energy charged per interval (kWh), None for no limit.
+        discharge_limits (array-like): Maximum energy discharged per interval (kWh), None for no limit.
+        charge_efficiency (array-like): Fraction of the charged energy that is stored.
+        discharge_efficiency (array-like): Fraction of the discharged energy that reaches the load.
+        initial_charge (array-like): Stored energy before the first interval (kWh).
+        backend (str): 'numpy' for the loop over timesteps, 'numba' or 'python' for the kernel in
+                       battery_kernels.py. None uses 'numba' when available, else 'numpy'.
+
+    Returns:
+        tuple: (charge, discharge, current_charge), arrays of shape (scenarios, T) with the surplus
+               taken by the battery, the energy delivered to the load and the stored energy at the
+               end of every interval (kWh).
+    """
+    net_power = np.asarray(net_power, dtype=float)
+    capacities = np.atleast_1d(np.asarray(capacities, dtype=float))
+    n_scenarios = max(capacities.shape[0], net_power.shape[0] if net_power.ndim == 2 else 1)
+    n_intervals = net_power.shape[-1]
+    net_power = np.broadcast_to(net_power, (n_scenarios, n_intervals))
+
+    capacities = _scenario_vector(capacities, n_scenarios, None)
+    charge_limits = _scenario_vector(charge_limits, n_scenarios, np.inf)
+    discharge_limits = _scenario_vector(discharge_limits, n_scenarios, np.inf)
+    charge_efficiency = _scenario_vector(charge_efficiency, n_scenarios, 1.0)
+    discharge_efficiency = _scenario_vector(discharge_efficiency, n_scenarios, 1.0)
+    current_charge = _scenario_vector(initial_charge, n_scenarios, 0.0)
+
+    # Surplus and deficit per interval, zero on the other side
+    surplus = np.maximum(net_power, 0)
+    deficit = np.maximum(-net_power, 0)
+
+    if backend is None:
+        backend = 'numba' if HAVE_NUMBA else 'numpy'
+    if backend != 'numpy':
+        return conventional_soc(surplus, deficit, capacities, charge_limits, discharge_limits, charge_efficiency, discharge_efficiency, current_charge, backend=backend)
+
+    charge = np.zeros((n_scenarios, n_intervals))
+    discharge = np.zeros((n_scenarios, n_intervals))
+    stored = np.zeros((n_scenarios, n_intervals))
+
+    for t in range(n_intervals):
+        charge_amount = np.minimum(np.minimum(surplus[:, t], charge_limits), (capacities - current_charge) / charge_efficiency)
+        current_charge += charge_amount * charge_efficiency
+
+        discharge_amount = np.minimum(np.minimum(deficit[:, t], discharge_limits), current_charge * discharge_efficiency)
+        current_charge -= discharge_amount / discharge_efficiency
+
+        charge[:, t] = charge_amount
+        discharge[:, t] = discharge_amount
+        stored[:, t] = current_charge
+
+    return charge, discharge, stored
@@ -2,13 +2,53 @@ import pandas as pd
 import pvlib
 import numpy as np
 import matplotlib.pyplot as plt
+from solar_geometry import solar_geometry, cached_dni
+
+# Site and module constants of the PV system, shared by all PV calculations (and pv_sweep.py)
+LATITUDE = 50.93  # Hasselt, Belgium (degrees)
+LONGITUDE = 5.34
+ALBEDO = 0.2  # Ground reflectance
+TEMP_COEFF = -0.004  # Temperature coefficient (per °C)
+
+def temperature_column(tilt_module):
+    """
+    Return the ambient temperature column used for a module tilt (roof vs. rack measurement).
+    """
+    return "T_RV_degC" if tilt_module > np.radians(10) else "T_CommRoof_degC"
+
+
+def poa_global_broadcast(surface_tilt, surface_azimuth, solar_zenith, solar_azimuth, dni, ghi, dhi, albedo=ALBEDO):
+    """
+    Calculate the isotropic plane-of-array irradiance for many orientations in one pass.
+    Same model as get_total_irradiance in calculation_power_output, broadcast over an
+    orientation axis.
+
+    Parameters:
+        surface_tilt (array-like): Tilt of every orientation (degrees), shape (orientations,).
+        surface_azimuth (array-like): Azimuth of every orientation (degrees), shape (orientations,).
+        solar_zenith, solar_azimuth (array-like): Solar position (degrees), shape (times,).
+        dni, ghi, dhi (array-like): Irradiance (W/m²), shape (times,).
+        albedo (float): Ground reflectance.
+
+    Returns:
+        ndarray: Plane-of-array irradiance (W/m²) of shape (orientations, times).
+    """
+    surface_tilt = np.asarray(surface_tilt, dtype=float)[:, None]
+    surface_azimuth = np.asarray(surface_azimuth, dtype=float)[:, None]
+
+    projection = pvlib.irradiance.aoi_projection(surface_tilt, surface_azimuth, np.asarray(solar_zenith), np.asarray(solar_azimuth))
+    aoi = np.degrees(np.arccos(projection))
+    sky_diffuse = pvlib.irradiance.isotropic(surface_tilt, np.asarray(dhi))
+    ground_diffuse = pvlib.irradiance.get_ground_diffuse(surface_tilt, np.asarray(ghi), albedo=albedo)
+    return pvlib.irradiance.poa_components(aoi, np.asarray(dni), sky_diffuse, ground_diffuse)['poa_global']
+
 
 def calculation_power_output(WP_panel, N_module, tilt_module, azimuth_module, irradiance_data):
     # Constants for PV system
-    albedo = 0.2  # Ground reflectance
-    temp_coeff = -0.004  # Temperature coefficient (per °C)
-    latitude = 50.93   # Hasselt, Belgium (degrees)
-    longitude = 5.34
+    albedo = ALBEDO
+    temp_coeff = TEMP_COEFF
+    latitude = LATITUDE
+    longitude = LONGITUDE
 
     # Calculate DC capacity (in W)
     dc_capacity = N_module * WP_panel  
@@ -23,22 +63,14 @@ def calculation_power_output(WP_panel, N_module, tilt_module, azimuth_module, ir
     # Convert DateTime to UTC for solar position calculations
     irradiance_data["DateTime_UTC"] = irradiance_data["DateTime"].dt.tz_convert("UTC")
 
-    # Calculate solar position using the DateTime_UTC column
-    solar_position = pvlib.solarposition.get_solarposition(
-        time=irradiance_data["DateTime_UTC"], 
-        latitude=latitude, 
-        longitude=longitude
-    )
+    # Solar position, extraterrestrial irradiance and airmass (cached, see solar_geometry.py)
+    solar_position = solar_geometry(irradiance_data["DateTime_UTC"], latitude, longitude)
 
     # Align solar_position with irradiance_data by copying the index
     solar_position.index = irradiance_data.index
 
     # Calculate DNI (Direct Normal Irradiance)
-    irradiance_data["DNI"] = pvlib.irradiance.dni(
-        ghi=irradiance_data["GlobRad"],
-        dhi=irradiance_data["DiffRad"],
-        zenith=solar_position["zenith"]
-    )
+    irradiance_data["DNI"] = cached_dni(irradiance_data["GlobRad"], irradiance_data["DiffRad"], solar_position)
 
     # Calculate POA (Plane-of-Array) irradiance
     poa = pvlib.irradiance.get_total_irradiance(
@@ -49,8 +81,8 @@ def calculation_power_output(WP_panel, N_module, tilt_module, azimuth_module, ir
         dni=irradiance_data["DNI"],
         ghi=irradiance_data["GlobRad"],
         dhi=irradiance_data["DiffRad"],
-        dni_extra=None, 
-        airmass=None,
+        dni_extra=solar_position["dni_extra"],
+        airmass=solar_position["airmass"],
         albedo=albedo,
         surface_type=None,
         model='isotropic',
@@ -58,7 +90,7 @@ def calculation_power_output(WP_panel, N_module, tilt_module, azimuth_module, ir
     )
 
     # Determine the ambient temperature column depending on the tilt angle
-    irradiance_data["T_cell"] = irradiance_data["T_RV_degC"] if tilt_module > np.radians(10) else irradiance_data["T_CommRoof_degC"]
+    irradiance_data["T_cell"] = irradiance_data[temperature_column(tilt_module)]
 
     # Calculate the DC power output using the PVWatts model and convert from W to kW
     irradiance_data["Power_Output_kW"] = pvlib.pvsystem.pvwatts_dc(
@@ -71,4 +103,77 @@ def calculation_power_output(WP_panel, N_module, tilt_module, azimuth_module, ir
     # Convert power to energy (kWh) for 1-minute intervals
     irradiance_data["Power_Output_kWh"] = irradiance_data["Power_Output_kW"] / 60
     
-    return irradiance_data[["DateTime", "Power_Output_kWh"]]
\ No newline at end of file
+    return irradiance_data[["DateTime", "Power_Output_kWh"]]
+
+def pv_system_spec(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2):
+    """
+    Build the PV system spec of the default roof: two arrays of N_module/2 panels with the same
+    tilt and the azimuths azimuth_module_1 and azimuth_module_2.
+
+    Returns:
+        list: Sub-arrays as used by calculation_power_output_multi.
+    """
+    return [
+        {'tilt': tilt_module, 'azimuth': azimuth, 'N_module': N_module / 2, 'WP_panel': WP_panel, 'temperature': temperature_column(tilt_module)}
+        for azimuth in [azimuth_module_1, azimuth_module_2]
+    ]
+
+
+def sub_array_power_output(pv_system, irradiance_data):
+    """
+    Calculate the output of every sub-array of a PV system in one pass.
+    The solar position and DNI are shared, the plane-of-array irradiance and PVWatts output
+    are calculated for all sub-arrays at once (see poa_global_broadcast).
+
+    Parameters:
+        pv_system (list): Sub-arrays, each a dict with 'tilt' and 'azimuth' (degrees), 'N_module',
+                          'WP_panel' (W) and optionally 'temperature' (ambient temperature column,
+                          chosen from the tilt like calculation_power_output when missing).
+        irradiance_data (DataFrame): 1-minute irradiance data with 'DateTime', 'GlobRad', 'DiffRad'
+                                     and the temperature columns.
+
+    Returns:
+        tuple: (datetimes, power_output_kwh) with the Europe/Brussels timestamps (Series) and the
+               energy per minute (kWh) of every sub-array, shape (sub-arrays, rows).
+    """
+    # Constants for PV system
+    albedo = ALBEDO
+    temp_coeff = TEMP_COEFF
+    latitude = LATITUDE
+    longitude = LONGITUDE
+
+    # Ensure DateTime is a timezone-aware datetime in Europe/Brussels timezone
+    datetimes = pd.to_datetime(irradiance_data["DateTime"])
+    if datetimes.dt.tz is None:
+        datetimes = datetimes.dt.tz_localize("Europe/Brussels", ambiguous="NaT", nonexistent="NaT")
+    else:
+        datetimes = datetimes.dt.tz_convert("Europe/Brussels")
+
+    solar_position = solar_geometry(datetimes.dt.tz_convert("UTC"), latitude, longitude)
+    ghi = irradiance_data["GlobRad"].values
+    dhi = irradiance_data["DiffRad"].values
+    dni = cached_dni(ghi, dhi, solar_position)
+
+    tilts = [array['tilt'] for array in pv_system]
+    azimuths = [array['azimuth'] for array in pv_system]
+    poa_global = poa_global_broadcast(tilts, azimuths, solar_position["zenith"].values, solar_position["azimuth"].values, dni, ghi, dhi, albedo=albedo)
+
+    # Ambient temperature and DC capacity (W) of every sub-array
+    temp_cell = np.stack([irradiance_data[array.get('temperature', temperature_column(array['tilt']))].values for array in pv_system])
+    dc_capacity = np.array([array['N_module'] * array['WP_panel'] for array in pv_system], dtype=float)[:, None]
+
+    # DC power of every sub-array (kW), converted to energy per minute (kWh)
+    power_kw = pvlib.pvsystem.pvwatts_dc(g_poa_effective=poa_global, temp_cell=temp_cell, pdc0=dc_capacity, gamma_pdc=temp_coeff) / 1000
+    return datetimes, power_kw / 60
+
+
+def calculation_power_output_multi(pv_system, irradiance_data):
+    """
+    Calculate the total output of a PV system with any number of sub-arrays in one pass
+    (see sub_array_power_output).
+
+    Returns:
+        DataFrame: 'DateTime' (Europe/Brussels) and the total 'Power_Output_kWh' per minute.
+    """
+    datetimes, power_output_kwh = sub_array_power_output(pv_system, irradiance_data)
+    return pd.DataFrame({"DateTime": datetimes, "Power_Output_kWh": power_output_kwh.sum(axis=0)}, index=irradiance_data.index)
@@ -1,51 +1,120 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from calculations_power import calculation_power_output
+from calculations_power import calculation_power_output_multi, sub_array_power_output, pv_system_spec
+from gap_filling import fill_gaps
 
-def correct_belpex_data(belpex_data):
-    belpex_data = belpex_data.copy()  # Avoid SettingWithCopyWarning
+# Numeric columns of the 1-minute irradiance file
+IRRADIANCE_COLUMNS = ['GlobRad', 'DiffRad', 'T_RV_degC', 'T_CommRoof_degC']
 
-    # Ensure the 'Euro' column is cleaned and formatted
-    belpex_data['Euro'] = belpex_data['Euro'].str.replace(r'[^\d.,-]', '', regex=True)
-    belpex_data['Euro'] = belpex_data['Euro'].str.replace(',', '.').astype(float)
+# Format of the 'Date' column of the Belpex exports
+BELPEX_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
 
-    # Append '00:00' to rows where only the date is present (no time)
-    belpex_data['Date'] = belpex_data['Date'].apply(lambda x: x if ':' in str(x) else f"{x} 00:00")
 
-    # Convert the 'Date' column to datetime format (if not already)
-    belpex_data['datetime'] = pd.to_datetime(belpex_data['Date'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
+def clean_belpex_prices(euro):
+    # Strip the currency signs and spaces and use a decimal point (vectorized)
+    if pd.api.types.is_numeric_dtype(euro):
+        return euro.astype(float)
+    euro = euro.astype(str).str.replace(r'[^\d.,-]', '', regex=True)
+    return euro.str.replace(',', '.', regex=False).astype(float)
+
+
+def parse_belpex_dates(dates, date_format=BELPEX_DATE_FORMAT):
+    # Rows with only a date (no time) do not match the format and become NaT
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    return pd.to_datetime(dates, format=date_format, errors='coerce')
+
+
+def change_year(datetimes, year=2000):
+    # Vectorized replace(year=year) of a naive datetime column
+    return pd.to_datetime(pd.DataFrame({
+        'year': year,
+        'month': datetimes.dt.month,
+        'day': datetimes.dt.day,
+        'hour': datetimes.dt.hour,
+        'minute': datetimes.dt.minute,
+    }))
+
+
+def correct_belpex_data(belpex_data, date_format=BELPEX_DATE_FORMAT):
+    """
+    Clean the Belpex prices and resample them to 15-minute intervals in the year 2000.
+    Works for hourly files and for native quarter-hour files.
+
+    Parameters:
+        belpex_data (DataFrame): Belpex export with columns 'Date' and 'Euro'.
+        date_format (str): Format of the 'Date' strings.
+
+    Returns:
+        DataFrame: 15-minute prices with columns 'datetime' and 'Euro'.
+    """
+    belpex_data = pd.DataFrame({
+        'datetime': parse_belpex_dates(belpex_data['Date'], date_format),
+        'Euro': clean_belpex_prices(belpex_data['Euro']),
+    })
 
     # Drop rows with invalid datetime values (NaT)
-    belpex_data = belpex_data.dropna(subset=['datetime']).copy()
+    belpex_data = belpex_data.dropna(subset=['datetime'])
 
     # Drop rows where the date is February 29
     belpex_data = belpex_data[~((belpex_data['datetime'].dt.month == 2) & (belpex_data['datetime'].dt.day == 29))]
 
-    # Drop duplicate datetime values by aggregating numeric columns
-    numeric_columns = belpex_data.select_dtypes(include='number').columns
-    belpex_data = belpex_data.groupby('datetime', as_index=False)[numeric_columns].mean()
+    # Drop duplicate datetime values (DST change) by taking the mean price
+    belpex_data = belpex_data.groupby('datetime', as_index=False)['Euro'].mean()
 
-    # Resample to 15-minute intervals using 'datetime' as the index
-    belpex_data = belpex_data.set_index('datetime').resample('15min').ffill().reset_index()
+    # Resample to 15-minute intervals and add the missing rows till 23:45:00 of the last day
+    belpex_data = belpex_data.set_index('datetime').resample('15min').ffill()
+    last_quarter = belpex_data.index[-1].normalize() + pd.Timedelta(hours=23, minutes=45)
+    belpex_data = belpex_data.reindex(pd.date_range(belpex_data.index[0], last_quarter, freq='15min'), method='ffill')
+    belpex_data = belpex_data.rename_axis('datetime').reset_index()
 
     # Change the year of belpex_data to 2000
-    belpex_data['datetime'] = belpex_data['datetime'].apply(lambda x: x.replace(year=2000))
-
-    # Add missing rows till 23:45:00
-    last_row = belpex_data.iloc[-1]
-    last_datetime = last_row['datetime']
-    additional_rows = []
-    for i in range(1, 4):
-        new_datetime = last_datetime + pd.Timedelta(minutes=15 * i)
-        new_row = last_row.copy()
-        new_row['datetime'] = new_datetime
-        additional_rows.append(new_row)
-    belpex_data = pd.concat([belpex_data, pd.DataFrame(additional_rows)], ignore_index=True)
+    belpex_data['datetime'] = change_year(belpex_data['datetime'])
 
     return belpex_data[["datetime", "Euro"]]
 
 
+def read_belpex_files(paths):
+    """
+    Read one or more Belpex csv exports (hourly or quarter-hour) into one DataFrame.
+    """
+    return pd.concat([
+        pd.read_csv(path, delimiter=';', encoding='ISO-8859-1', usecols=['Date', 'Euro'], dtype=str)
+        for path in paths
+    ], ignore_index=True)
+
+
+def belpex_price_array(paths, n_intervals=35040, date_format=BELPEX_DATE_FORMAT):
+    """
+    Load several years of Belpex prices (hourly or native quarter-hour files) in one pass and
+    align every year to the 15-minute axis of the data returned by all_correct_data_files.
+
+    Parameters:
+        paths (list): Paths of the Belpex csv exports; a file may contain several years.
+        n_intervals (int): Length of the 15-minute axis.
+        date_format (str): Format of the 'Date' strings.
+
+    Returns:
+        tuple: (years, prices) where prices[i] equals data['Euro'] for the prices of years[i].
+    """
+    belpex_data = read_belpex_files(paths)
+    belpex_data['Date'] = parse_belpex_dates(belpex_data['Date'], date_format)
+    belpex_data = belpex_data.dropna(subset=['Date'])
+    source_years = belpex_data['Date'].dt.year
+
+    years = np.sort(source_years.unique())
+    prices = np.full((len(years), n_intervals), np.nan)
+    for i, year in enumerate(years):
+        euro = correct_belpex_data(belpex_data[source_years == year])['Euro'].values[:n_intervals]
+        prices[i, :len(euro)] = euro
+
+    # Same shift as change_order_dates: the last day's prices move to the beginning
+    prices = np.roll(prices, 96, axis=1)
+
+    return years, prices
+
+
 def correct_load_profile(load_profile):
     load_profile = load_profile.copy()  # Avoid SettingWithCopyWarning
 
@@ -56,57 +125,25 @@ def correct_load_profile(load_profile):
     load_profile = load_profile.dropna(subset=['Datum_Startuur']).copy()
 
     # Drop rows where the date is February 29
-    load_profile = load_profile[~((load_profile['Datum_Startuur'].dt.month == 2) & (load_profile['Datum_Startuur'].dt.day == 29))]
+    load_profile = load_profile[~((load_profile['Datum_Startuur'].dt.month == 2) & (load_profile['Datum_Startuur'].dt.day == 29))].copy()
 
-    # Convert the 'Volume_Afname_kWh' column to numeric and drop invalid rows
+    # Convert the 'Volume_Afname_kWh' column to numeric, invalid values become missing data
     load_profile['Volume_Afname_kWh'] = pd.to_numeric(load_profile['Volume_Afname_kWh'], errors='coerce')
-    load_profile = load_profile.dropna(subset=['Volume_Afname_kWh']).copy()
 
     # Change the year of 'Datum_Startuur' to 2000
     load_profile['Datum_Startuur'] = load_profile['Datum_Startuur'].apply(lambda x: x.replace(year=2000))
 
-    # Identify periods with missing data
-    missing_periods_load = load_profile[load_profile['Volume_Afname_kWh'].isna()]
-
-    # Group by consecutive missing periods
-    missing_periods_load['group'] = (missing_periods_load.index.to_series().diff() != pd.Timedelta('15min')).cumsum()
-
-    for group_load, period_load in missing_periods_load.groupby('group'):
-        start_date_load = period_load.index.min().normalize()
-        end_date_load = period_load.index.max().normalize()
-
-        # Calculate the number of days in the period
-        num_days_load = (end_date_load - start_date_load).days + 1
-
-        # Get the data for the days before and after the period
-        before_period_load = load_profile.loc[start_date_load - pd.Timedelta(days=num_days_load):start_date_load - pd.Timedelta(minutes=15)]
-        after_period_load = load_profile.loc[end_date_load + pd.Timedelta(minutes=15):end_date_load + pd.Timedelta(days=num_days_load)]
-
-        # Calculate the total load for the days before and after the period
-        before_load_load = before_period_load['Volume_Afname_kWh'].sum()
-        after_load_load = after_period_load['Volume_Afname_kWh'].sum()
-
-        # Fill the missing data with the data from the day with the lowest load
-        if before_load_load < after_load_load:
-            fill_data_load = before_period_load['Volume_Afname_kWh']
-        else:
-            fill_data_load = after_period_load['Volume_Afname_kWh']
-
-        # Repeat the fill data to match the length of the missing period
-        fill_data_load = fill_data_load.iloc[:len(period_load)].values
+    # Fill periods with missing data with the data of the neighbouring days with the lowest load
+    values = load_profile['Volume_Afname_kWh'].values
+    load_profile['Volume_Afname_kWh'] = fill_gaps(values, np.isnan(values), slots_per_day=96)
 
-        # Fill the missing period with the fill data
-        load_profile.loc[period_load.index, 'Volume_Afname_kWh'] = fill_data_load
-
-    # Reset index to keep 'Datum_Startuur' as a column
-    load_profile.reset_index(inplace=True)
+    # Drop rows that could not be filled
+    load_profile = load_profile.dropna(subset=['Volume_Afname_kWh']).reset_index(drop=True)
 
     return load_profile[["Datum_Startuur", "Volume_Afname_kWh"]]
 
 
-def correct_irradiance_data(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, irradiance_data):
-    irradiance_data = irradiance_data.copy()  # Avoid SettingWithCopyWarning
-
+def prepare_irradiance_data(irradiance_data):
     # Ensure the 'DateTime' column is in datetime format
     irradiance_data['DateTime'] = pd.to_datetime(irradiance_data['DateTime'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
 
@@ -117,30 +154,20 @@ def correct_irradiance_data(WP_panel, N_module, tilt_module, azimuth_module_1, a
     irradiance_data = irradiance_data[~((irradiance_data['DateTime'].dt.month == 2) & (irradiance_data['DateTime'].dt.day == 29))]
 
     # Ensure numeric columns are properly formatted
-    numeric_columns = ['GlobRad', 'DiffRad', 'T_RV_degC', 'T_CommRoof_degC']  # Replace with actual column names
-    for col in numeric_columns:
+    for col in IRRADIANCE_COLUMNS:
         irradiance_data[col] = pd.to_numeric(irradiance_data[col], errors='coerce')
 
-    # Initialize power_output as a DataFrame
-    power_output_1 = pd.DataFrame()
-    power_output_2 = pd.DataFrame()
+    return irradiance_data
 
-    power_output_1 = calculation_power_output(WP_panel, N_module/2, tilt_module, azimuth_module_1, irradiance_data)
-    power_output_2 = calculation_power_output(WP_panel, N_module/2, tilt_module, azimuth_module_2, irradiance_data)
 
-    # Combine power_output_1 and power_output_2 by summing 'Power_Output_kWh' for matching 'DateTime'
-    power_output = pd.merge(
-        power_output_1, 
-        power_output_2, 
-        on='DateTime', 
-        suffixes=('_1', '_2')
-    )
-
-    # Sum the 'Power_Output_kWh' columns from both dataframes
-    power_output['Power_Output_kWh'] = power_output['Power_Output_kWh_1'] + power_output['Power_Output_kWh_2']
+def correct_irradiance_data(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, irradiance_data, pv_system=None):
+    irradiance_data = irradiance_data.copy()  # Avoid SettingWithCopyWarning
+    irradiance_data = prepare_irradiance_data(irradiance_data)
 
-    # Drop the intermediate columns
-    power_output = power_output[['DateTime', 'Power_Output_kWh']]
+    # Total output of the sub-arrays of the roof, calculated in one pass
+    if pv_system is None:
+        pv_system = pv_system_spec(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
+    power_output = calculation_power_output_multi(pv_system, irradiance_data)
 
     # Set the 'DateTime' column as the index
     power_output = power_output.set_index('DateTime', drop=False)
@@ -148,64 +175,142 @@ def correct_irradiance_data(WP_panel, N_module, tilt_module, azimuth_module_1, a
     # Resample to 15-minute intervals
     power_output = power_output.set_index('DateTime').resample('15min').sum().reset_index()
 
+    return correct_power_output(power_output)
+
+
+def correct_irradiance_data_streaming(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, irradiance_path, chunksize=100000, pv_system=None, inverter_limit_kw=None):
+    """
+    Streaming version of correct_irradiance_data that reads the 1-minute irradiance csv in chunks.
+    Only the needed columns are parsed, the PV power is calculated per chunk and immediately
+    summed into 15-minute bins, so the peak memory is set by the chunk size and not by the file size.
+
+    Parameters:
+        WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2: Roof parameters.
+        irradiance_path (str): Path of the 1-minute irradiance csv file.
+        chunksize (int): Number of rows read per chunk.
+        pv_system (list): Sub-arrays of the PV system (see calculation_power_output_multi), or None
+                          for the two arrays defined by the roof parameters.
+        inverter_limit_kw (float): AC limit of the inverter (kW); the 1-minute output of every chunk
+                                   is clipped to this power before binning. None for no clipping.
+
+    Returns:
+        DataFrame: 15-minute power output with columns 'DateTime' and 'Power_Output_kWh'.
+    """
+    dtypes = {'DateTime': str}
+    dtypes.update({col: 'float64' for col in IRRADIANCE_COLUMNS})
+    reader = pd.read_csv(irradiance_path, usecols=['DateTime'] + IRRADIANCE_COLUMNS, dtype=dtypes, chunksize=chunksize)
+
+    if pv_system is None:
+        pv_system = pv_system_spec(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
+
+    binned_chunks = []
+    for chunk in reader:
+        chunk = prepare_irradiance_data(chunk)
+        if chunk.empty:
+            continue
+
+        power_output = calculation_power_output_multi(pv_system, chunk)
+        if inverter_limit_kw is not None:
+            power_output['Power_Output_kWh'] = np.minimum(power_output['Power_Output_kWh'], inverter_limit_kw / 60)
+
+        # Sum into 15-minute bins (floored in UTC, ambiguous DST times are NaT and dropped like in resample)
+        bins = power_output['DateTime'].dt.tz_convert('UTC').dt.floor('15min')
+        binned_chunks.append(power_output['Power_Output_kWh'].groupby(bins).sum())
+
+    # Bins split over two chunks are added together
+    return binned_power_output(pd.concat(binned_chunks).groupby(level=0).sum())
+
+
+def binned_power_output(binned):
+    """
+    Turn 15-minute sums of the PV output (indexed by the UTC start of the bin) into the
+    corrected power_output DataFrame.
+    """
+    # Include empty 15-minute bins (as resample does) and go back to local time
+    full_index = pd.date_range(binned.index.min(), binned.index.max(), freq='15min')
+    power_output = binned.reindex(full_index, fill_value=0)
+    power_output.index = power_output.index.tz_convert('Europe/Brussels')
+
+    power_output = pd.DataFrame({'DateTime': power_output.index, 'Power_Output_kWh': power_output.values})
+
+    return correct_power_output(power_output)
+
+
+def kwp_profiles_streaming(irradiance_path, orientations, chunksize=100000):
+    """
+    Calculate the 15-minute PV output per kWp for a list of orientations, reading the
+    irradiance csv in chunks. Every chunk is summed into 15-minute bins before the next one is
+    read, so the memory is bounded by the chunk size and the 15-minute year. PVWatts is linear
+    in the DC capacity, so the output of any array size is the profile times its kWp (see
+    power_output_from_kwp_profiles).
+
+    Parameters:
+        irradiance_path (str): Path of the 1-minute irradiance csv file.
+        orientations (list): Dicts with 'tilt', 'azimuth' and optionally 'temperature'.
+        chunksize (int): Number of rows read per chunk.
+
+    Returns:
+        tuple: (bin_starts, profiles) with the UTC start of every 15-minute bin and the energy
+               per bin per kWp (kWh), shape (orientations, bins).
+    """
+    dtypes = {'DateTime': str}
+    dtypes.update({col: 'float64' for col in IRRADIANCE_COLUMNS})
+    reader = pd.read_csv(irradiance_path, usecols=['DateTime'] + IRRADIANCE_COLUMNS, dtype=dtypes, chunksize=chunksize)
+
+    # One kWp per orientation
+    unit_system = [dict(orientation, N_module=1, WP_panel=1000) for orientation in orientations]
+
+    binned_chunks = []
+    for chunk in reader:
+        chunk = prepare_irradiance_data(chunk)
+        if chunk.empty:
+            continue
+        datetimes, power_output_kwh = sub_array_power_output(unit_system, chunk)
+
+        # Sum into 15-minute bins (floored in UTC, ambiguous DST times are NaT and dropped like in resample)
+        bins = pd.DatetimeIndex(datetimes).tz_convert('UTC').floor('15min')
+        binned_chunks.append(pd.DataFrame(power_output_kwh.T).groupby(bins).sum())
+
+    # Bins split over two chunks are added together
+    binned = pd.concat(binned_chunks).groupby(level=0).sum()
+    return pd.DatetimeIndex(binned.index), binned.values.T
+
+
+def power_output_from_kwp_profiles(bin_starts, profiles, pv_system):
+    """
+    Scale the 15-minute per-kWp profiles to a PV system.
+
+    Parameters:
+        bin_starts (DatetimeIndex): UTC start of every 15-minute bin of the profiles.
+        profiles (ndarray): Energy per bin per kWp (kWh), one row per sub-array of pv_system.
+        pv_system (list): Sub-arrays with 'N_module' and 'WP_panel' (W).
+
+    Returns:
+        DataFrame: 15-minute power output with columns 'DateTime' and 'Power_Output_kWh'.
+    """
+    kwp = np.array([array['N_module'] * array['WP_panel'] / 1000 for array in pv_system], dtype=float)
+    power_output_kwh = (profiles * kwp[:, None]).sum(axis=0)
+    return binned_power_output(pd.Series(power_output_kwh, index=bin_starts))
+
+
+def correct_power_output(power_output):
+    power_output = power_output.copy()  # Avoid SettingWithCopyWarning
+
     # Change the year of 'DateTime' to 2000
     power_output['DateTime'] = power_output['DateTime'].apply(lambda x: x.replace(year=2000))
 
     # Drop rows with invalid datetime values (NaT) after year replacement
     power_output = power_output.dropna(subset=['DateTime']).copy()
 
-    # Identify zero power output periods
-    power_output['is_zero'] = power_output['Power_Output_kWh'] == 0
-
-    # Group consecutive zero periods
-    power_output['group'] = (~power_output['is_zero']).cumsum()
-
-    # Identify groups where the zero period lasts more than 1 day (96 intervals for 15-minute data)
-    zero_groups = power_output[power_output['is_zero']].groupby('group').size()
-    long_zero_groups = zero_groups[zero_groups > 288].index
-
-    # Handle long zero periods
-    for group in long_zero_groups:
-        period_power = power_output[power_output['group'] == group]
-
-        # Ensure period_power contains only full days with power == 0
-        full_days = period_power.groupby(period_power['DateTime'].dt.date).filter(lambda x: len(x) == 96)
-        period_power = period_power[period_power['DateTime'].dt.date.isin(full_days['DateTime'].dt.date)]
-
-        # Get the start and end indices of the missing group
-        start_idx = period_power.index.min()
-        end_idx = period_power.index.max()
-
-        # Calculate the length of the missing group
-        group_length = len(period_power)
+    # Fill zero output periods of more than 3 days (outages of the measurement) with the
+    # neighbouring full days that have the lowest output; shorter zero periods are kept
+    values = power_output['Power_Output_kWh'].values
+    day_ids = pd.factorize(power_output['DateTime'].dt.date)[0]
+    power_output['Power_Output_kWh'] = fill_gaps(values, values == 0, min_length=289, slots_per_day=96, day_ids=day_ids)
 
-        # Create fake groups before and after the missing group
-        before_period_power = power_output.loc[start_idx - group_length:start_idx - 1]
-        after_period_power = power_output.loc[end_idx + 1:end_idx + group_length]
-
-        # Calculate total power output for fake groups
-        before_total = before_period_power['Power_Output_kWh'].sum()
-        after_total = after_period_power['Power_Output_kWh'].sum()
-
-        # Choose the fake group with the lowest total power output
-        if before_total < after_total:
-            fill_data = before_period_power['Power_Output_kWh'].values
-        else:
-            fill_data = after_period_power['Power_Output_kWh'].values
-
-        # Replace the missing group with the chosen fake group
-        power_output.loc[period_power.index, 'Power_Output_kWh'] = fill_data
-
-    # Preserve single-day zero periods (do not change their values)
-    single_day_groups = zero_groups[zero_groups <= 288].index
-    for group in single_day_groups:
-        power_output.loc[power_output['group'] == group, 'Power_Output_kWh'] = 0
-
-    # Drop helper columns
-    power_output = power_output.drop(columns=['is_zero', 'group'])
-    
     return power_output[["DateTime", "Power_Output_kWh"]]
 
+
 def all_correct_data_files(power_output_old, load_profile_old, belpex_data_old, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2):
     power_output_old = power_output_old.copy()  # Avoid SettingWithCopyWarning
     load_profile_old = load_profile_old.copy()  # Avoid SettingWithCopyWarning
@@ -217,6 +322,11 @@ def all_correct_data_files(power_output_old, load_profile_old, belpex_data_old,
     #belpex_data = correct_belpex_data(belpex_data_old)  # File with date-time and index values
     belpex_data = belpex_data_old  # File with date-time and index values
 
+    data = align_corrected_data(power_output, load_profile, belpex_data)
+
+    return data, power_output, load_profile, belpex_data
+
+def align_corrected_data(power_output, load_profile, belpex_data):
     # Ensure datetime is timezone-aware or convert if already aware
     belpex_data["datetime"] = pd.to_datetime(belpex_data["datetime"])  # Ensure datetime is in datetime format
     if belpex_data["datetime"].dt.tz is None:
@@ -234,7 +344,7 @@ def all_correct_data_files(power_output_old, load_profile_old, belpex_data_old,
     data['Euro'] = belpex_data['Euro']
     data = change_order_dates(data)
 
-    return data, power_output, load_profile, belpex_data
+    return data
 
 def change_order_dates(data):
     # Shift 'Euro' column: move the last day's values to the beginning
@@ -0,0 +1,260 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from calculations_power import pv_system_spec, temperature_column
+from correct_data_files import kwp_profiles_streaming, power_output_from_kwp_profiles, align_corrected_data, correct_irradiance_data_streaming
+from day_matrix import write_day_matrix_store, open_day_matrix_store
+
+# Cache for the aligned 15-minute data produced by all_correct_data_files.
+# Entries are stored as .npz files (one array per column) and keyed by a hash of the
+# input files plus the roof parameters, so every scenario with the same roof
+# configuration only pays for the PV modelling and data correction once.
+CACHE_DIR = 'data/cache'
+MAX_CACHE_BYTES = 200 * 1024 * 1024  # Size bound of the cache directory (200 MB)
+CACHE_VERSION = 5  # Bump when the correction code changes so old entries are not reused
+
+_file_hashes = {}  # In-process memo of file hashes, keyed by (path, size, mtime)
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """
+    Calculate the SHA-256 hash of a file, reading it in chunks.
+
+    Parameters:
+        path (str): Path of the file.
+        chunk_size (int): Number of bytes read per chunk.
+
+    Returns:
+        str: Hexadecimal hash of the file contents.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _file_hashes:
+        return _file_hashes[memo_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    _file_hashes[memo_key] = sha.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def cache_key(input_paths, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, pv_system=None, inverter_limit_kw=None):
+    """
+    Build the cache key from the input files and the roof parameters.
+
+    Parameters:
+        input_paths (list): Paths of the irradiance, load profile and Belpex files.
+        WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2: Roof parameters.
+        pv_system (list): Sub-arrays of the PV system, or None for the roof parameters.
+        inverter_limit_kw (float): AC limit of the inverter, or None for no clipping.
+
+    Returns:
+        str: Cache key.
+    """
+    sha = hashlib.sha256()
+    for path in input_paths:
+        sha.update(file_hash(path).encode())
+    parameters = [CACHE_VERSION, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2]
+    sha.update(json.dumps([float(p) for p in parameters]).encode())
+    if pv_system is not None:
+        sha.update(json.dumps(pv_system, sort_keys=True, default=float).encode())
+    if inverter_limit_kw is not None:
+        sha.update(json.dumps(['inverter_limit_kw', float(inverter_limit_kw)]).encode())
+    return sha.hexdigest()[:32]
+
+
+def _frame_to_arrays(df, prefix):
+    # Store every column as a plain numpy array; tz-aware datetimes are stored in UTC
+    arrays = {}
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        tz = None
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            tz = str(series.dt.tz)
+            series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+        arrays[f'{prefix}{len(columns)}'] = series.to_numpy()
+        columns.append({'name': col, 'tz': tz})
+    return arrays, columns
+
+
+def _arrays_to_frame(npz, prefix, columns):
+    df = pd.DataFrame()
+    for i, col in enumerate(columns):
+        values = npz[f'{prefix}{i}']
+        if col['tz'] is not None:
+            df[col['name']] = pd.Series(values).dt.tz_localize('UTC').dt.tz_convert(col['tz'])
+        else:
+            df[col['name']] = values
+    return df
+
+
+def save_corrected_data(path, data, power_output):
+    """
+    Save data and power_output to a .npz cache file (written atomically).
+    """
+    data_arrays, data_columns = _frame_to_arrays(data, 'data_')
+    power_arrays, power_columns = _frame_to_arrays(power_output, 'power_output_')
+    meta = json.dumps({'data': data_columns, 'power_output': power_columns})
+
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, meta=np.array(meta), **data_arrays, **power_arrays)
+    os.replace(tmp_path, path)
+
+
+def load_corrected_data(path):
+    """
+    Load data and power_output from a .npz cache file.
+    """
+    with np.load(path) as npz:
+        meta = json.loads(str(npz['meta']))
+        data = _arrays_to_frame(npz, 'data_', meta['data'])
+        power_output = _arrays_to_frame(npz, 'power_output_', meta['power_output'])
+    return data, power_output
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, pattern_prefix='corrected_'):
+    """
+    Remove the least recently used cache entries until the cache fits within max_bytes.
+    The day-matrix store of an entry (days_<key>) is removed together with the entry.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.startswith(pattern_prefix) and name.endswith('.npz') and not name.endswith('.tmp.npz'):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            store_dir = os.path.join(cache_dir, 'days_' + name[len(pattern_prefix):-len('.npz')])
+            size = stat.st_size + (_directory_size(store_dir) if os.path.isdir(store_dir) else 0)
+            entries.append((stat.st_mtime, size, path, store_dir))
+
+    total_size = sum(size for _, size, _, _ in entries)
+    for _, size, path, store_dir in sorted(entries):  # Oldest (least recently used) first
+        if total_size <= max_bytes:
+            break
+        os.remove(path)
+        shutil.rmtree(store_dir, ignore_errors=True)
+        total_size -= size
+
+
+def _orientation(array):
+    # Orientation of a sub-array, the part of the spec that determines its per-kWp profile
+    return {'tilt': float(array['tilt']), 'azimuth': float(array['azimuth']), 'temperature': array.get('temperature', temperature_column(array['tilt']))}
+
+
+def cached_kwp_profiles(irradiance_path, pv_system, cache_dir=CACHE_DIR, max_cache_bytes=MAX_CACHE_BYTES):
+    """
+    Return the 15-minute per-kWp PV profile of every sub-array of a PV system. Profiles are cached
+    per orientation (kwp_<key>.npz), so changing the number of panels or their rating only
+    rescales the cached profiles and does not run pvlib again.
+
+    Parameters:
+        irradiance_path (str): Path of the 1-minute irradiance csv file.
+        pv_system (list): Sub-arrays of the PV system (see calculation_power_output_multi).
+        cache_dir (str): Directory of the cache.
+        max_cache_bytes (int): Size bound of the cached profiles.
+
+    Returns:
+        tuple: (bin_starts, profiles) as returned by kwp_profiles_streaming, one row per sub-array.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    orientations = [_orientation(array) for array in pv_system]
+    keys = []
+    for orientation in orientations:
+        sha = hashlib.sha256(file_hash(irradiance_path).encode())
+        sha.update(json.dumps([CACHE_VERSION, orientation], sort_keys=True).encode())
+        keys.append(sha.hexdigest()[:32])
+    paths = {key: os.path.join(cache_dir, f'kwp_{key}.npz') for key in keys}
+
+    # Calculate all missing orientations in one pass over the irradiance file
+    missing = list(dict.fromkeys(key for key in keys if not os.path.exists(paths[key])))
+    if missing:
+        missing_orientations = [orientations[keys.index(key)] for key in missing]
+        bin_starts, profiles = kwp_profiles_streaming(irradiance_path, missing_orientations)
+        times_utc = bin_starts.tz_convert('UTC').tz_localize(None).values
+        for key, profile in zip(missing, profiles):
+            tmp_path = paths[key] + '.tmp.npz'
+            np.savez(tmp_path, times_utc=times_utc, profile=profile)
+            os.replace(tmp_path, paths[key])
+
+    profiles = []
+    for key in keys:
+        os.utime(paths[key])  # Mark the entry as recently used
+        with np.load(paths[key]) as npz:
+            times_utc = npz['times_utc']
+            profiles.append(npz['profile'])
+    bin_starts = pd.DatetimeIndex(times_utc).tz_localize('UTC')
+
+    evict_cache(cache_dir, max_cache_bytes, pattern_prefix='kwp_')
+    return bin_starts, np.stack(profiles)
+
+
+def cached_all_correct_data_files(irradiance_path, load_profile_path, belpex_path, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, cache_dir=CACHE_DIR, max_cache_bytes=MAX_CACHE_BYTES, pv_system=None, inverter_limit_kw=None):
+    """
+    Return the aligned 15-minute data and power_output, reusing the cached result when the
+    input files and the roof parameters did not change.
+
+    Parameters:
+        irradiance_path (str): Path of the 1-minute irradiance csv file.
+        load_profile_path (str): Path of the corrected load profile pickle.
+        belpex_path (str): Path of the corrected Belpex pickle.
+        WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2: Roof parameters.
+        cache_dir (str): Directory of the cache.
+        max_cache_bytes (int): Size bound of the cache directory.
+        pv_system (list): Sub-arrays of the PV system (see calculation_power_output_multi), or None
+                          for the two arrays defined by the roof parameters.
+        inverter_limit_kw (float): AC limit of the inverter (kW), or None for no clipping.
+
+    Returns:
+        tuple: (data, power_output) as returned by all_correct_data_files.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key([irradiance_path, load_profile_path, belpex_path], WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, pv_system, inverter_limit_kw)
+    path = os.path.join(cache_dir, f'corrected_{key}.npz')
+
+    if os.path.exists(path):
+        os.utime(path)  # Mark the entry as recently used
+        return load_corrected_data(path)
+
+    # Same steps as all_correct_data_files, with the PV output scaled from the cached per-kWp profiles
+    if pv_system is None:
+        pv_system = pv_system_spec(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
+    if inverter_limit_kw is None:
+        bin_starts, profiles = cached_kwp_profiles(irradiance_path, pv_system, cache_dir, max_cache_bytes)
+        power_output = power_output_from_kwp_profiles(bin_starts, profiles, pv_system)
+    else:
+        # The inverter clips the 1-minute output of the whole system, which cannot be done on the
+        # binned per-kWp profiles: stream the file and clip every chunk before binning
+        power_output = correct_irradiance_data_streaming(WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, irradiance_path, pv_system=pv_system, inverter_limit_kw=inverter_limit_kw)
+    load_profile = pd.read_pickle(load_profile_path)
+    belpex_data = pd.read_pickle(belpex_path)
+    data = align_corrected_data(power_output, load_profile, belpex_data)
+
+    save_corrected_data(path, data, power_output)
+    evict_cache(cache_dir, max_cache_bytes)
+    return data, power_output
+
+
+def cached_day_matrix_store(irradiance_path, load_profile_path, belpex_path, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, cache_dir=CACHE_DIR, max_cache_bytes=MAX_CACHE_BYTES, pv_system=None, inverter_limit_kw=None):
+    """
+    Return the memory-mapped (days, 100) local-day matrices of the aligned data (see day_matrix.py).
+    The store is written next to the cached data the first time it is requested.
+
+    Returns:
+        tuple: (matrices, index) as returned by open_day_matrix_store.
+    """
+    data, _ = cached_all_correct_data_files(irradiance_path, load_profile_path, belpex_path, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, cache_dir, max_cache_bytes, pv_system, inverter_limit_kw)
+    key = cache_key([irradiance_path, load_profile_path, belpex_path], WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2, pv_system, inverter_limit_kw)
+    store_dir = os.path.join(cache_dir, f'days_{key}')
+
+    if not os.path.exists(os.path.join(store_dir, 'index.json')):
+        write_day_matrix_store(data, store_dir)
+    return open_day_matrix_store(store_dir)
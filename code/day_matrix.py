@@ -0,0 +1,185 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# Day layout of the 15-minute series.
+# The rows of the aligned data are grouped per local calendar day, like
+# groupby(datetime.dt.date) in the schedulers: the days of the DST transitions have 92 or 100
+# rows instead of 96. Per-day work runs on a few regular day matrices, one per day length
+# (see segment_rows), instead of a loop over the days.
+# On disk every series is a contiguous float32 (days, 100) array: one row per local day,
+# padded after its last interval. rows.npy holds the position of every slot in the data
+# (-1 for padding), so the valid slots of the matrix read row by row are exactly the rows of
+# local_day_segments. Memory-mapping the files read-only lets repeated runs and
+# process-pool workers share the same pages without copying.
+SLOTS_PER_DAY = 100  # Longest local day (end of DST)
+STORE_COLUMNS = ['Power_Output_kWh', 'Volume_Afname_kWh', 'Euro']
+
+
+def local_day_segments(datetimes):
+    """
+    Group the rows of a 15-minute series per local calendar day, like groupby(datetime.dt.date).
+    Days in the DST transitions have 92 or 100 rows instead of 96.
+
+    Parameters:
+        datetimes (Series): Timestamps of the rows (tz-aware or naive local time).
+
+    Returns:
+        tuple: (order, segment_starts, days) where order sorts the rows per day (rows of a day
+               keep their original order), segment_starts holds the start of every day in that
+               order plus the number of rows, and days the dates (datetime64[D]).
+    """
+    wall_times = pd.DatetimeIndex(datetimes)
+    if wall_times.tz is not None:
+        wall_times = wall_times.tz_localize(None)
+    dates = wall_times.values.astype('datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    dates = dates[order]
+    starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+    segment_starts = np.r_[starts, len(dates)]
+    return order, segment_starts, dates[starts]
+
+
+def segment_rows(segment_starts):
+    """
+    Yield the segments of equal length as (segments, rows), with rows an array of shape
+    (len(segments), length) holding the positions of the rows of every segment.
+    This turns a ragged series of days into a few regular day matrices (96, 92 and 100 rows).
+    """
+    segment_starts = np.asarray(segment_starts)
+    lengths = np.diff(segment_starts)
+    for length in np.unique(lengths):
+        segments = np.flatnonzero(lengths == length)
+        yield segments, segment_starts[segments][:, None] + np.arange(length)
+
+
+def sort_within_segments(values, segment_starts, ascending=True):
+    """
+    Order of the rows that sorts every segment by value, with the same order for equal values
+    as DataFrame.sort_values (quicksort) on each segment separately.
+
+    Returns:
+        ndarray: Positions of the rows, segment by segment, sorted within every segment.
+    """
+    values = np.asarray(values)
+    order = np.empty(len(values), dtype=np.int64)
+    for segments, rows in segment_rows(segment_starts):
+        if ascending:
+            ranks = np.argsort(values[rows], axis=1, kind='quicksort')
+        else:
+            # Descending like pandas: sort the reversed rows and reverse the result
+            length = rows.shape[1]
+            ranks = length - 1 - np.argsort(values[rows][:, ::-1], axis=1, kind='quicksort')
+            ranks = ranks[:, ::-1]
+        order[rows] = np.take_along_axis(rows, ranks, axis=1)
+    return order
+
+
+def day_rows(segments, slots_per_day=SLOTS_PER_DAY):
+    """
+    Positions of the rows of every local day in a (days, slots_per_day) array, -1 for padding.
+
+    Parameters:
+        segments (tuple): Result of local_day_segments.
+        slots_per_day (int): Number of slots per day, at least the length of the longest day.
+
+    Returns:
+        ndarray: Array of shape (days, slots_per_day).
+    """
+    order, segment_starts, days = segments
+    rows = np.full((len(days), slots_per_day), -1, dtype=np.int64)
+    for segments_of_length, positions in segment_rows(segment_starts):
+        if positions.shape[1] > slots_per_day:
+            raise ValueError(f"A day has {positions.shape[1]} intervals, more than {slots_per_day} slots.")
+        rows[segments_of_length, :positions.shape[1]] = order[positions]
+    return rows
+
+
+def to_day_matrix(values, rows, fill=0, dtype=np.float32):
+    """
+    Arrange a 15-minute series as a contiguous (days, slots_per_day) array (see day_rows).
+    Padding slots get the value fill.
+    """
+    values = np.asarray(values, dtype=dtype)
+    return np.ascontiguousarray(np.where(rows >= 0, values[rows], fill).astype(dtype))
+
+
+def from_day_matrix(matrix, rows):
+    """
+    Flatten a (days, slots_per_day) array back to the 15-minute series in the order of the data.
+    """
+    valid = rows >= 0
+    values = np.empty(valid.sum(), dtype=np.asarray(matrix).dtype)
+    values[rows[valid]] = np.asarray(matrix)[valid]
+    return values
+
+
+def write_day_matrix_store(data, store_dir, columns=STORE_COLUMNS):
+    """
+    Write the series of data as float32 (days, 100) .npy files that can be memory-mapped.
+
+    Parameters:
+        data (DataFrame): Aligned data with a 'datetime' column and the columns to store.
+        store_dir (str): Directory of the store (replaced if it exists).
+        columns (list): Columns to store.
+    """
+    segments = local_day_segments(data['datetime'])
+    rows = day_rows(segments)
+
+    # Write to a temporary directory first, so readers never see a half-written store
+    tmp_dir = store_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for col in columns:
+        matrix = to_day_matrix(data[col].values, rows)
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, f'{col}.npy'), mode='w+', dtype=np.float32, shape=matrix.shape)
+        out[:] = matrix
+        out.flush()
+        del out
+    np.save(os.path.join(tmp_dir, 'rows.npy'), rows.astype(np.int32))
+    np.save(os.path.join(tmp_dir, 'days.npy'), segments[2])
+
+    index = {
+        'n_rows': len(data),
+        'days': len(segments[2]),
+        'slots_per_day': SLOTS_PER_DAY,
+        'columns': list(columns),
+    }
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+
+
+def open_day_matrix_store(store_dir):
+    """
+    Open a day-matrix store with read-only memory maps.
+
+    Parameters:
+        store_dir (str): Directory of the store.
+
+    Returns:
+        tuple: (matrices, index) where matrices maps each column to a read-only (days, 100) memmap
+               and index contains the shape and location of the store, the positions of the slots
+               in the data ('rows', -1 for padding) and the dates of the days ('dates').
+    """
+    with open(os.path.join(store_dir, 'index.json')) as f:
+        index = json.load(f)
+    index['store_dir'] = store_dir
+    index['rows'] = np.load(os.path.join(store_dir, 'rows.npy'), mmap_mode='r')
+    index['dates'] = np.load(os.path.join(store_dir, 'days.npy'))
+    matrices = {col: np.load(os.path.join(store_dir, f'{col}.npy'), mmap_mode='r') for col in index['columns']}
+    return matrices, index
+
+
+def store_segments(index):
+    """
+    Day layout of a store in the form of local_day_segments: (order, segment_starts, days).
+    """
+    rows = np.asarray(index['rows'])
+    valid = rows >= 0
+    return rows[valid].astype(np.int64), np.r_[0, np.cumsum(valid.sum(axis=1))], index['dates']
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+from battery_kernels import HAVE_NUMBA, ev_fleet
+from battery_simulation import _scenario_vector
+
+# Fleet mode of the EV model: many vehicles simulated at once, each with its own battery,
+# charger, availability and consumption. The vehicles share the PV surplus of the household
+# and optionally a site connection limit. Like simulate_conventional_batch, the loop runs over
+# the timesteps and every step is a NumPy operation over the vehicle axis (or the compiled
+# kernel in battery_kernels.py when Numba is installed).
+INTERVAL_HOURS = 0.25  # 15-minute intervals
+
+
+def window_mask(datetimes, start_hour, end_hour):
+    """
+    Mask of the intervals that start inside a daily window, e.g. (8, 18) for 8 AM to 6 PM.
+    Both ends are included, like the drive window of charge_ev_weekly (08:00 up to and
+    including 18:00). A window with start_hour > end_hour wraps around midnight, e.g. (18, 8);
+    start_hour == end_hour is not a valid window.
+
+    Parameters:
+        datetimes (Series): Timestamps of the intervals (local time).
+        start_hour, end_hour (float): Start and end of the window (hours).
+
+    Returns:
+        ndarray: Boolean mask per interval.
+    """
+    datetimes = pd.Series(datetimes).reset_index(drop=True)
+    return _in_window(datetimes.dt.hour.values + datetimes.dt.minute.values / 60, start_hour, end_hour)
+
+
+def _in_window(hour, start_hour, end_hour):
+    # Hour of day inside [start_hour, end_hour], wrapping around midnight if start_hour > end_hour
+    if start_hour == end_hour:
+        raise ValueError(f"Window ({start_hour}, {end_hour}) has the same start and end hour.")
+    if start_hour < end_hour:
+        return (hour >= start_hour) & (hour <= end_hour)
+    return (hour >= start_hour) | (hour <= end_hour)
+
+
+def fleet_arrays(datetimes, vehicles):
+    """
+    Availability and consumption arrays of a fleet from a list of vehicle specifications.
+
+    Every vehicle is a dict with:
+        'capacity' (float): Battery capacity (kWh).
+        'charger_kw' (float): Charger rating (kW).
+        'away' (tuple): Daily window (start_hour, end_hour) in which the vehicle is away, both ends
+                        included, default (8, 18) like charge_ev_weekly. Unlike charge_ev_weekly,
+                        which also charges at 08:00 and 18:00, the vehicle is not plugged in at the ends.
+        'daily_consumption' (float or array): Energy used per day (kWh), spread evenly over the
+                                              quarter hours of the away window (41 for (8, 18)),
+                                              or a profile of 96 values (kWh per quarter hour).
+        'weekend_home' (bool): The vehicle stays home (and does not drive) on Saturday and Sunday.
+
+    Parameters:
+        datetimes (Series): Timestamps of the intervals (local time).
+        vehicles (list): Vehicle specifications.
+
+    Returns:
+        tuple: (available, consumption, capacities, charger_kw) with the availability mask and
+               consumption (kWh per interval) of shape (vehicles, T) and the per-vehicle capacity and
+               charger rating.
+    """
+    datetimes = pd.Series(datetimes).reset_index(drop=True)
+    minute_of_day = datetimes.dt.hour.values * 60 + datetimes.dt.minute.values
+    hour = minute_of_day / 60
+    slot = minute_of_day // 15
+    slot_hours = np.arange(96) / 4
+    is_weekend = datetimes.dt.weekday.values >= 5
+
+    available = np.zeros((len(vehicles), len(datetimes)), dtype=bool)
+    consumption = np.zeros((len(vehicles), len(datetimes)))
+    for v, vehicle in enumerate(vehicles):
+        away_window = vehicle.get('away', (8, 18))
+        away = _in_window(hour, *away_window)
+        if vehicle.get('weekend_home', False):
+            away &= ~is_weekend
+        profile = np.asarray(vehicle.get('daily_consumption', 8), dtype=float)
+        if profile.ndim == 0:
+            # Spread the daily consumption evenly over the quarter hours of the away window
+            away_slots = _in_window(slot_hours, *away_window)
+            if not away_slots.any():
+                raise ValueError(f"Away window {away_window} contains no quarter hour.")
+            profile = np.where(away_slots, profile / away_slots.sum(), 0.0)
+        available[v] = ~away
+        consumption[v] = np.where(away, profile[slot], 0.0)
+
+    capacities = np.array([vehicle['capacity'] for vehicle in vehicles], dtype=float)
+    charger_kw = np.array([vehicle['charger_kw'] for vehicle in vehicles], dtype=float)
+    return available, consumption, capacities, charger_kw
+
+
+def simulate_ev_fleet(power_surplus, available, consumption, capacities, charger_kw, initial_soc=1.0, site_limit_kw=None, grid_charging=False, backend=None):
+    """
+    Simulate a fleet of EVs that charge from a shared PV surplus.
+
+    Every interval each vehicle first uses its consumption; energy that is not in the battery is
+    counted as unmet. The plugged-in vehicles then request the energy their charger can deliver,
+    limited by the free capacity. The requests share the PV surplus in proportion to their size,
+    the rest is charged from the grid if grid_charging is True, and the total charging power is
+    limited by the site connection.
+
+    Parameters:
+        power_surplus (array-like): PV surplus per interval (kWh), e.g. data['power_difference_kwh'].
+        available (array-like): Plugged-in mask of shape (vehicles, T).
+        consumption (array-like): Energy used per interval (kWh) of shape (vehicles, T).
+        capacities (array-like): Battery capacity per vehicle (kWh).
+        charger_kw (array-like): Charger rating per vehicle (kW).
+        initial_soc (array-like): State of charge at the start (fraction of the capacity).
+        site_limit_kw (array-like): Maximum total charging power of the site (kW), scalar or per
+                                    interval; None for no limit.
+        grid_charging (bool): Charge from the grid when the PV surplus is not enough. Off by
+                              default, like charge_ev_weekly (its grid charging pass is disabled);
+                              grid charging here ignores the price.
+        backend (str): 'numpy' for the loop over timesteps, 'numba' or 'python' for the kernel in
+                       battery_kernels.py. None uses 'numba' when available, else 'numpy'.
+
+    Returns:
+        tuple: (pv_charge, grid_charge, levels, unmet), arrays of shape (vehicles, T) with the
+               energy charged from PV and from the grid, the charge level at the end of every
+               interval and the consumption that could not be delivered (kWh).
+    """
+    available = np.atleast_2d(np.asarray(available, dtype=bool))
+    n_vehicles, n_intervals = available.shape
+    power_surplus = np.broadcast_to(np.asarray(power_surplus, dtype=float), (n_intervals,))
+    consumption = np.broadcast_to(np.asarray(consumption, dtype=float), (n_vehicles, n_intervals))
+    capacities = _scenario_vector(capacities, n_vehicles, None)
+    charge_limits = _scenario_vector(charger_kw, n_vehicles, None) * INTERVAL_HOURS
+    current_charge = _scenario_vector(initial_soc, n_vehicles, 1.0) * capacities
+    site_limits = np.full(n_intervals, np.inf) if site_limit_kw is None else np.broadcast_to(np.asarray(site_limit_kw, dtype=float) * INTERVAL_HOURS, (n_intervals,))
+
+    if backend is None:
+        backend = 'numba' if HAVE_NUMBA else 'numpy'
+    if backend != 'numpy':
+        return ev_fleet(power_surplus, available, consumption, capacities, charge_limits, current_charge, site_limits, grid_charging, backend=backend)
+
+    pv_charge = np.zeros((n_vehicles, n_intervals))
+    grid_charge = np.zeros((n_vehicles, n_intervals))
+    levels = np.zeros((n_vehicles, n_intervals))
+    unmet = np.zeros((n_vehicles, n_intervals))
+    surplus = np.maximum(power_surplus, 0)
+
+    for t in range(n_intervals):
+        unmet[:, t] = np.maximum(consumption[:, t] - current_charge, 0)
+        current_charge = np.maximum(current_charge - consumption[:, t], 0)
+
+        request = np.where(available[:, t], np.maximum(np.minimum(charge_limits, capacities - current_charge), 0), 0)
+        total_request = request.sum()
+        if total_request > 0:
+            delivered = min(total_request, site_limits[t])
+            pv_used = min(surplus[t], delivered)
+            grid_used = delivered - pv_used if grid_charging else 0.0
+            share = request / total_request
+            pv_charge[:, t] = pv_used * share
+            grid_charge[:, t] = grid_used * share
+            current_charge = current_charge + pv_charge[:, t] + grid_charge[:, t]
+
+        levels[:, t] = current_charge
+
+    return pv_charge, grid_charge, levels, unmet
+
+
+def ev_fleet_schedule(data, vehicles, site_limit_kw=None, grid_charging=False, initial_soc=1.0, backend=None):
+    """
+    Simulate a fleet of EVs described by vehicle specifications (see fleet_arrays) against the
+    PV surplus of data.
+
+    Parameters:
+        data (DataFrame): Aligned data with 'datetime' and 'power_difference_kwh'.
+        vehicles (list): Vehicle specifications.
+        site_limit_kw (float): Maximum total charging power of the site (kW), None for no limit.
+        grid_charging (bool): Charge from the grid when the PV surplus is not enough (off by default).
+        initial_soc (float): State of charge at the start (fraction of the capacity).
+        backend (str): Backend of simulate_ev_fleet.
+
+    Returns:
+        tuple: (summary, levels) with a DataFrame of the fleet totals per interval (PV charge,
+               grid charge and unmet consumption in kWh) and the (vehicles, T) charge levels.
+    """
+    available, consumption, capacities, charger_kw = fleet_arrays(data['datetime'], vehicles)
+    pv_charge, grid_charge, levels, unmet = simulate_ev_fleet(
+        data['power_difference_kwh'].values, available, consumption, capacities, charger_kw,
+        initial_soc=initial_soc, site_limit_kw=site_limit_kw, grid_charging=grid_charging, backend=backend)
+
+    summary = pd.DataFrame({
+        'datetime': data['datetime'].reset_index(drop=True),
+        'power_surplus': data['power_difference_kwh'].values,
+        'pv_charge': pv_charge.sum(axis=0),
+        'grid_charge': grid_charge.sum(axis=0),
+        'unmet_consumption': unmet.sum(axis=0),
+    })
+    return summary, levels
@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+from correct_data_files import change_year
+
+# EV availability from logged charging sessions instead of fixed daily windows.
+# Every session (vehicle, arrival, departure, energy needed) covers a range of 15-minute
+# intervals. The ranges are stored as an interval index in CSR form: for interval t the active
+# sessions are session_ids[indptr[t]:indptr[t + 1]]. It is built in one pass over all sessions
+# and answers "which vehicles are plugged in at t" with a slice, and it is directly the sparse
+# (vehicles x intervals) availability mask in CSC form.
+# The data grid is one year (2000, without February 29) in local time, so the sessions are
+# placed on it by their local wall-clock time in that year, like change_year does for the data.
+SESSION_COLUMNS = ['vehicle', 'arrival', 'departure', 'energy_kwh']
+
+
+def read_session_log(path, column_map=None, tz='Europe/Brussels', **read_csv_kwargs):
+    """
+    Read a charging session log from a csv file.
+
+    Parameters:
+        path (str): Path of the csv file.
+        column_map (dict): Names of the columns in the file for 'vehicle', 'arrival', 'departure'
+                           and 'energy_kwh' (e.g. {'arrival': 'Started'}), None if they match.
+        tz (str): Timezone of timestamps without timezone.
+        **read_csv_kwargs: Passed to pd.read_csv (delimiter, ...).
+
+    Returns:
+        DataFrame: Sessions with the columns in SESSION_COLUMNS, sorted by arrival. Sessions without
+                   a valid arrival and departure, or that depart before they arrive, are dropped.
+    """
+    sessions = pd.read_csv(path, **read_csv_kwargs)
+    if column_map:
+        sessions = sessions.rename(columns={file_col: col for col, file_col in column_map.items()})
+    sessions = sessions[SESSION_COLUMNS].copy()
+
+    for col in ['arrival', 'departure']:
+        # Timestamps with a UTC offset (which differs between summer and winter) are parsed via UTC
+        values = sessions[col].dropna()
+        has_offset = len(values) > 0 and pd.Timestamp(values.iloc[0]).tz is not None
+        times = pd.to_datetime(sessions[col], utc=has_offset)
+        if not has_offset:
+            times = times.dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
+        sessions[col] = times.dt.tz_convert(tz)
+    sessions['energy_kwh'] = pd.to_numeric(sessions['energy_kwh'], errors='coerce').fillna(0)
+
+    valid = sessions['arrival'].notna() & sessions['departure'].notna() & (sessions['departure'] > sessions['arrival'])
+    return sessions[valid].sort_values(by='arrival').reset_index(drop=True)
+
+
+def _wall_clock(times, tz):
+    # Local wall-clock time (naive) of tz-aware or naive timestamps
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+        times = times.tz_convert(tz).tz_localize(None)
+    return pd.Series(times)
+
+
+def session_interval_bounds(sessions, datetimes, tz='Europe/Brussels'):
+    """
+    First and last (exclusive) interval of every session on a 15-minute grid. A session covers
+    every interval it overlaps. The sessions are moved to the year of the grid by their local
+    wall-clock time (see change_year). Sessions that do not overlap the grid get an empty range
+    (first == end): sessions on February 29, sessions that cross the new year and sessions
+    outside the grid.
+
+    Parameters:
+        sessions (DataFrame): Sessions with 'arrival' and 'departure'.
+        datetimes (Series): Start times of the intervals (in order of time).
+        tz (str): Timezone of the wall-clock time of the grid.
+
+    Returns:
+        tuple: (first, end) integer arrays with the first interval and one past the last interval.
+    """
+    grid = _wall_clock(datetimes, tz)
+    arrival = _wall_clock(sessions['arrival'], tz)
+    departure = _wall_clock(sessions['departure'], tz)
+
+    # February 29 is not on the grid (those sessions get a placeholder time and are dropped
+    # below); other dates keep their month, day and time of day
+    leap_day = ((arrival.dt.month == 2) & (arrival.dt.day == 29)) | ((departure.dt.month == 2) & (departure.dt.day == 29))
+    year = grid.iloc[0].year
+    arrival = change_year(arrival.where(~leap_day, grid.iloc[0]), year).values.astype(np.int64)
+    departure = change_year(departure.where(~leap_day, grid.iloc[0]), year).values.astype(np.int64)
+
+    # Wall-clock times of the grid repeat in the DST hours; the running maximum keeps them sorted
+    grid = np.maximum.accumulate(grid.values.astype(np.int64))
+    grid_end = grid[-1] + pd.Timedelta(minutes=15).value
+    on_grid = ~leap_day.values & (departure > arrival) & (arrival < grid_end) & (departure > grid[0])
+
+    first = np.maximum(np.searchsorted(grid, arrival, side='right') - 1, 0)
+    end = np.searchsorted(grid, departure, side='left')
+    end = np.where(on_grid, end, first)
+    return first, end
+
+
+def build_interval_index(first, end, n_intervals):
+    """
+    Interval index of a set of interval ranges in CSR form.
+
+    Parameters:
+        first, end (array-like): First and one-past-last interval of every session.
+        n_intervals (int): Number of intervals of the grid.
+
+    Returns:
+        tuple: (indptr, session_ids) where the sessions active in interval t are
+               session_ids[indptr[t]:indptr[t + 1]] (in order of session).
+    """
+    first = np.asarray(first, dtype=np.int64)
+    lengths = np.asarray(end, dtype=np.int64) - first
+
+    # One entry per (session, interval) pair, sorted by interval
+    session_ids = np.repeat(np.arange(len(first)), lengths)
+    entry_starts = np.cumsum(lengths) - lengths
+    intervals = first[session_ids] + np.arange(len(session_ids)) - entry_starts[session_ids]
+    order = np.argsort(intervals, kind='stable')
+
+    indptr = np.zeros(n_intervals + 1, dtype=np.int64)
+    np.cumsum(np.bincount(intervals, minlength=n_intervals)[:n_intervals], out=indptr[1:])
+    return indptr, session_ids[order]
+
+
+def active_sessions(index, t):
+    """
+    Sessions that are plugged in during interval t.
+    """
+    indptr, session_ids = index
+    return session_ids[indptr[t]:indptr[t + 1]]
+
+
+def availability_mask(index, session_vehicles, n_vehicles=None):
+    """
+    Sparse availability mask of the vehicles from the interval index.
+
+    Parameters:
+        index (tuple): Interval index (indptr, session_ids) of the sessions.
+        session_vehicles (array-like): Vehicle number (0 .. n_vehicles - 1) of every session.
+        n_vehicles (int): Number of vehicles, the highest vehicle number + 1 if None.
+
+    Returns:
+        scipy.sparse.csc_matrix: Boolean mask of shape (vehicles, intervals), True while a vehicle
+                                 is plugged in.
+    """
+    from scipy.sparse import csc_matrix
+
+    indptr, session_ids = index
+    session_vehicles = np.asarray(session_vehicles, dtype=np.int64)
+    if n_vehicles is None:
+        n_vehicles = session_vehicles.max() + 1 if len(session_vehicles) else 0
+    # The CSR index over intervals is the CSC layout of the (vehicles, intervals) mask;
+    # overlapping sessions of the same vehicle are merged
+    mask = csc_matrix((np.ones(len(session_ids), dtype=bool), session_vehicles[session_ids], indptr), shape=(n_vehicles, len(indptr) - 1))
+    mask.sum_duplicates()
+    return mask
+
+
+def session_fleet_arrays(sessions, datetimes):
+    """
+    Availability and consumption arrays for simulate_ev_fleet from a session log: a vehicle is
+    available during its sessions and arrives with the energy of the session used.
+
+    Parameters:
+        sessions (DataFrame): Sessions with the columns in SESSION_COLUMNS.
+        datetimes (Series): Start times of the intervals (sorted).
+
+    Returns:
+        tuple: (available, consumption, vehicles) with the (vehicles, T) availability mask, the
+               (vehicles, T) consumption (kWh, at the arrival interval) and the vehicle labels.
+    """
+    first, end = session_interval_bounds(sessions, datetimes)
+    index = build_interval_index(first, end, len(datetimes))
+    session_vehicles, vehicles = pd.factorize(sessions['vehicle'])
+
+    available = availability_mask(index, session_vehicles, len(vehicles)).toarray()
+    consumption = np.zeros(available.shape)
+    inside = first < end
+    np.add.at(consumption, (session_vehicles[inside], first[inside]), sessions['energy_kwh'].values[inside])
+    return available, consumption, vehicles
+
+
+def smart_charge_sessions(sessions, data, charger_kw=11.0):
+    """
+    Charge every session in the cheapest intervals between arrival and departure.
+    All sessions are handled together: the (session, interval) pairs are sorted by price per
+    session and the energy is assigned with a cumulative sum, without a loop over the sessions.
+
+    Parameters:
+        sessions (DataFrame): Sessions with the columns in SESSION_COLUMNS, optionally with a
+                              'charger_kw' column per session.
+        data (DataFrame): Aligned data with 'datetime' and 'Euro' (EUR/MWh).
+        charger_kw (float): Charger rating of sessions without a 'charger_kw' value (kW).
+
+    Returns:
+        tuple: (load, sessions) with the total charging energy per interval of data (kWh) and a
+               copy of sessions with the 'delivered_kwh' and 'energy_cost' (EUR, at the Belpex
+               price) of every session.
+    """
+    datetimes = data['datetime'].reset_index(drop=True)
+    euro = data['Euro'].values
+    first, end = session_interval_bounds(sessions, datetimes)
+    lengths = end - first
+
+    rates = sessions['charger_kw'].fillna(charger_kw).values if 'charger_kw' in sessions else np.full(len(sessions), charger_kw)
+    max_energy = np.asarray(rates, dtype=float) * 0.25  # Energy per 15-minute interval
+
+    # (session, interval) pairs, cheapest interval first within every session
+    session_ids = np.repeat(np.arange(len(sessions)), lengths)
+    entry_starts = np.cumsum(lengths) - lengths
+    intervals = first[session_ids] + np.arange(len(session_ids)) - entry_starts[session_ids]
+    order = np.lexsort((euro[intervals], session_ids))
+    session_ids = session_ids[order]
+    intervals = intervals[order]
+
+    # Energy charged before every entry of its session, then what is still needed
+    energy_per_entry = max_energy[session_ids]
+    charged_before = np.cumsum(energy_per_entry) - energy_per_entry
+    charged_before -= charged_before[entry_starts[session_ids]]
+    needed = sessions['energy_kwh'].values[session_ids]
+    taken = np.clip(needed - charged_before, 0, energy_per_entry)
+
+    load = np.bincount(intervals, weights=taken, minlength=len(datetimes))
+    sessions = sessions.copy()
+    sessions['delivered_kwh'] = np.bincount(session_ids, weights=taken, minlength=len(sessions))
+    sessions['energy_cost'] = np.bincount(session_ids, weights=taken * euro[intervals] / 1000, minlength=len(sessions))
+    return load, sessions
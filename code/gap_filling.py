@@ -0,0 +1,141 @@
+import numpy as np
+
+# Gap filling for 15-minute series (PV output, load profiles).
+# Gaps are found with a run-length encoding of a (series, intervals) mask, and every gap is
+# replaced by the neighbouring window (before or after the gap) with the lowest energy.
+# Windows that overlap another gap are skipped for the next window further away.
+# All gaps of all series are filled in one vectorized pass; the neighbouring windows are
+# always taken from the unfilled series.
+
+
+def run_length_encode(mask):
+    """
+    Find the runs of True values in every row of a boolean mask.
+
+    Parameters:
+        mask (array-like): Boolean array of shape (intervals,) or (series, intervals).
+
+    Returns:
+        tuple: (rows, starts, lengths) of every run, ordered by row and start.
+    """
+    mask = np.atleast_2d(np.asarray(mask, dtype=bool))
+    n_series, n_intervals = mask.shape
+
+    # Pad every row with False so runs never touch the row boundaries
+    padded = np.zeros((n_series, n_intervals + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return rows, starts, ends - starts
+
+
+def _full_day_runs(rows, starts, lengths, day_ids, slots_per_day, n_series):
+    # Keep only the intervals of a run that belong to a day completely inside the run,
+    # then split the runs again on the remaining intervals
+    run_ids = np.repeat(np.arange(len(starts)), lengths)
+    cols = _run_columns(starts, lengths)
+    _, inverse, counts = np.unique(np.stack([run_ids, day_ids[cols]]), axis=1, return_inverse=True, return_counts=True)
+    keep = counts[inverse.ravel()] == slots_per_day
+
+    mask = np.zeros((n_series, len(day_ids)), dtype=bool)
+    mask[np.repeat(rows, lengths)[keep], cols[keep]] = True
+    return run_length_encode(mask)
+
+
+def _run_columns(starts, lengths):
+    # Column of every interval of every run, concatenated
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def _window_sums(prefix, rows, window_starts, lengths):
+    # Sum of every window from the prefix sums of its row, windows may lie partly outside the row
+    n_intervals = prefix.shape[1] - 1
+    return prefix[rows, np.clip(window_starts + lengths, 0, n_intervals)] - prefix[rows, np.clip(window_starts, 0, n_intervals)]
+
+
+def fill_gaps(values, gap_mask, min_length=1, slots_per_day=None, day_ids=None):
+    """
+    Fill the gaps of one or more series with the lowest-energy neighbouring window.
+
+    A gap of length L is replaced by the L values before it or the L values after it,
+    whichever has the lowest sum. With slots_per_day, the windows are shifted by a whole
+    number of days so the time of day is kept. A window that overlaps another gap is not
+    used; the windows one shift further away are tried instead.
+
+    Parameters:
+        values (array-like): Series of shape (intervals,) or (series, intervals).
+        gap_mask (array-like): Boolean mask of the gaps, same shape as values.
+        min_length (int): Minimum number of intervals of a gap to be filled; shorter gaps are kept.
+        slots_per_day (int): Number of intervals per day, or None to shift the windows by the gap length.
+        day_ids (array-like): Day number of every interval (shared by all series). When given,
+                              only the days that lie completely inside a gap are filled.
+
+    Returns:
+        ndarray: Filled copy of values, same shape as values.
+    """
+    values = np.asarray(values, dtype=float)
+    original_shape = values.shape
+    values = np.atleast_2d(values)
+    n_intervals = values.shape[1]
+    filled = values.copy()
+
+    rows, starts, lengths = run_length_encode(np.reshape(gap_mask, values.shape))
+    long_runs = lengths >= min_length
+    rows, starts, lengths = rows[long_runs], starts[long_runs], lengths[long_runs]
+
+    if day_ids is not None and len(starts):
+        rows, starts, lengths = _full_day_runs(rows, starts, lengths, np.asarray(day_ids), slots_per_day, values.shape[0])
+    if len(starts) == 0:
+        return filled.reshape(original_shape)
+
+    # Shift of the neighbouring windows
+    if slots_per_day is None:
+        shifts = lengths
+    else:
+        shifts = -(-lengths // slots_per_day) * slots_per_day
+
+    # Prefix sums of the energy and of the gap intervals of each row
+    prefix = np.zeros((values.shape[0], n_intervals + 1))
+    np.cumsum(np.nan_to_num(values), axis=1, out=prefix[:, 1:])
+    gap_intervals = np.zeros(values.shape, dtype=bool)
+    gap_intervals[np.repeat(rows, lengths), _run_columns(starts, lengths)] = True
+    gap_prefix = np.zeros((values.shape[0], n_intervals + 1), dtype=np.int64)
+    np.cumsum(gap_intervals, axis=1, out=gap_prefix[:, 1:])
+
+    # Take the window with the lowest energy; a window outside the series or overlapping a gap
+    # is never taken, and a gap without a valid window tries the windows one shift further away
+    offsets = np.zeros(len(starts), dtype=np.int64)
+    pending = np.arange(len(starts))
+    step = 1
+    while len(pending):
+        p_rows, p_starts, p_lengths = rows[pending], starts[pending], lengths[pending]
+        distances = shifts[pending] * step
+        before_start = p_starts - distances
+        after_start = p_starts + distances
+        before_inside = before_start >= 0
+        after_inside = after_start + p_lengths <= n_intervals
+        if not (before_inside | after_inside).any():
+            break
+        before_ok = before_inside & (_window_sums(gap_prefix, p_rows, before_start, p_lengths) == 0)
+        after_ok = after_inside & (_window_sums(gap_prefix, p_rows, after_start, p_lengths) == 0)
+        before_total = _window_sums(prefix, p_rows, before_start, p_lengths)
+        after_total = _window_sums(prefix, p_rows, after_start, p_lengths)
+
+        use_before = before_ok & (~after_ok | (before_total < after_total))
+        use_after = ~use_before & after_ok
+        found = use_before | use_after
+        offsets[pending[found]] = np.where(use_before, -distances, distances)[found]
+        pending = pending[~found]
+        step += 1
+    fillable = np.ones(len(starts), dtype=bool)
+    fillable[pending] = False
+
+    rows, starts, lengths, offsets = rows[fillable], starts[fillable], lengths[fillable], offsets[fillable]
+    cols = _run_columns(starts, lengths)
+    interval_rows = np.repeat(rows, lengths)
+    filled[interval_rows, cols] = values[interval_rows, cols + np.repeat(offsets, lengths)]
+
+    return filled.reshape(original_shape)
@@ -0,0 +1,82 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from correct_data_files import correct_load_profile
+from gap_filling import fill_gaps
+
+# Batch ingestion of meter exports (Fluvius format: 'Datum_Startuur', 'Volume_Afname_kWh').
+# Every export is cleaned with correct_load_profile in a separate process and placed on the
+# same 15-minute axis of the year 2000 (UTC, without February 29), so the whole fleet is one
+# (households, 35040) array.
+N_INTERVALS = 35040
+
+
+def canonical_load_axis():
+    """
+    Return the 15-minute UTC axis of the year 2000 without February 29 (35040 intervals).
+    """
+    axis = pd.date_range('2000-01-01', '2001-01-01', freq='15min', inclusive='left', tz='UTC')
+    return axis[~((axis.month == 2) & (axis.day == 29))]
+
+
+def read_load_profile(path):
+    """
+    Read a meter export (.csv or .xlsx) with the columns 'Datum_Startuur' and 'Volume_Afname_kWh'.
+    """
+    if path.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path, usecols=['Datum_Startuur', 'Volume_Afname_kWh'])
+    return pd.read_csv(path, usecols=['Datum_Startuur', 'Volume_Afname_kWh'], parse_dates=['Datum_Startuur'])
+
+
+def _load_household(path):
+    # Read and clean one export, then place it on the canonical axis
+    load_profile = correct_load_profile(read_load_profile(path))
+    datetimes = pd.to_datetime(load_profile['Datum_Startuur'], utc=True)
+    series = pd.Series(load_profile['Volume_Afname_kWh'].values, index=datetimes)
+    series = series[~series.index.duplicated()]
+    values = series.reindex(canonical_load_axis()).values
+
+    metadata = {
+        'household': os.path.splitext(os.path.basename(path))[0],
+        'path': path,
+        'rows': len(load_profile),
+        'missing_intervals': int(np.isnan(values).sum()),
+    }
+    return values, metadata
+
+
+def load_household_profiles(directory='data', pattern='Load_profile_*.csv', max_workers=None):
+    """
+    Read and clean all meter exports in a directory in parallel.
+
+    Intervals that are missing from an export are filled with the neighbouring days with the
+    lowest load (see gap_filling.py), in one pass over the whole fleet.
+
+    Parameters:
+        directory (str): Directory with the meter exports.
+        pattern (str): Glob pattern of the export files.
+        max_workers (int): Number of worker processes (None uses all cores).
+
+    Returns:
+        tuple: (profiles, metadata) where profiles is a (households, 35040) array of the
+               consumption in kWh per 15 minutes, and metadata is a DataFrame with one row
+               per household (same order as profiles).
+    """
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No load profiles matching '{pattern}' in '{directory}'.")
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_load_household, paths))
+
+    profiles = np.vstack([values for values, _ in results])
+    metadata = pd.DataFrame([meta for _, meta in results])
+
+    # Fill the intervals that are missing from the exports
+    profiles = fill_gaps(profiles, np.isnan(profiles), slots_per_day=96)
+    metadata['unfilled_intervals'] = np.isnan(profiles).sum(axis=1)
+    metadata['annual_consumption_kWh'] = np.nansum(profiles, axis=1)
+
+    return profiles, metadata
@@ -10,13 +10,14 @@ from plot import average_power, power_per_year, belpex_visualisation
 from dynamic_electricity_cost import calculate_total_dynamic_cost
 from day_night_electricity_cost import day_night_electricity_cost
 from correct_data_files import all_correct_data_files
+from data_cache import cached_all_correct_data_files, cached_day_matrix_store
 from battery1 import calculate_power_difference, calculate_average_daily_power_difference
 from Charge_battery import charge_battery, smart_battery_merge
 from Discharge_battery import discharge_battery
 from financial_evaluation import financial_evaluation
 from Conventional_charge_discharge import conventional_battery
 from EV_charge import charge_ev_weekly
-from Smartmodel import smartmodel
+from Smartmodel import optimize_smart_battery
 from plot import plot_27_july
 
 def main(tilt_module, azimuth_module_1, azimuth_module_2, battery_type):
@@ -51,16 +52,15 @@ def main(tilt_module, azimuth_module_1, azimuth_module_2, battery_type):
     # importing corrected files (first run data_configuration to correct the files)
 
     #power_output = pd.read_pickle('data/Corrected_power_output.pkl')
-    load_profile_old = pd.read_pickle('data/Corrected_load_profile.pkl')
-    belpex_data_old = pd.read_pickle('data/Corrected_belpex_data.pkl')
     #data = pd.read_pickle('data/Corrected_data.pkl')
-    
+
 
     # The csv files
-    power_output_old  = pd.read_csv('data/Irradiance_data.csv', parse_dates=['DateTime'])
     #load_profile_old = pd.read_csv('data/Load_profile_8.csv', parse_dates=['Datum_Startuur'])
     #belpex_data_old = pd.read_csv('data/Belpex_2024.csv', delimiter=';', parse_dates=['Date'], encoding='ISO-8859-1', dayfirst=True)
-    data, power_output, load_profile, belpex_data = all_correct_data_files(power_output_old, load_profile_old, belpex_data_old, WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
+
+    # Aligned 15-minute data, cached per roof configuration (see data_cache.py)
+    data, power_output = cached_all_correct_data_files('data/Irradiance_data.csv', 'data/Corrected_load_profile.pkl', 'data/Corrected_belpex_data.pkl', WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
     # Visualize the data
     #power_per_year(power_output, load_profile)
     #average_power(power_output, load_profile)
@@ -85,15 +85,15 @@ def main(tilt_module, azimuth_module_1, azimuth_module_2, battery_type):
         conventional_charge_schedule, conventional_discharge_schedule, conventional_charge_discharge_schedule = conventional_battery(battery_capacity, data)
         evaluated_battery = conventional_charge_discharge_schedule
     elif battery_type == 2:
-        charge_schedule, data2, end_of_day_charge_level, battery_charge = charge_battery(battery_capacity, data)
-        discharge_schedule = discharge_battery(data2, end_of_day_charge_level, charge_schedule)
-        smart_battery = smart_battery_merge(battery_charge, discharge_schedule)
-        smartmodell = smartmodel()
+        # Same solver as smartmodel (PuLP/CBC): HiGHS finds the same objective but can return another optimal schedule
+        smartmodell, smart_objective = optimize_smart_battery(data, {'E_max': battery_capacity}, backend='pulp')
         evaluated_battery = smartmodell
         
     elif battery_type == 3:
-        charge_schedule, data2, end_of_day_charge_level, battery_charge = charge_battery(battery_capacity, data)
-        ev_charge_schedule = charge_ev_weekly(data, battery_capacity_ev, charge_schedule)
+        # Day layout and prices from the memory-mapped local-day store of the same cached data
+        store = cached_day_matrix_store('data/Irradiance_data.csv', 'data/Corrected_load_profile.pkl', 'data/Corrected_belpex_data.pkl', WP_panel, N_module, tilt_module, azimuth_module_1, azimuth_module_2)
+        charge_schedule, data2, end_of_day_charge_level, battery_charge = charge_battery(battery_capacity, data, write_excel=False, store=store)
+        ev_charge_schedule = charge_ev_weekly(data, battery_capacity_ev, charge_schedule, write_excel=False)
         evaluated_battery = ev_charge_schedule
     else:
         raise ValueError("Invalid battery type.")
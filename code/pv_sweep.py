@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pvlib
+from calculations_power import ALBEDO, LATITUDE, LONGITUDE, TEMP_COEFF, poa_global_broadcast, temperature_column
+from correct_data_files import prepare_irradiance_data
+from gap_filling import fill_gaps
+from solar_geometry import solar_geometry, cached_dni
+
+# Orientation sweep: PV yield of a whole grid of tilts and azimuths in one pass over the
+# irradiance data. The solar geometry is shared by all orientations, the plane-of-array
+# irradiance and PVWatts output are broadcast over an orientation axis, and the 1-minute
+# output is summed into 15-minute bins per chunk of time so memory stays bounded.
+# Optionally the irradiance is averaged to the output resolution first (aggregate-first mode).
+# The site constants are those of calculations_power.py.
+
+
+def aggregate_irradiance(times_utc, irradiance_data, resolution='15min'):
+    """
+    Average the 1-minute irradiance and temperature to a coarser resolution.
+
+    Parameters:
+        times_utc (DatetimeIndex): UTC timestamps of the rows of irradiance_data.
+        irradiance_data (DataFrame): 1-minute irradiance data.
+        resolution (str): Target resolution ('15min', '1h', ...).
+
+    Returns:
+        tuple: (midpoints, aggregated, minutes) with the UTC midpoints of the intervals, the
+               mean values per interval and the number of measured minutes per interval.
+    """
+    columns = ['GlobRad', 'DiffRad', 'T_RV_degC', 'T_CommRoof_degC']
+    interval_starts = times_utc.floor(resolution)
+    grouped = irradiance_data[columns].set_axis(times_utc).groupby(interval_starts)
+    aggregated = grouped.mean()
+    minutes = grouped['GlobRad'].count().values
+    midpoints = aggregated.index + pd.Timedelta(resolution) / 2
+    return midpoints, aggregated.reset_index(drop=True), minutes
+
+
+def orientation_sweep(irradiance_data, tilts, azimuths, WP_panel, N_module, chunk_size=10000, fill_outages=True, resolution=None):
+    """
+    Calculate the PV yield per interval and per year for every combination of tilt and azimuth.
+    Every orientation is evaluated for the full array (N_module modules of WP_panel).
+
+    By default pvlib is evaluated on every 1-minute row and the output is summed per 15 minutes.
+    With a resolution ('15min' or '1h'), the irradiance and temperature are averaged to that
+    resolution first and pvlib is evaluated once per interval at its midpoint, which is about
+    15 (or 60) times less work; see compare_aggregate_first for the error this introduces.
+
+    Parameters:
+        irradiance_data (DataFrame): 1-minute irradiance data as read from the irradiance csv.
+        tilts (array-like): Tilt angles to evaluate (degrees).
+        azimuths (array-like): Azimuth angles to evaluate (degrees).
+        WP_panel (float): Peak power per module (W).
+        N_module (int): Number of modules.
+        chunk_size (int): Number of rows evaluated per pass.
+        fill_outages (bool): Fill zero output periods of more than 3 days like correct_power_output.
+        resolution (str): None for the 1-minute model, or the resolution to aggregate to first.
+
+    Returns:
+        tuple: (annual_yield, yields, datetimes) where annual_yield is a DataFrame of the yearly
+               energy (kWh) with the tilts as index and the azimuths as columns, yields is an
+               array of shape (tilts, azimuths, intervals) with the energy per interval (kWh),
+               and datetimes are the (Europe/Brussels) start times of the intervals.
+    """
+    tilts = np.asarray(tilts, dtype=float)
+    azimuths = np.asarray(azimuths, dtype=float)
+    tilt_grid, azimuth_grid = [grid.ravel() for grid in np.meshgrid(tilts, azimuths, indexing='ij')]
+
+    irradiance_data = prepare_irradiance_data(irradiance_data.copy())
+
+    # Same timestamps as calculation_power_output; ambiguous and non-existing times are dropped
+    # (resample drops them as well)
+    times = irradiance_data['DateTime'].dt.tz_localize('Europe/Brussels', ambiguous='NaT', nonexistent='NaT')
+    valid = times.notna().values
+    irradiance_data = irradiance_data[valid]
+    times_utc = pd.DatetimeIndex(times[valid]).tz_convert('UTC')
+    order = np.argsort(times_utc.asi8, kind='stable')
+    times_utc = times_utc[order]
+    irradiance_data = irradiance_data.iloc[order].reset_index(drop=True)
+
+    # Rows to evaluate and the number of minutes each row represents
+    interval = pd.Timedelta(resolution if resolution is not None else '15min')
+    if resolution is None:
+        minutes = np.ones(len(times_utc))
+    else:
+        times_utc, irradiance_data, minutes = aggregate_irradiance(times_utc, irradiance_data, resolution)
+
+    # Output interval of every row
+    bin_starts = times_utc.floor(interval)
+    first_bin = bin_starts[0]
+    bins = ((bin_starts - first_bin) // interval).values.astype(np.int64)
+    n_bins = bins[-1] + 1
+
+    # Ambient temperature of every orientation, chosen per tilt like calculation_power_output
+    temperatures = {col: irradiance_data[col].values for col in ['T_RV_degC', 'T_CommRoof_degC']}
+    use_rv = np.array([temperature_column(tilt) == 'T_RV_degC' for tilt in tilt_grid])[:, None]
+
+    ghi = irradiance_data['GlobRad'].values
+    dhi = irradiance_data['DiffRad'].values
+    yields = np.zeros((len(tilt_grid), n_bins))
+
+    for start in range(0, len(times_utc), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        geometry = solar_geometry(times_utc[chunk], LATITUDE, LONGITUDE)
+        dni = cached_dni(ghi[chunk], dhi[chunk], geometry)
+
+        poa_global = poa_global_broadcast(tilt_grid, azimuth_grid, geometry['zenith'].values, geometry['azimuth'].values, dni, ghi[chunk], dhi[chunk], albedo=ALBEDO)
+        temp_cell = np.where(use_rv, temperatures['T_RV_degC'][chunk], temperatures['T_CommRoof_degC'][chunk])
+        power_kw = pvlib.pvsystem.pvwatts_dc(g_poa_effective=poa_global, temp_cell=temp_cell, pdc0=N_module * WP_panel, gamma_pdc=TEMP_COEFF) / 1000
+        energy_kwh = np.nan_to_num(power_kw * minutes[chunk] / 60)
+
+        # Sum the energy into the output intervals of the chunk
+        chunk_bins, bin_index = np.unique(bins[chunk], return_index=True)
+        yields[:, chunk_bins] += np.add.reduceat(energy_kwh, bin_index, axis=1)
+
+    datetimes = pd.date_range(first_bin, periods=n_bins, freq=interval).tz_convert('Europe/Brussels')
+
+    if fill_outages:
+        slots_per_day = int(pd.Timedelta('1D') / interval)
+        day_ids = pd.factorize(datetimes.date)[0]
+        yields = fill_gaps(yields, yields == 0, min_length=3 * slots_per_day + 1, slots_per_day=slots_per_day, day_ids=day_ids)
+
+    yields = yields.reshape(len(tilts), len(azimuths), n_bins)
+    annual_yield = pd.DataFrame(yields.sum(axis=2), index=pd.Index(tilts, name='tilt'), columns=pd.Index(azimuths, name='azimuth'))
+
+    return annual_yield, yields, datetimes
+
+
+def compare_aggregate_first(irradiance_data, tilts, azimuths, WP_panel, N_module, resolution='15min'):
+    """
+    Compare the aggregate-first model with the 1-minute model for a grid of orientations.
+    The 1-minute reference is summed to the same resolution before comparing.
+
+    Parameters:
+        irradiance_data (DataFrame): 1-minute irradiance data as read from the irradiance csv.
+        tilts, azimuths (array-like): Orientations to compare (degrees).
+        WP_panel (float): Peak power per module (W).
+        N_module (int): Number of modules.
+        resolution (str): Resolution of the aggregate-first model ('15min', '1h', ...).
+
+    Returns:
+        DataFrame: One row per orientation with the annual yield of both models (kWh), the
+                   annual error (%), and the mean absolute, RMS and maximum absolute error per
+                   interval (kWh).
+    """
+    reference_annual, reference, reference_datetimes = orientation_sweep(irradiance_data, tilts, azimuths, WP_panel, N_module, fill_outages=False)
+    annual, approximate, datetimes = orientation_sweep(irradiance_data, tilts, azimuths, WP_panel, N_module, fill_outages=False, resolution=resolution)
+
+    # Sum the 15-minute reference into the intervals of the aggregate-first model
+    interval_index = ((reference_datetimes.tz_convert('UTC').floor(resolution) - datetimes[0]) // pd.Timedelta(resolution)).values
+    reference_binned = np.zeros_like(approximate)
+    np.add.at(reference_binned, (slice(None), slice(None), interval_index), reference)
+
+    error = approximate - reference_binned
+    comparison = pd.DataFrame({
+        'reference_kWh': reference_annual.stack(),
+        'aggregate_first_kWh': annual.stack(),
+    })
+    comparison['annual_error_%'] = 100 * (comparison['aggregate_first_kWh'] / comparison['reference_kWh'] - 1)
+    comparison['mean_abs_error_kWh'] = np.abs(error).mean(axis=2).ravel()
+    comparison['rms_error_kWh'] = np.sqrt((error ** 2).mean(axis=2)).ravel()
+    comparison['max_abs_error_kWh'] = np.abs(error).max(axis=2).ravel()
+
+    return comparison
@@ -0,0 +1,262 @@
+import time
+import numpy as np
+import pandas as pd
+from smart_lp import cached_smart_lp
+
+# Dynamic programming solver for the smart battery problem of a single battery with perfect
+# foresight of the prices. The stored energy is discretized on a grid of SOC levels and the
+# best value of every level is carried from one interval to the next, with the values between
+# levels interpolated linearly. In an interval the battery can either only charge (PV surplus)
+# or only discharge (residual load) and the reward is linear in the energy moved, so the best
+# predecessor of a level is either another level inside a sliding window or the predecessor at
+# the full power of the interval. The sliding window maximum is evaluated for all levels at
+# once with NumPy (log2(window) shifted comparisons), which gives a runtime that only depends
+# on the number of intervals and levels, without an LP solver.
+_SNAP = 1e-9  # Positions this close to a level (in levels) are taken as the level
+
+
+def _window_max(values, width):
+    # Maximum over values[j - width + 1 : j + 1] for every j (trailing window)
+    n = len(values)
+    best = values.copy()
+    span = 1
+    while span < width:
+        shift = min(span, width - span)  # The last step overlaps, which is fine for a maximum
+        shifted = np.full(n, -np.inf)
+        shifted[shift:] = best[:-shift]
+        best = np.maximum(best, shifted)
+        span += shift
+    return best
+
+
+def _shifted_values(values, move):
+    # Interpolated values at position j - move for every level j, -inf below the first level
+    n = len(values)
+    whole = int(np.floor(move + _SNAP))
+    fraction = move - whole
+    shifted = np.full(n, -np.inf)
+    if fraction <= _SNAP:
+        if whole < n:
+            shifted[whole:] = values[:n - whole]
+    elif whole + 1 < n:
+        shifted[whole + 1:] = fraction * values[:n - whole - 1] + (1 - fraction) * values[1:n - whole]
+    return shifted
+
+
+def _value_at(values, position):
+    # Interpolated value at a fractional position (in levels)
+    lower = int(np.floor(position + _SNAP))
+    fraction = position - lower
+    if fraction <= _SNAP or lower >= len(values) - 1:
+        return values[min(lower, len(values) - 1)]
+    return (1 - fraction) * values[lower] + fraction * values[lower + 1]
+
+
+def _best_predecessor(values, position, move, gain, grid):
+    # Predecessor of position within position + move (move < 0 looks down) with the best value
+    # plus gain per level moved. The candidates are the position itself, the levels in between
+    # and the end point; ties keep the smallest move.
+    end = min(max(position + move, 0.0), len(values) - 1.0)
+    best_position, best_score = position, _value_at(values, position)
+    if move < 0:
+        levels = grid[int(np.ceil(end - _SNAP)):int(np.floor(position + _SNAP)) + 1][::-1]
+    else:
+        levels = grid[int(np.ceil(position - _SNAP)):int(np.floor(end + _SNAP)) + 1]
+    if len(levels):
+        scores = values[levels] + gain * np.abs(levels - position)
+        k = np.argmax(scores)
+        if scores[k] > best_score:
+            best_position, best_score = float(levels[k]), scores[k]
+    if _value_at(values, end) + gain * abs(end - position) > best_score:
+        best_position = end
+    return best_position
+
+
+def soc_grid(E_min, E_max, soc_step, anchors):
+    """
+    Uniform SOC grid with a step of at most soc_step on which every anchor (start and end SOC) is
+    an exact level.
+
+    The grid covers [E_min, E_max] with the smallest number of steps that puts the anchors on
+    levels. If no such step exists (e.g. an irrational ratio), the grid is built around the first
+    anchor with a step that divides the distance to the others, and its outer levels may lie up
+    to one step inside E_min and E_max.
+
+    Parameters:
+        E_min, E_max (float): Minimum and maximum stored energy (kWh).
+        soc_step (float): Largest step of the grid (kWh).
+        anchors (list): SOC values (kWh) that must be levels.
+
+    Returns:
+        tuple: (base, step, n_levels) with the SOC of level 0 (kWh), the step (kWh) and the
+               number of levels.
+    """
+    anchors = np.asarray(anchors, dtype=float)
+    if np.any(anchors < E_min - 1e-9) or np.any(anchors > E_max + 1e-9):
+        raise ValueError("The start and end SOC must lie within [E_min, E_max].")
+    span = E_max - E_min
+    if span <= 0:
+        return E_min, 1.0, 1
+    first_steps = max(int(np.ceil(span / soc_step - 1e-9)), 1)
+    for n_steps in range(first_steps, 2 * first_steps + 1):
+        positions = (anchors - E_min) / span * n_steps
+        if np.all(np.abs(positions - np.round(positions)) <= 1e-6):
+            return E_min, span / n_steps, n_steps + 1
+
+    # Grid around the first anchor with a step that divides the distances to the other anchors
+    distance = np.max(np.abs(anchors - anchors[0]))
+    step = soc_step if distance == 0 else distance / np.ceil(distance / soc_step - 1e-9)
+    if np.any(np.abs((anchors - anchors[0]) / step - np.round((anchors - anchors[0]) / step)) > 1e-6):
+        raise ValueError("The start and end SOC cannot both be levels of a uniform SOC grid.")
+    below = int(np.floor((anchors[0] - E_min) / step + 1e-9))
+    above = int(np.floor((E_max - anchors[0]) / step + 1e-9))
+    return anchors[0] - below * step, step, below + above + 1
+
+
+def solve_smart_dp(prices, residual, c_max, d_max, E_max, E_min=0.0, eta_c=1.0, eta_d=1.0, aplha=100, delta_t=0.25, E_start=None, E_end=None, pin_first=True, soc_step=0.05):
+    """
+    Solve the smart battery problem of solve_smart_lp with dynamic programming over a grid of SOC
+    levels (same constraints: charge only with PV surplus, discharge only with a residual load,
+    throughput weight aplha and the cyclic SOC).
+
+    The grid is built with soc_grid, so E_start and E_end are exact levels and the DP solves the
+    same problem as the LP. The values between the levels are interpolated, so the result is a
+    feasible schedule whose objective is a lower bound of the LP objective. A smaller soc_step is
+    closer to the LP and the runtime and memory (intervals x levels values) grow with the number
+    of levels.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW), load minus PV.
+        c_max, d_max (float): Maximum charge and discharge power (kW).
+        E_max, E_min (float): Maximum and minimum stored energy (kWh).
+        eta_c, eta_d (float): Charge and discharge efficiency.
+        aplha (float): Weight of the throughput term of the objective.
+        delta_t (float): Length of an interval (hours).
+        E_start (float): Stored energy at the start, E_max / 2 if None.
+        E_end (float): Stored energy after the last interval, E_max / 2 if None; np.nan leaves it free.
+        pin_first (bool): True fixes E[0] = E_start as in smartmodel, False applies the dynamics
+                          from E_start in the first interval as well (see build_smart_lp).
+        soc_step (float): Largest step of the SOC grid (kWh), see soc_grid.
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    N = len(prices)
+    E_start = E_max / 2 if E_start is None else E_start
+    E_end = E_max / 2 if E_end is None else E_end
+
+    # SOC grid, positions are expressed in levels
+    base, step, n_levels = soc_grid(E_min, E_max, soc_step, [E_start] if np.isnan(E_end) else [E_start, E_end])
+    grid = np.arange(n_levels)
+    start_level = int(round((E_start - base) / step))
+    end_level = None if np.isnan(E_end) else int(round((E_end - base) / step))
+
+    # Energy the battery can move up (charging) or down (discharging) per interval, in levels,
+    # from the bounds of build_smart_lp, and the objective gain per level moved
+    c_upper = np.where(residual < 0, np.minimum(c_max, -residual), 0.0)
+    d_upper = np.where(residual > 0, np.minimum(d_max, residual), 0.0)
+    up_moves = c_upper * delta_t * eta_c / step
+    down_moves = d_upper * delta_t / eta_d / step
+    up_gain = (aplha - prices) * step / (delta_t * eta_c)
+    down_gain = (aplha + prices) * step * eta_d / delta_t
+
+    # Forward pass: values[t + 1] is the best value of every level after interval t
+    first = 1 if pin_first else 0
+    values = np.empty((N + 1, n_levels))
+    values[0] = -np.inf
+    values[0, start_level] = 0.0
+    values[1:first + 1] = values[0]
+    for t in range(first, N):
+        value = values[t]
+        if up_moves[t] > 0:
+            width = int(np.floor(up_moves[t] + _SNAP))
+            best = _window_max(value - up_gain[t] * grid, width + 1) + up_gain[t] * grid
+            full = _shifted_values(value, up_moves[t]) + up_gain[t] * up_moves[t]
+            values[t + 1] = np.maximum(best, full)
+        elif down_moves[t] > 0:
+            # Leading window over the higher levels: a trailing window on the reversed levels
+            width = int(np.floor(down_moves[t] + _SNAP))
+            best = _window_max((value + down_gain[t] * grid)[::-1], width + 1)[::-1] - down_gain[t] * grid
+            full = _shifted_values(value[::-1], down_moves[t])[::-1] + down_gain[t] * down_moves[t]
+            values[t + 1] = np.maximum(best, full)
+        else:
+            values[t + 1] = value
+
+    # Backward pass: from the end level, the predecessor of every interval that gives its value
+    # (the smallest move when several do)
+    position = float(end_level if end_level is not None else np.argmax(values[N]))
+    if not np.isfinite(values[N, int(position)]):
+        raise RuntimeError("Smart battery DP not solved: the end SOC cannot be reached on the SOC grid.")
+    path = np.empty(N + 1)
+    path[N] = position
+    for t in range(N - 1, first - 1, -1):
+        if up_moves[t] > 0:
+            position = _best_predecessor(values[t], position, -up_moves[t], up_gain[t], grid)
+        elif down_moves[t] > 0:
+            position = _best_predecessor(values[t], position, down_moves[t], down_gain[t], grid)
+        path[t] = position
+    path[:first] = start_level
+
+    SOC_kWh = base + step * path[1:]
+    moved = np.diff(path) * step
+    charge_kW = np.maximum(moved, 0) / (delta_t * eta_c)
+    discharge_kW = np.maximum(-moved, 0) * eta_d / delta_t
+    if pin_first:
+        # c[0] and d[0] do not change the SOC in the pinned model, so they take their best bound
+        charge_kW[0] = c_upper[0] if aplha - prices[0] > 0 else 0.0
+        discharge_kW[0] = d_upper[0] if aplha + prices[0] > 0 else 0.0
+    objective = np.sum(prices * (discharge_kW - charge_kW) + aplha * (discharge_kW + charge_kW))
+    return charge_kW, discharge_kW, SOC_kWh, objective
+
+
+def benchmark_smart_dp(prices, residual, battery, soc_steps=(0.2, 0.1, 0.05, 0.02), reference=None):
+    """
+    Compare the runtime and objective of solve_smart_dp at several SOC resolutions with the
+    PuLP model of smartmodel.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW).
+        battery (dict): Battery parameters of solve_smart_lp ('c_max', 'd_max', 'E_max', ...).
+        soc_steps (list): SOC resolutions (kWh) to benchmark.
+        reference (tuple): Reference solution (charge_kW, discharge_kW, SOC_kWh, objective). None
+                           solves the PuLP model (through the solution cache of smart_lp.py).
+
+    Returns:
+        DataFrame: One row per resolution with the number of levels, the runtime (s), the
+                   objective and its gap with the reference (%), plus a row for the reference.
+    """
+    from Smartmodel import solve_pulp
+
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    args = {'E_min': 0.0, 'eta_c': 1.0, 'eta_d': 1.0, 'aplha': 100, 'delta_t': 0.25}
+    args.update(battery)
+
+    start = time.perf_counter()
+    if reference is None:
+        reference = cached_smart_lp(prices, residual, battery, backend='pulp', solve=lambda: solve_pulp(
+            prices, residual, args['c_max'], args['d_max'], args['E_max'], args['eta_c'], args['eta_d'], args['aplha'], args['delta_t'], args['E_min']))
+    rows = [{'solver': 'pulp', 'soc_step': np.nan, 'levels': np.nan, 'seconds': time.perf_counter() - start, 'objective': reference[3]}]
+
+    for soc_step in soc_steps:
+        start = time.perf_counter()
+        objective = solve_smart_dp(prices, residual, soc_step=soc_step, **args)[3]
+        rows.append({'solver': 'dp', 'soc_step': soc_step, 'levels': soc_grid(args['E_min'], args['E_max'], soc_step, [args.get('E_start', args['E_max'] / 2)])[2],
+                     'seconds': time.perf_counter() - start, 'objective': objective})
+
+    benchmark = pd.DataFrame(rows)
+    benchmark['gap_pct'] = (reference[3] - benchmark['objective']) / abs(reference[3]) * 100
+    return benchmark
+
+
+if __name__ == '__main__':
+    # Same data preparation as smartmodel, so the PuLP reference is shared with its solution cache
+    df = pd.read_excel('results/data.xlsx')
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df = df.sort_values('datetime').reset_index(drop=True)
+    residual = df['Volume_Afname_kWh'] / 0.25 - df['Power_Output_kWh'] / 0.25
+    print(benchmark_smart_dp(df['Euro'].astype(float).values, residual.values, {'c_max': 5.85, 'd_max': 5.85, 'E_max': 5.85}))
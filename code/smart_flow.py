@@ -0,0 +1,119 @@
+import numpy as np
+from battery_kernels import storage_flow
+from smart_lp import _battery_args, solve_smart_lp
+
+# Exact solver of the smart battery problem for a lossless battery (eta_c = eta_d = 1, as in
+# smartmodel). Without losses the problem is a min-cost flow: energy flows from charging
+# intervals to later discharging intervals through a store of limited capacity. It is solved
+# with the slope representation of that flow: after every interval the best value as a
+# function of the SOC is concave and piecewise linear, and its slopes are the marginal value
+# of the stored energy. Every interval adds one slope (its own price) and the store capacity
+# cuts the slopes at the ends; a Fenwick tree over the slope order does both in O(log T).
+# A year is solved in milliseconds with the compiled kernel (battery_kernels.py).
+
+
+def flow_arrays(prices, residual, c_max, d_max, aplha=100, delta_t=0.25):
+    """
+    Prepare the inputs of the storage_flow kernel: the energy every interval can move and the
+    rank of its slope (value per kWh) in the order of all slopes.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW), load minus PV.
+        c_max, d_max (float): Maximum charge and discharge power (kW).
+        aplha (float): Weight of the throughput term of the objective.
+        delta_t (float): Length of an interval (hours).
+
+    Returns:
+        tuple: (moves, ranks, gt_count, ge_count, positive_count) with the energy per interval
+               (kWh, + for charging and - for discharging), the rank of every slope (largest
+               first), the number of slopes larger than and at least the slope of every interval
+               and the number of positive slopes.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    # Charge only with PV surplus and discharge only with a residual load, like build_smart_lp
+    charge = np.where(residual < 0, np.minimum(c_max, -residual), 0.0) * delta_t
+    discharge = np.where(residual > 0, np.minimum(d_max, residual), 0.0) * delta_t
+    moves = charge - discharge
+
+    # Value of one kWh more in store after the interval: a kWh charged earns aplha - price, a
+    # kWh not discharged loses aplha + price (per kW, so divided by delta_t)
+    slopes = np.where(moves > 0, (aplha - prices) / delta_t, -(aplha + prices) / delta_t)
+    order = np.argsort(-slopes, kind='stable')
+    ranks = np.empty(len(slopes), dtype=np.int64)
+    ranks[order] = np.arange(len(slopes))
+    descending = -slopes[order]
+    gt_count = np.searchsorted(descending, -slopes, side='left')
+    ge_count = np.searchsorted(descending, -slopes, side='right')
+    positive_count = np.searchsorted(descending, 0.0, side='left')
+    return moves, ranks, gt_count, ge_count, positive_count
+
+
+def solve_smart_flow(prices, residual, c_max, d_max, E_max, E_min=0.0, eta_c=1.0, eta_d=1.0, aplha=100, delta_t=0.25, E_start=None, E_end=None, pin_first=True, backend=None):
+    """
+    Solve the smart battery problem of solve_smart_lp exactly for a lossless battery, without an
+    LP solver (see build_smart_lp for the parameters).
+
+    Parameters:
+        backend (str): Backend of the storage_flow kernel ('numba' or 'python', None for the default).
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
+    """
+    if eta_c != 1 or eta_d != 1:
+        raise ValueError("The flow solver only handles a lossless battery (eta_c = eta_d = 1), use solve_smart_lp.")
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    E_start = E_max / 2 if E_start is None else E_start
+    E_end = E_max / 2 if E_end is None else E_end
+    first = 1 if pin_first else 0
+
+    moves, ranks, gt_count, ge_count, positive_count = flow_arrays(prices, residual, c_max, d_max, aplha, delta_t)
+    path, feasible = storage_flow(moves, ranks, gt_count, ge_count, positive_count, len(moves), E_start, E_end, E_min, E_max, first, backend=backend)
+    if not feasible:
+        raise RuntimeError("Smart battery flow not solved: the end SOC cannot be reached.")
+
+    moved = np.diff(path)
+    charge_kW = np.maximum(moved, 0) / delta_t
+    discharge_kW = np.maximum(-moved, 0) / delta_t
+    if pin_first:
+        # c[0] and d[0] do not change the SOC in the pinned model, so they take their best bound
+        charge_kW[0] = max(moves[0], 0) / delta_t if aplha - prices[0] > 0 else 0.0
+        discharge_kW[0] = max(-moves[0], 0) / delta_t if aplha + prices[0] > 0 else 0.0
+    objective = np.sum(prices * (discharge_kW - charge_kW) + aplha * (discharge_kW + charge_kW))
+    return charge_kW, discharge_kW, path[1:], objective
+
+
+def solve_smart_flow_batch(prices, residual, battery, backend=None):
+    """
+    Solve the smart battery problem for many households with the same prices.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load (kW) of shape (households, T).
+        battery (dict): Battery parameters of solve_smart_lp ('c_max', 'd_max', 'E_max', ...),
+                        the same for every household.
+        backend (str): Backend of the storage_flow kernel.
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective), arrays of shape (households, T) and
+               the objective per household.
+    """
+    residual = np.atleast_2d(np.asarray(residual, dtype=float))
+    results = [solve_smart_flow(prices, household, backend=backend, **_battery_args(battery)) for household in residual]
+    return (np.stack([result[0] for result in results]), np.stack([result[1] for result in results]),
+            np.stack([result[2] for result in results]), np.array([result[3] for result in results]))
+
+
+def compare_with_lp(prices, residual, battery, pin_first=True):
+    """
+    Cross-check solve_smart_flow against the LP (HiGHS) for the same problem.
+
+    Returns:
+        tuple: (flow_objective, lp_objective, max_soc_difference). The objectives agree up to the
+               solver tolerance; the schedules may differ where the optimum is not unique.
+    """
+    flow = solve_smart_flow(prices, residual, pin_first=pin_first, **_battery_args(battery))
+    lp = solve_smart_lp(prices, residual, pin_first=pin_first, **_battery_args(battery))
+    return flow[3], lp[3], np.max(np.abs(flow[2] - lp[2]))
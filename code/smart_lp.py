@@ -0,0 +1,297 @@
+import os
+import json
+import hashlib
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import linprog
+
+# Matrix form of the smart battery LP of Smartmodel.smartmodel.
+# Variables x = [c (N), d (N), E (N)]: charge and discharge power (kW) and stored energy (kWh).
+# The SOC dynamics are a banded equality matrix and the charge/discharge restrictions (only
+# charge with PV overproduction, only discharge with a residual load) are variable bounds, so
+# the whole problem is built with a few sparse array operations instead of one Python
+# expression per constraint. It is solved in-process with HiGHS through scipy.optimize.linprog.
+#
+# Solutions are cached (cached_smart_lp) by a hash of the prices, the residual load and the
+# battery parameters, in memory for the process and as .npz files in the cache directory, so
+# a problem that did not change is not solved again.
+CACHE_DIR = 'data/cache'  # Same directory as the data cache (data_cache.py)
+MAX_DISK_ENTRIES = 32  # Oldest smart LP solutions are removed above this number
+CACHE_VERSION = 1  # Bump when the LP changes so old solutions are not reused
+
+_memory_cache = {}  # Solutions of this process, keyed by file name
+
+
+def build_smart_lp(prices, residual, c_max, d_max, E_max, E_min=0.0, eta_c=1.0, eta_d=1.0, aplha=100, delta_t=0.25, E_start=None, E_end=None, pin_first=True):
+    """
+    Build the smart battery LP in matrix form (minimization, as scipy.optimize.linprog expects).
+
+    The objective maximizes sum(prices * (d - c) + aplha * (d + c)) like smartmodel.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW), load minus PV.
+        c_max, d_max (float): Maximum charge and discharge power (kW).
+        E_max, E_min (float): Maximum and minimum stored energy (kWh).
+        eta_c, eta_d (float): Charge and discharge efficiency.
+        aplha (float): Weight of the throughput term of the objective.
+        delta_t (float): Length of an interval (hours).
+        E_start (float): Stored energy at the start, E_max / 2 if None.
+        E_end (float): Stored energy after the last interval, E_max / 2 if None; np.nan leaves it free.
+        pin_first (bool): True fixes E[0] = E_start as in smartmodel (c[0] and d[0] do not change E).
+                          False applies the dynamics from E_start in the first interval as well,
+                          which is what consecutive windows need.
+
+    Returns:
+        tuple: (cost, A_eq, b_eq, bounds) for linprog, with bounds an (3N, 2) array.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    N = len(prices)
+    E_start = E_max / 2 if E_start is None else E_start
+    E_end = E_max / 2 if E_end is None else E_end
+
+    # Objective: maximize prices * (d - c) + aplha * (d + c), so minimize the negative
+    cost = np.concatenate([prices - aplha, -prices - aplha, np.zeros(N)])
+
+    # SOC dynamics: E[t] - E[t-1] - delta_t * eta_c * c[t] + delta_t / eta_d * d[t] = 0
+    first = 1 if pin_first else 0
+    rows = np.arange(N - first)
+    t = rows + first
+    A_eq = sp.hstack([
+        sp.csr_matrix((np.full(len(t), -delta_t * eta_c), (rows, t)), shape=(len(t), N)),
+        sp.csr_matrix((np.full(len(t), delta_t / eta_d), (rows, t)), shape=(len(t), N)),
+        sp.diags([np.ones(len(t)), -np.ones(len(t))], [first, first - 1], shape=(len(t), N)),
+    ], format='csr')
+    b_eq = np.zeros(len(t))
+    if not pin_first:
+        # The first row refers to E[-1] = E_start, which is a constant
+        b_eq[0] = E_start
+
+    # Bounds: charge only when residual < 0, discharge only when residual > 0
+    c_upper = np.where(residual < 0, np.minimum(c_max, -residual), 0.0)
+    d_upper = np.where(residual > 0, np.minimum(d_max, residual), 0.0)
+    E_lower = np.full(N, float(E_min))
+    E_upper = np.full(N, float(E_max))
+    if pin_first:
+        E_lower[0] = E_upper[0] = E_start
+    if not np.isnan(E_end):
+        E_lower[-1] = E_upper[-1] = E_end
+    bounds = np.column_stack([
+        np.concatenate([np.zeros(2 * N), E_lower]),
+        np.concatenate([c_upper, d_upper, E_upper]),
+    ])
+    return cost, A_eq, b_eq, bounds
+
+
+def solve_smart_lp(prices, residual, c_max, d_max, E_max, E_min=0.0, eta_c=1.0, eta_d=1.0, aplha=100, delta_t=0.25, E_start=None, E_end=None, pin_first=True, options=None):
+    """
+    Build and solve the smart battery LP with HiGHS (see build_smart_lp for the parameters).
+
+    Parameters:
+        options (dict): Options passed to linprog (e.g. {'presolve': False}).
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) with the optimal schedule as arrays and
+               the maximized objective value.
+    """
+    N = len(prices)
+    cost, A_eq, b_eq, bounds = build_smart_lp(prices, residual, c_max, d_max, E_max, E_min, eta_c, eta_d, aplha, delta_t, E_start, E_end, pin_first)
+    result = linprog(cost, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method='highs', options=options)
+    if result.status != 0:
+        raise RuntimeError(f"Smart battery LP not solved: {result.message}")
+    x = result.x
+    return x[:N], x[N:2 * N], x[2 * N:], -result.fun
+
+
+def _battery_args(battery):
+    # Keyword arguments of solve_smart_lp from a dict of battery parameters
+    keys = ['c_max', 'd_max', 'E_max', 'E_min', 'eta_c', 'eta_d', 'aplha', 'delta_t']
+    return {key: battery[key] for key in keys if key in battery}
+
+
+def rolling_horizon_lp(prices, residual, battery, window=96, lookahead=96, E_start=None, E_end=None):
+    """
+    Solve the smart battery LP in a rolling horizon, like a home controller with day-ahead prices.
+    Every step optimizes window + lookahead intervals from the current SOC, keeps the decisions
+    of the first window intervals and carries the SOC over to the next step.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW).
+        battery (dict): Battery parameters of solve_smart_lp ('c_max', 'd_max', 'E_max', ...).
+        window (int): Intervals that are kept per step (96 for daily, 672 for weekly steps).
+        lookahead (int): Extra intervals that are optimized but not kept.
+        E_start (float): Stored energy before the first interval, E_max / 2 if None.
+        E_end (float): Stored energy after the last interval, E_max / 2 if None; np.nan leaves it free.
+                       Only the last step (whose horizon reaches the end) is constrained.
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    N = len(prices)
+    args = _battery_args(battery)
+    soc = battery['E_max'] / 2 if E_start is None else E_start
+    E_end = battery['E_max'] / 2 if E_end is None else E_end
+
+    charge = np.zeros(N)
+    discharge = np.zeros(N)
+    stored = np.zeros(N)
+    for start in range(0, N, window):
+        stop = min(start + window + lookahead, N)
+        keep = min(window, N - start)
+        horizon = slice(start, stop)
+        if stop == N and not np.isnan(E_end):
+            try:
+                c, d, E, _ = solve_smart_lp(prices[horizon], residual[horizon], E_start=soc, E_end=E_end, pin_first=False, **args)
+            except RuntimeError:
+                # The carried SOC cannot reach the end target in the last horizon (e.g. no PV
+                # surplus to charge): finish with a free end level instead
+                c, d, E, _ = solve_smart_lp(prices[horizon], residual[horizon], E_start=soc, E_end=np.nan, pin_first=False, **args)
+        else:
+            c, d, E, _ = solve_smart_lp(prices[horizon], residual[horizon], E_start=soc, E_end=np.nan, pin_first=False, **args)
+
+        kept = slice(start, start + keep)
+        charge[kept] = c[:keep]
+        discharge[kept] = d[:keep]
+        stored[kept] = E[:keep]
+        soc = E[keep - 1]
+
+    aplha = battery.get('aplha', 100)
+    objective = np.sum(prices * (discharge - charge) + aplha * (discharge + charge))
+    return charge, discharge, stored, objective
+
+
+def _solve_window(task):
+    # Worker of decomposed_lp: one window between two boundary SOC targets
+    prices, residual, args, E_start, E_end = task
+    c, d, E, objective = solve_smart_lp(prices, residual, E_start=E_start, E_end=E_end, pin_first=False, **args)
+    return c, d, E, objective
+
+
+def decomposed_lp(prices, residual, battery, window=672, boundary_soc=None, max_workers=None):
+    """
+    Solve the smart battery LP as independent windows that are linked through SOC targets at
+    their boundaries. The windows are solved in parallel on a process pool, so the solver memory
+    is bounded by one window and a year uses all cores.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW).
+        battery (dict): Battery parameters of solve_smart_lp ('c_max', 'd_max', 'E_max', ...).
+        window (int): Intervals per window (672 for weekly windows).
+        boundary_soc (array-like): Stored energy at every window boundary (windows + 1 values,
+                                   the first is the start and the last the end of the year).
+                                   E_max / 2 at every boundary if None, like the cyclic constraint.
+        max_workers (int): Number of worker processes (None uses all cores, 0 solves in this process).
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    N = len(prices)
+    starts = np.arange(0, N, window)
+    if boundary_soc is None:
+        boundary_soc = np.full(len(starts) + 1, battery['E_max'] / 2)
+    boundary_soc = np.asarray(boundary_soc, dtype=float)
+    if len(boundary_soc) != len(starts) + 1:
+        raise ValueError(f"Expected {len(starts) + 1} boundary SOC values, got {len(boundary_soc)}.")
+
+    args = _battery_args(battery)
+    tasks = [
+        (prices[start:start + window], residual[start:start + window], args, boundary_soc[k], boundary_soc[k + 1])
+        for k, start in enumerate(starts)
+    ]
+    if max_workers == 0:
+        results = [_solve_window(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(_solve_window, tasks))
+
+    charge = np.concatenate([result[0] for result in results])
+    discharge = np.concatenate([result[1] for result in results])
+    stored = np.concatenate([result[2] for result in results])
+    objective = sum(result[3] for result in results)
+    return charge, discharge, stored, objective
+
+
+def _problem_hash(prices, residual):
+    # Hash of the time series of the problem, shared by all battery parameters
+    sha = hashlib.sha256()
+    for array in (prices, residual):
+        sha.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return sha.hexdigest()[:32]
+
+
+def _solution_hash(problem, battery, backend):
+    parameters = {key: float(value) for key, value in _battery_args(battery).items()}
+    sha = hashlib.sha256(problem.encode())
+    sha.update(json.dumps([CACHE_VERSION, backend, parameters], sort_keys=True).encode())
+    return sha.hexdigest()[:32]
+
+
+def _evict_disk_cache(cache_dir):
+    # Keep the most recently used smart LP solutions
+    names = [name for name in os.listdir(cache_dir) if name.startswith('smartlp_') and name.endswith('.npz') and not name.endswith('.tmp.npz')]
+    paths = sorted((os.path.join(cache_dir, name) for name in names), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - MAX_DISK_ENTRIES, 0)]:
+        os.remove(path)
+
+
+def _load_solution(path):
+    with np.load(path) as npz:
+        meta = json.loads(str(npz['meta']))
+        return (npz['charge'], npz['discharge'], npz['stored'], meta['objective']), meta
+
+
+def cached_smart_lp(prices, residual, battery, solve=None, backend='highs', cache_dir=CACHE_DIR):
+    """
+    Solve the smart battery LP, reusing the cached solution when the prices, the residual load
+    and the battery parameters did not change.
+
+    On a miss the problem is solved from scratch: HiGHS through linprog does not accept a
+    starting point, and CBC only uses one for a MIP, so a previous solution would not speed up
+    the LP.
+
+    Parameters:
+        prices (array-like): Electricity price per interval (EUR/MWh).
+        residual (array-like): Residual load per interval (kW).
+        battery (dict): Battery parameters of solve_smart_lp ('c_max', 'd_max', 'E_max', ...).
+        solve (callable): solve() returning (charge_kW, discharge_kW, SOC_kWh, objective).
+                          None solves with HiGHS.
+        backend (str): Name of the solver, part of the cache key.
+        cache_dir (str): Directory of the cache, None to keep the solutions in memory only.
+
+    Returns:
+        tuple: (charge_kW, discharge_kW, SOC_kWh, objective) like solve_smart_lp.
+    """
+    prices = np.asarray(prices, dtype=float)
+    residual = np.asarray(residual, dtype=float)
+    problem = _problem_hash(prices, residual)
+    name = f'smartlp_{_solution_hash(problem, battery, backend)}.npz'
+    if name in _memory_cache:
+        return _memory_cache[name]
+
+    path = os.path.join(cache_dir, name) if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        os.utime(path)  # Mark the entry as recently used
+        solution = _load_solution(path)[0]
+    else:
+        if solve is None:
+            solve = lambda: solve_smart_lp(prices, residual, **_battery_args(battery))
+        solution = solve()
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            meta = {'problem': problem, 'backend': backend, 'objective': float(solution[3]),
+                    'battery': {key: float(value) for key, value in _battery_args(battery).items()}}
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, meta=np.array(json.dumps(meta)), charge=solution[0], discharge=solution[1], stored=solution[2])
+            os.replace(tmp_path, path)
+            _evict_disk_cache(cache_dir)
+
+    _memory_cache[name] = solution
+    return solution
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pvlib
+
+# Cache for the solar geometry of the PV calculations.
+# The sun position only depends on the timestamps and the location, so it is calculated once
+# and reused for every orientation, roof configuration and battery scenario. Results are kept
+# in memory for the process and stored as .npz files in the cache directory for later runs.
+CACHE_DIR = 'data/cache'  # Same directory as the data cache (data_cache.py)
+MAX_DISK_ENTRIES = 64  # Oldest solar geometry files are removed above this number
+MAX_MEMORY_ENTRIES = 8  # Least recently used results are dropped from memory above this number
+GEOMETRY_COLUMNS = ['apparent_zenith', 'zenith', 'azimuth', 'dni_extra', 'airmass']
+
+_memory_cache = OrderedDict()  # Results of this process, keyed by file name, least recently used first
+
+
+def _array_hash(*arrays):
+    sha = hashlib.sha256()
+    for array in arrays:
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()[:32]
+
+
+def _evict_disk_cache(cache_dir):
+    # Keep the most recently used solar geometry files
+    names = [name for name in os.listdir(cache_dir) if name.startswith(('solar_', 'dni_')) and name.endswith('.npz') and not name.endswith('.tmp.npz')]
+    paths = sorted((os.path.join(cache_dir, name) for name in names), key=os.path.getmtime)
+    for path in paths[:max(len(paths) - MAX_DISK_ENTRIES, 0)]:
+        os.remove(path)
+
+
+def _cached_arrays(name, compute, cache_dir):
+    # Look up a dict of arrays in memory, then on disk, and calculate it when both miss
+    if name in _memory_cache:
+        _memory_cache.move_to_end(name)  # Mark the entry as recently used
+        return _memory_cache[name]
+
+    path = os.path.join(cache_dir, name) if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        os.utime(path)  # Mark the entry as recently used
+        with np.load(path) as npz:
+            arrays = {key: npz[key] for key in json.loads(str(npz['meta']))}
+    else:
+        arrays = compute()
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, meta=np.array(json.dumps(list(arrays))), **arrays)
+            os.replace(tmp_path, path)
+            _evict_disk_cache(cache_dir)
+
+    _memory_cache[name] = arrays
+    while len(_memory_cache) > MAX_MEMORY_ENTRIES:
+        _memory_cache.popitem(last=False)
+    return arrays
+
+
+def solar_geometry(times, latitude, longitude, cache_dir=CACHE_DIR):
+    """
+    Calculate the solar position, extraterrestrial irradiance and relative airmass, reusing
+    the cached result for the same timestamps and location.
+
+    Parameters:
+        times (array-like): Timezone-aware timestamps.
+        latitude (float): Latitude of the site (degrees).
+        longitude (float): Longitude of the site (degrees).
+        cache_dir (str): Directory of the disk cache, or None to only cache in memory.
+
+    Returns:
+        DataFrame: Columns 'apparent_zenith', 'zenith', 'azimuth', 'dni_extra' and 'airmass',
+                   indexed by the timestamps.
+    """
+    times = pd.DatetimeIndex(times).tz_convert('UTC')
+    key = _array_hash(times.asi8, np.array([latitude, longitude], dtype=float))
+
+    def compute():
+        solar_position = pvlib.solarposition.get_solarposition(time=times, latitude=latitude, longitude=longitude)
+        return {
+            'apparent_zenith': solar_position['apparent_zenith'].values,
+            'zenith': solar_position['zenith'].values,
+            'azimuth': solar_position['azimuth'].values,
+            'dni_extra': np.asarray(pvlib.irradiance.get_extra_radiation(times)),
+            'airmass': np.asarray(pvlib.atmosphere.get_relative_airmass(solar_position['apparent_zenith'].values)),
+        }
+
+    arrays = _cached_arrays(f'solar_{key}.npz', compute, cache_dir)
+    return pd.DataFrame({col: arrays[col] for col in GEOMETRY_COLUMNS}, index=times)
+
+
+def cached_dni(ghi, dhi, geometry, cache_dir=CACHE_DIR):
+    """
+    Calculate the direct normal irradiance with pvlib.irradiance.dni, reusing the cached result
+    for the same irradiance data and solar geometry.
+
+    Parameters:
+        ghi (array-like): Global horizontal irradiance (W/m²).
+        dhi (array-like): Diffuse horizontal irradiance (W/m²).
+        geometry (DataFrame): Solar geometry returned by solar_geometry.
+        cache_dir (str): Directory of the disk cache, or None to only cache in memory.
+
+    Returns:
+        ndarray: Direct normal irradiance (W/m²).
+    """
+    ghi = np.asarray(ghi, dtype=float)
+    dhi = np.asarray(dhi, dtype=float)
+    zenith = geometry['zenith'].values
+    key = _array_hash(ghi, dhi, zenith)
+
+    def compute():
+        return {'dni': np.asarray(pvlib.irradiance.dni(ghi=ghi, dhi=dhi, zenith=zenith))}
+
+    return _cached_arrays(f'dni_{key}.npz', compute, cache_dir)['dni']
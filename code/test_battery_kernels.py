@@ -0,0 +1,269 @@
+from datetime import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from battery_kernels import HAVE_NUMBA, clamped_cumsum, ev_drive_discharge, ev_weekly_correction, storage_flow
+from battery_simulation import simulate_conventional_batch
+from Charge_battery import charge_intervals
+from Conventional_charge_discharge import conventional_battery
+from day_matrix import from_day_matrix, local_day_segments, open_day_matrix_store, store_segments, write_day_matrix_store
+from EV_charge import charge_ev_weekly
+from ev_fleet import simulate_ev_fleet
+from smart_flow import flow_arrays
+
+# Equivalence of the kernels with the loops they replace. The reference functions below are the
+# original pandas loops of conventional_battery, charge_ev_weekly, charge_battery and
+# discharge_battery, without the Excel output and the plots.
+# Kernels without an original loop (the EV fleet and the storage flow) are checked across backends.
+# Run from code/ with: python -m pytest test_battery_kernels.py
+BACKENDS = ['python'] + (['numba'] if HAVE_NUMBA else [])
+
+
+def make_data(n_weeks=5, seed=0):
+    # 15-minute intervals in local time around the spring DST change, with prices and a
+    # surplus (+) or deficit (-) rounded to 0.1 kWh, so about one interval in eight is exactly zero
+    rng = np.random.default_rng(seed)
+    datetimes = pd.date_range('2000-03-13', periods=n_weeks * 7 * 96 - 4, freq='15min', tz='Europe/Brussels')
+    net_power = rng.normal(0, 0.3, len(datetimes)).round(1)
+    return pd.DataFrame({
+        'datetime': datetimes,
+        'Euro': rng.normal(60, 40, len(datetimes)).round(2),
+        'power_difference_kwh': net_power,
+        'power_difference_kwh_for_conventional': net_power,
+    })
+
+
+def original_conventional_battery(battery_capacity, data):
+    current_charge = 0
+    charge_amount = 0
+    discharge_amount = 0
+    rows = []
+    for _, row in data.iterrows():
+        power_difference = row['power_difference_kwh_for_conventional']
+        if power_difference > 0:
+            charge_amount = min(power_difference, battery_capacity - current_charge)
+            current_charge += charge_amount
+            discharge_amount = 0
+        elif power_difference < 0:
+            discharge_amount = min(abs(power_difference), current_charge)
+            current_charge -= discharge_amount
+            charge_amount = 0
+        rows.append((charge_amount, discharge_amount, current_charge))
+    return np.array(rows).T
+
+
+def original_charge_ev_weekly(data, battery_capacity, max_charge_rate=2.3, drive_discharge=8):
+    max_charge = battery_capacity
+    max_charge_per_interval = max_charge_rate / 4
+    data = data.sort_values(by='datetime')
+
+    # First iteration: driving
+    results = []
+    current_charge = max_charge
+    current_day = None
+    current_week = None
+    daily_discharge_remaining = 0
+    for _, entry in data.iterrows():
+        dt = entry['datetime']
+        if current_week != dt.isocalendar()[1]:
+            current_week = dt.isocalendar()[1]
+            current_charge = max_charge
+        if current_day != dt.date():
+            current_day = dt.date()
+            daily_discharge_remaining = drive_discharge
+        if time(8, 0) <= dt.time() <= time(18, 0):
+            discharge_amount = min(drive_discharge / (10 * 4), daily_discharge_remaining)
+            current_charge -= discharge_amount
+            current_charge = max(current_charge, 0)
+            daily_discharge_remaining -= discharge_amount
+        results.append({"datetime": dt, "price": entry['Euro'], "power_surplus": entry['power_difference_kwh'],
+                        "charge_power": 0, "discharge_charge": current_charge})
+    results_df = pd.DataFrame(results)
+    results_df['charge_power'] = results_df['charge_power'].astype(float)
+
+    # Second iteration: charging with the power surplus, in price order
+    results_df = results_df.sort_values(by='price')
+    for _, row in results_df.iterrows():
+        dt = row['datetime']
+        charge_power = 0
+        if dt.weekday() >= 5 or dt.time() >= time(18, 0) or dt.time() <= time(8, 0):
+            charge_needed = max_charge - results_df.loc[row.name, 'discharge_charge']
+            if row['power_surplus'] > 0:
+                charge_power = min(charge_needed, row['power_surplus'], max_charge_per_interval)
+        results_df.loc[row.name, 'charge_power'] = charge_power
+
+    # Third iteration: weekly correction in chronological order
+    results_df = results_df.sort_values(by='datetime')
+    results_df['surplus_charge_power'] = results_df['charge_power']  # Charge power before the correction
+    current_week = None
+    for i, row in results_df.iterrows():
+        dt = row['datetime']
+        if current_week != dt.isocalendar()[1]:
+            current_week = dt.isocalendar()[1]
+            cumulative_charge_power = 0
+        cumulative_charge_power += row['charge_power']
+        updated_charge = row['discharge_charge'] + cumulative_charge_power
+        if updated_charge > max_charge:
+            excess = updated_charge - max_charge
+            adjusted_charge_power = max(0, row['charge_power'] - excess)
+            results_df.loc[i, 'charge_power'] = adjusted_charge_power
+            updated_charge = row['discharge_charge'] + cumulative_charge_power - (row['charge_power'] - adjusted_charge_power)
+        results_df.loc[i, 'updated_charge'] = updated_charge
+    return results_df
+
+
+def original_charge_levels(charge_power, temp_capacity):
+    # Charge levels of one day in charge_battery
+    current_charge = 0
+    charge_levels = []
+    for power in charge_power:
+        current_charge += power
+        if current_charge > temp_capacity:
+            current_charge = temp_capacity
+        charge_levels.append(current_charge)
+    return charge_levels
+
+
+def original_discharge_levels(discharge_power, previous_day_charge):
+    # Charge levels of one day in discharge_battery
+    current_charge = previous_day_charge
+    charge_levels = []
+    for power in discharge_power:
+        current_charge -= power
+        if current_charge < 0:
+            current_charge = 0
+        charge_levels.append(current_charge)
+    return charge_levels
+
+
+@pytest.mark.parametrize('backend', BACKENDS + ['numpy'])
+def test_conventional_soc_matches_original_loop(backend):
+    data = make_data(n_weeks=2)
+    expected = original_conventional_battery(9.0, data)
+    net_power = data['power_difference_kwh_for_conventional'].values
+    result = simulate_conventional_batch(net_power, 9.0, backend=backend)
+    # The original loop repeated the previous charge and discharge amounts when the net power is
+    # zero; the batched simulator reports 0 there (see test_conventional_battery_zero_net_power)
+    nonzero = net_power != 0
+    assert (~nonzero).any()
+    np.testing.assert_array_equal(expected[0][nonzero], result[0][0][nonzero])
+    np.testing.assert_array_equal(expected[1][nonzero], result[1][0][nonzero])
+    np.testing.assert_array_equal(expected[2], result[2][0])
+
+
+def test_conventional_battery_zero_net_power(tmp_path, monkeypatch):
+    # A run of zeros after charging and a run of zeros after discharging: nothing is charged or
+    # discharged and the stored energy does not change
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'results').mkdir()
+    net_power = np.array([2.0, 1.0, 0.0, 0.0, 0.0, -1.5, 0.0, 0.0, 0.5, -4.0, 0.0])
+    data = pd.DataFrame({
+        'datetime': pd.date_range('2000-05-30', periods=len(net_power), freq='15min', tz='Europe/Brussels'),
+        'power_difference_kwh': net_power,
+        'power_difference_kwh_for_conventional': net_power,
+    })
+    charge_schedule, discharge_schedule, _ = conventional_battery(9.0, data)
+    plt.close('all')
+
+    zero = net_power == 0
+    stored = charge_schedule['current_charge'].values
+    np.testing.assert_array_equal(charge_schedule['charge_power'].values[zero], 0)
+    np.testing.assert_array_equal(discharge_schedule['discharge_power'].values[zero], 0)
+    np.testing.assert_array_equal(stored[1:][zero[1:]], stored[:-1][zero[1:]])
+    np.testing.assert_array_equal(stored, [2.0, 3.0, 3.0, 3.0, 3.0, 1.5, 1.5, 1.5, 2.0, 0.0, 0.0])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_ev_kernels_match_original_loops(backend):
+    data = make_data()
+    expected = original_charge_ev_weekly(data, 60.0)
+
+    datetimes = data['datetime']
+    minute_of_day = datetimes.dt.hour.values * 60 + datetimes.dt.minute.values
+    days = datetimes.dt.date.values
+    weeks = datetimes.dt.isocalendar().week.values
+    new_day = np.r_[True, days[1:] != days[:-1]]
+    new_week = np.r_[True, weeks[1:] != weeks[:-1]]
+    in_drive_window = (minute_of_day >= 8 * 60) & (minute_of_day <= 18 * 60)
+    discharge_charge = ev_drive_discharge(in_drive_window, new_day, new_week, 60.0, 8.0, 8.0 / 40, backend=backend)
+    np.testing.assert_array_equal(discharge_charge, expected['discharge_charge'].values)
+
+    adjusted_charge_power, updated_charge = ev_weekly_correction(expected['discharge_charge'].values, expected['surplus_charge_power'].values, new_week, 60.0, backend=backend)
+    np.testing.assert_array_equal(adjusted_charge_power, expected['charge_power'].values)
+    np.testing.assert_array_equal(updated_charge, expected['updated_charge'].values)
+
+
+def test_charge_ev_weekly_matches_original():
+    data = make_data()
+    expected = original_charge_ev_weekly(data, 60.0)
+    result = charge_ev_weekly(data, 60.0, pd.DataFrame({'datetime': []}), write_excel=False, plot=False)
+    np.testing.assert_array_equal(result['charge_power'].values, expected['charge_power'].values)
+    np.testing.assert_array_equal(result['updated_charge'].values, expected['updated_charge'].values)
+    np.testing.assert_array_equal(result['discharge_charge'].values, expected['discharge_charge'].values)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_clamped_cumsum_matches_original_loops(backend):
+    rng = np.random.default_rng(1)
+    lengths = rng.integers(0, 40, 30)
+    segment_starts = np.r_[0, np.cumsum(lengths)]
+    power = rng.uniform(0, 1.5, segment_starts[-1])
+    capacities = rng.uniform(0, 9, len(lengths))
+
+    charge_levels = clamped_cumsum(power, segment_starts, upper=capacities, backend=backend)
+    discharge_levels = clamped_cumsum(-power, segment_starts, initial_levels=capacities, lower=0, backend=backend)
+    for k in range(len(lengths)):
+        day = slice(segment_starts[k], segment_starts[k + 1])
+        np.testing.assert_array_equal(charge_levels[day], original_charge_levels(power[day], capacities[k]))
+        np.testing.assert_array_equal(discharge_levels[day], original_discharge_levels(power[day], capacities[k]))
+
+
+def test_day_matrix_store_matches_local_days(tmp_path):
+    # Spring (92 rows) and autumn (100 rows) DST days in the padded (days, 100) layout
+    rng = np.random.default_rng(4)
+    data = pd.concat([make_data(n_weeks=2), make_data(n_weeks=2).assign(datetime=lambda df: df['datetime'] + pd.Timedelta(days=224))], ignore_index=True)
+    data['Power_Output_kWh'] = rng.uniform(0, 1, len(data))
+    data['Volume_Afname_kWh'] = rng.uniform(0, 1, len(data))
+    write_day_matrix_store(data, str(tmp_path / 'days'))
+    matrices, index = open_day_matrix_store(str(tmp_path / 'days'))
+
+    assert not matrices['Euro'].flags.writeable and matrices['Euro'].shape == (index['days'], 100)
+    for a, b in zip(store_segments(index), local_day_segments(data['datetime'])):
+        np.testing.assert_array_equal(a, b)
+    assert {92, 96, 100} <= set((np.asarray(index['rows']) >= 0).sum(axis=1))
+    np.testing.assert_array_equal(from_day_matrix(matrices['Euro'], np.asarray(index['rows'])), data['Euro'].values.astype(np.float32))
+
+    expected = charge_intervals(5.0, data)
+    result = charge_intervals(5.0, data, store=(matrices, index))
+    for a, b in zip(expected, result):
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize('grid_charging', [False, True])
+def test_ev_fleet_backends_agree(grid_charging):
+    rng = np.random.default_rng(2)
+    n_intervals = 7 * 96
+    slot = np.arange(n_intervals) % 96
+    away = (slot >= 32) & (slot <= 72)
+    power_surplus = rng.normal(0, 0.5, n_intervals)
+    args = (power_surplus, np.tile(~away, (3, 1)), np.tile(away * 0.2, (3, 1)), [40.0, 60.0, 75.0], [2.3, 7.4, 11.0])
+    expected = simulate_ev_fleet(*args, initial_soc=0.5, site_limit_kw=10.0, grid_charging=grid_charging, backend='numpy')
+    for backend in BACKENDS:
+        result = simulate_ev_fleet(*args, initial_soc=0.5, site_limit_kw=10.0, grid_charging=grid_charging, backend=backend)
+        # The NumPy loop sums the requests of the vehicles with np.sum, so the last digits can differ
+        for a, b in zip(expected, result):
+            np.testing.assert_allclose(a, b, rtol=0, atol=1e-12)
+
+
+@pytest.mark.skipif(not HAVE_NUMBA, reason='needs numba')
+def test_storage_flow_backends_agree():
+    rng = np.random.default_rng(3)
+    n_intervals = 2000
+    flow = flow_arrays(rng.normal(60, 40, n_intervals), rng.normal(0, 3, n_intervals), 5.0, 5.0)
+    expected = storage_flow(*flow, n_intervals, 5.0, 5.0, 0.0, 10.0, 1, backend='python')
+    result = storage_flow(*flow, n_intervals, 5.0, 5.0, 0.0, 10.0, 1, backend='numba')
+    np.testing.assert_array_equal(expected[0], result[0])
+    assert expected[1] == result[1]